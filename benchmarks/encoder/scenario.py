@@ -1,6 +1,10 @@
+import threading
+
 import bm
 import utils
 
+from ddtrace.internal._encoding import BufferFull
+
 
 class Encoder(bm.Scenario):
     ntraces = bm.var(type=int)
@@ -10,10 +14,50 @@ class Encoder(bm.Scenario):
     nmetrics = bm.var(type=int)
     dd_origin = bm.var_bool()
     encoding = bm.var(type=str)
+    concurrent_flush = bm.var_bool()
+    hot_strings = bm.var(type=int)
+    warm_string_table = bm.var_bool()
 
     def run(self):
-        encoder = utils.init_encoder(self.encoding)
         traces = utils.gen_traces(self)
+        if self.encoding == "v0.5":
+            encoder = utils.init_encoder(self.encoding, hot_strings=self.hot_strings)
+        else:
+            encoder = utils.init_encoder(self.encoding)
+
+        if self.warm_string_table:
+            # Let the frequently used strings stay in the string table
+            for _ in range(2):
+                for trace in traces:
+                    encoder.put(trace)
+                    encoder.encode()
+
+        if self.concurrent_flush:
+            # Only time the put() calls while a background thread keeps
+            # flushing the encoder, as the writer's periodic thread does.
+            stop = threading.Event()
+
+            def flush():
+                while not stop.is_set():
+                    encoder.encode()
+
+            flusher = threading.Thread(target=flush)
+            flusher.start()
+
+            def _(loops):
+                for _ in range(loops):
+                    for trace in traces:
+                        try:
+                            encoder.put(trace)
+                        except BufferFull:
+                            # The writer would drop the trace
+                            pass
+
+            yield _
+
+            stop.set()
+            flusher.join()
+            return
 
         def _(loops):
             for _ in range(loops):
@@ -18,8 +18,16 @@ try:
     # see https://github.com/DataDog/dd-trace-py/pull/2422
     from ddtrace.internal._encoding import BufferedEncoder  # noqa: F401
 
-    def init_encoder(encoding, max_size=8 << 20, max_item_size=8 << 20):
-        return MSGPACK_ENCODERS[encoding](max_size, max_item_size)
+    def init_encoder(encoding, max_size=8 << 20, max_item_size=8 << 20, **kwargs):
+        if encoding == "otlp":
+            from ddtrace.internal.encoding import OTLPEncoder
+
+            return OTLPEncoder(max_size, max_item_size)
+        try:
+            return MSGPACK_ENCODERS[encoding](max_size, max_item_size, **kwargs)
+        except TypeError:
+            # encoder options are not supported by this version
+            return MSGPACK_ENCODERS[encoding](max_size, max_item_size)
 
 
 except ImportError:
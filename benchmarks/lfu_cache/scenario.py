@@ -0,0 +1,52 @@
+import itertools
+import random
+
+import bm
+
+from ddtrace.internal.utils.cache import LFUCache
+
+
+def uniform_keys(nkeys, n):
+    """Every key is as likely to be accessed"""
+    return [random.randrange(nkeys) for _ in range(n)]
+
+
+def zipfian_keys(nkeys, n):
+    """The k-th most accessed key is accessed about 1/k times as often as the first one"""
+    weights = list(itertools.accumulate(1.0 / (k + 1) for k in range(nkeys)))
+    return random.choices(range(nkeys), cum_weights=weights, k=n)
+
+
+def scan_keys(nkeys, n):
+    """Accesses to a few hot keys interleaved with a scan of keys accessed only once"""
+    hot = max(nkeys // 100, 1)
+    return [random.randrange(hot) if i % 2 else hot + i for i in range(n)]
+
+
+PATTERNS = {
+    "uniform": uniform_keys,
+    "zipfian": zipfian_keys,
+    "scan": scan_keys,
+}
+
+
+class LFUCacheAccess(bm.Scenario):
+    pattern = bm.var(type=str)
+    nkeys = bm.var(type=int)
+    maxsize = bm.var(type=int)
+    naccesses = bm.var(type=int)
+
+    def run(self):
+        random.seed(0)
+        keys = PATTERNS[self.pattern](self.nkeys, self.naccesses)
+
+        def f(key):
+            return key
+
+        def _(loops):
+            for _ in range(loops):
+                cache = LFUCache(self.maxsize)
+                for key in keys:
+                    cache.get(key, f)
+
+        yield _
@@ -0,0 +1,40 @@
+import bm
+
+from ddtrace.filters import TraceFilter
+
+
+class _DropTraces(TraceFilter):
+    def process_trace(self, trace):
+        return
+
+
+class PartialFlush(bm.Scenario):
+    nspans = bm.var(type=int)
+    partial_flush_min_spans = bm.var(type=int)
+    open_spans = bm.var_bool()
+
+    def run(self):
+        from ddtrace import Tracer
+
+        # drop traces rather than encode and send them to an agent
+        tracer = Tracer()
+        tracer.configure(
+            settings={"FILTERS": [_DropTraces()]},
+            partial_flush_enabled=True,
+            partial_flush_min_spans=self.partial_flush_min_spans,
+        )
+
+        def _(loops):
+            for _ in range(loops):
+                with tracer.trace("root") as root:
+                    if self.open_spans:
+                        # All the spans stay open until the last one is
+                        # started, like the tasks of a batch job.
+                        spans = [tracer.start_span("child", child_of=root) for _ in range(self.nspans)]
+                        for span in spans:
+                            span.finish()
+                    else:
+                        for _ in range(self.nspans):
+                            tracer.start_span("child", child_of=root).finish()
+
+        yield _
@@ -8,6 +8,7 @@ class Span(bm.Scenario):
     ltags = bm.var(type=int)
     nmetrics = bm.var(type=int)
     finishspan = bm.var_bool()
+    keepspans = bm.var_bool(default=False)
 
     def run(self):
         # run scenario to also set tags on spans
@@ -21,8 +22,13 @@ class Span(bm.Scenario):
         # run scenario to include finishing spans
         finishspan = self.finishspan
 
+        # keep the spans of a loop alive until the end of the loop, so that
+        # the peak memory reported by --tracemalloc grows with nspans
+        keepspans = self.keepspans
+
         def _(loops):
             for _ in range(loops):
+                spans = []
                 for i in range(self.nspans):
                     s = utils.gen_span("test." + str(i))
                     if settags:
@@ -31,5 +37,7 @@ class Span(bm.Scenario):
                         s.set_metrics(metrics)
                     if finishspan:
                         s.finish()
+                    if keepspans:
+                        spans.append(s)
 
         yield _
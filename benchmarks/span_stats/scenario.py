@@ -0,0 +1,35 @@
+import bm
+
+from ddtrace.internal._encoding import packb
+from ddtrace.internal.processor.stats import SpanStatsProcessorV06
+from ddtrace.span import Span
+
+
+class SpanStats(bm.Scenario):
+    nresources = bm.var(type=int)
+    nspans = bm.var(type=int)
+    errors = bm.var_bool()
+
+    def run(self):
+        # The processor is stopped so that stats are only flushed by the benchmark
+        processor = SpanStatsProcessorV06("http://localhost:8126", interval=3600)
+        processor.stop()
+
+        spans = []
+        for i in range(self.nresources):
+            for j in range(self.nspans):
+                span = Span("web.request", service="web", resource="GET /resource/%d" % i, span_type="web")
+                span._local_root = span
+                span.set_tag("http.status_code", 200)
+                span.error = int(self.errors and j % 2 == 0)
+                span.finish()
+                spans.append(span)
+
+        def _(loops):
+            for _ in range(loops):
+                for span in spans:
+                    processor.on_span_finish(span)
+                # Serialize the stats as in periodic(), without sending them
+                packb({u"Stats": processor._serialize_buckets(), u"Hostname": u"host"})
+
+        yield _
@@ -7,15 +7,20 @@ from typing import Optional
 
 import bm
 
+from ddtrace.internal.encoding import MSGPACK_ENCODERS
 from ddtrace.internal.writer import TraceWriter
 from ddtrace.span import Span
 from ddtrace.tracer import Tracer
 
 
 class NoopWriter(TraceWriter):
+    def __init__(self, encode=False):
+        # type: (bool) -> None
+        self._encoder = MSGPACK_ENCODERS["v0.4"](8 << 20, 8 << 20) if encode else None
+
     def recreate(self):
         # type: () -> TraceWriter
-        return NoopWriter()
+        return NoopWriter(self._encoder is not None)
 
     def stop(self, timeout=None):
         # type: (Optional[float]) -> None
@@ -23,18 +28,22 @@ class NoopWriter(TraceWriter):
 
     def write(self, spans=None):
         # type: (Optional[List[Span]]) -> None
-        pass
+        if self._encoder is not None and spans:
+            # Encode the trace like the agent writer does, then drop it
+            self._encoder.put(spans)
+            self._encoder.encode()
 
     def flush_queue(self):
         # type: () -> None
         pass
 
 
-@bm.register
 class Threading(bm.Scenario):
     nthreads = bm.var(type=int)
     ntraces = bm.var(type=int)
     nspans = bm.var(type=int)
+    encode = bm.var_bool()
+    compute_stats = bm.var_bool()
 
     def create_trace(self, tracer):
         # type: (Tracer) -> None
@@ -49,14 +58,21 @@ class Threading(bm.Scenario):
         from ddtrace import tracer
 
         # configure global tracer to drop traces rather
-        tracer.configure(writer=NoopWriter())
+        tracer.configure(writer=NoopWriter(self.encode), compute_stats_enabled=self.compute_stats)
+
+        # The workers are started before timing so that only the creation
+        # and processing of spans are measured.
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.nthreads)
+        for task in [executor.submit(random.random) for _ in range(self.nthreads)]:
+            task.result()
 
         def _(loops):
             # type: (int) -> None
             for _ in range(loops):
-                with concurrent.futures.ThreadPoolExecutor(max_workers=self.nthreads) as executor:
-                    tasks = {executor.submit(self.create_trace, tracer) for i in range(self.ntraces)}
-                    for task in concurrent.futures.as_completed(tasks):
-                        task.result()
+                tasks = {executor.submit(self.create_trace, tracer) for i in range(self.ntraces)}
+                for task in concurrent.futures.as_completed(tasks):
+                    task.result()
 
         yield _
+
+        executor.shutdown()
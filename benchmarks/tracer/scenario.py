@@ -10,12 +10,16 @@ class _DropTraces(TraceFilter):
 
 class Tracer(bm.Scenario):
     depth = bm.var(type=int)
+    traceid128 = bm.var_bool(default=False)
 
     def run(self):
         # configure global tracer to drop traces rather than encoded and sent to
         # an agent
+        from ddtrace import config
         from ddtrace import tracer
 
+        config._128_bit_trace_id_enabled = self.traceid128
+
         tracer.configure(settings={"FILTERS": [_DropTraces()]})
 
         def _(loops):
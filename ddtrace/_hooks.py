@@ -108,6 +108,21 @@ class Hooks(object):
             except KeyError:
                 pass
 
+    def has(
+        self,
+        hook,  # type: Any
+    ):
+        # type: (...) -> bool
+        """
+        Function used to check whether any function is registered for a hook
+
+        :param hook: The hook to check
+        :type hook: object
+        :returns: Whether at least one function is registered for the hook
+        :rtype: bool
+        """
+        return bool(self._hooks.get(hook))
+
     def emit(
         self,
         hook,  # type: Any
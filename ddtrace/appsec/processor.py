@@ -115,6 +115,9 @@ def _get_waf_timeout():
 @attr.s(eq=False)
 class AppSecSpanProcessor(SpanProcessor):
 
+    # The WAF runs on the request span as soon as it finishes
+    inline = True
+
     rules = attr.ib(type=str, factory=get_rules)
     _ddwaf = attr.ib(type=DDWaf, default=None)
     _addresses_to_keep = attr.ib(type=Set[str], factory=set)
@@ -70,8 +70,14 @@ class Context(object):
     def _update_tags(self, span):
         # type: (Span) -> None
         with self._lock:
-            span._meta.update(self._meta)
-            span._metrics.update(self._metrics)
+            if self._meta:
+                if span._meta is None:
+                    span._meta = {}
+                span._meta.update(self._meta)
+            if self._metrics:
+                if span._metrics is None:
+                    span._metrics = {}
+                span._metrics.update(self._metrics)
 
     @property
     def sampling_priority(self):
@@ -56,8 +56,8 @@ class WrappedClientResponseContentProxy(wrapt.ObjectProxy):
             # inherit parent attributes
             span.resource = self._self_parent_span.resource
             span.span_type = self._self_parent_span.span_type
-            span._meta = dict(self._self_parent_span._meta)
-            span._metrics = dict(self._self_parent_span.metrics)
+            span._meta = self._self_parent_span.get_tags()
+            span._metrics = self._self_parent_span.get_metrics()
 
             result = await self.__wrapped__.read(*args, **kwargs)
             span.set_tag("Length", len(result))
@@ -335,7 +335,7 @@ def traced_get_response(django, pin, func, instance, args, kwargs):
         span_type=SpanTypes.WEB,
     ) as span:
         utils._before_request_tags(pin, span, request)
-        span._metrics[SPAN_MEASURED_KEY] = 1
+        span.set_metric(SPAN_MEASURED_KEY, 1)
 
         response = None
         try:
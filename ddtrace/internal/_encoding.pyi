@@ -1,12 +1,16 @@
 from typing import Any
 from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 from ddtrace.span import Span
 
 Trace = List[Span]
 
+class PackedBuffer(object):
+    def __len__(self) -> int: ...
+
 class ListStringTable(object):
     def index(self, string: str) -> int: ...
 
@@ -33,9 +37,22 @@ class ListBufferedEncoder(BufferedEncoder):
 class MsgpackEncoderBase(BufferedEncoder):
     content_type: str
     def get_bytes(self) -> bytes: ...
+    def encode_segments(self) -> Optional[List[Union[bytes, memoryview]]]: ...
+    def encode_split(
+        self, max_size: int, max_traces: int
+    ) -> Optional[List[Tuple[List[Union[bytes, memoryview]], int]]]: ...
     def _decode(self, data: Union[str, bytes]) -> Any: ...
 
 class MsgpackEncoderV03(MsgpackEncoderBase): ...
-class MsgpackEncoderV05(MsgpackEncoderBase): ...
+
+class MsgpackEncoderV05(MsgpackEncoderBase):
+    def __init__(self, max_size: int, max_item_size: int, hot_strings: int = ...) -> None: ...
+
+class OTLPEncoder(BufferedEncoder):
+    content_type: str
+    def encode_segments(self) -> Optional[List[Union[bytes, memoryview]]]: ...
+    def encode_split(
+        self, max_size: int, max_traces: int
+    ) -> Optional[List[Tuple[List[Union[bytes, memoryview]], int]]]: ...
 
 def packb(o: Any, **kwargs) -> bytes: ...
@@ -1,20 +1,45 @@
 from cpython cimport *
 from cpython.bytearray cimport PyByteArray_CheckExact
 from libc cimport stdint
+from libc.string cimport memcpy
+from libc.string cimport memmove
+from libc.string cimport memset
 from libc.string cimport strlen
+from operator import itemgetter
 import threading
+from types import MemberDescriptorType
 from ._utils cimport PyBytesLike_Check
 
+from ddtrace.constants import ERROR_MSG
 from ddtrace.constants import ORIGIN_KEY
+from ddtrace.constants import SPAN_KIND
+from ddtrace.internal.constants import HIGHER_ORDER_TRACE_ID_BITS
+from ddtrace.internal.utils.cache import LFUCache
 
 
 DEF MSGPACK_ARRAY_LENGTH_PREFIX_SIZE = 5
 DEF MSGPACK_STRING_TABLE_LENGTH_PREFIX_SIZE = 6
+DEF MSGPACK_STRING_TABLE_HOT_STRINGS = 256
+DEF MSGPACK_STRING_TABLE_HOT_STRINGS_PERIOD = 32
+DEF MSGPACK_STRING_TABLE_HOT_STRINGS_WINDOW = 4
+DEF MSGPACK_STRING_TABLE_HOT_STRINGS_MIN_SAMPLES = 3
+
+# Protobuf wire types
+DEF PB_VARINT = 0
+DEF PB_FIXED64 = 1
+DEF PB_LEN = 2
 
 
 cdef extern from "Python.h":
     const char* PyUnicode_AsUTF8(object o)
 
+cdef extern from "structmember.h":
+    ctypedef struct PyMemberDef:
+        Py_ssize_t offset
+
+    ctypedef struct PyMemberDescrObject:
+        PyMemberDef *d_member
+
 cdef extern from "pack.h":
     struct msgpack_packer:
         char* buf
@@ -38,6 +63,7 @@ cdef extern from "pack.h":
     int msgpack_pack_int64(msgpack_packer* pk, stdint.int64_t d)
     int msgpack_pack_true(msgpack_packer* pk)
     int msgpack_pack_false(msgpack_packer* pk)
+    int msgpack_pack_write(msgpack_packer* pk, const char *data, size_t l)
 
 
 cdef long long ITEM_LIMIT = (2**32)-1
@@ -55,6 +81,60 @@ class BufferItemTooLarge(Exception):
     pass
 
 
+cdef class PackedBuffer(object):
+    """Read-only buffer of packed data.
+
+    The memory is taken over from a packer, so that payloads can be handed to
+    socket writes through memoryviews without being copied. It is released
+    when the last view on the buffer goes away.
+    """
+
+    cdef char *buf
+    cdef Py_ssize_t length
+
+    def __dealloc__(self):
+        PyMem_Free(self.buf)
+        self.buf = NULL
+
+    def __len__(self):
+        return self.length
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        PyBuffer_FillInfo(buffer, self, self.buf, self.length, 1, flags)
+
+
+cdef PackedBuffer detach_buffer(msgpack_packer *pk, size_t keep):
+    """Take over the buffer of a packer and give it a new one.
+
+    The new buffer has the same capacity, so that the packer does not grow it
+    again, and starts with a copy of the first ``keep`` bytes.
+    """
+    cdef PackedBuffer packed
+    cdef char *buf = <char*> PyMem_Malloc(pk.buf_size)
+
+    if buf == NULL:
+        raise MemoryError("Unable to allocate internal buffer.")
+    if keep:
+        memcpy(buf, pk.buf, keep)
+
+    packed = PackedBuffer.__new__(PackedBuffer)
+    packed.buf = pk.buf
+    packed.length = pk.length
+    pk.buf = buf
+    return packed
+
+
+cdef bytes array_header(stdint.uint32_t l):
+    cdef char buf[MSGPACK_ARRAY_LENGTH_PREFIX_SIZE]
+    cdef msgpack_packer pk
+
+    pk.buf = buf
+    pk.length = 0
+    pk.buf_size = MSGPACK_ARRAY_LENGTH_PREFIX_SIZE
+    msgpack_pack_array(&pk, l)
+    return PyBytes_FromStringAndSize(buf, pk.length)
+
+
 cdef inline const char * string_to_buff(str s):
     IF PY_MAJOR_VERSION >= 3:
         return PyUnicode_AsUTF8(s)
@@ -68,6 +148,113 @@ cdef const char * _ORIGIN_KEY = string_to_buff(ORIGIN_KEY)
 cdef size_t _ORIGIN_KEY_LEN = <size_t> len(ORIGIN_KEY)
 
 
+cdef struct span_slots_t:
+    Py_ssize_t service
+    Py_ssize_t name
+    Py_ssize_t resource
+    Py_ssize_t trace_id
+    Py_ssize_t span_id
+    Py_ssize_t parent_id
+    Py_ssize_t start_ns
+    Py_ssize_t duration_ns
+    Py_ssize_t error
+    Py_ssize_t span_type
+    Py_ssize_t meta
+    Py_ssize_t metrics
+
+
+cdef span_slots_t SPAN_SLOTS
+# The Span class, once its slots have been looked up
+cdef PyTypeObject *SPAN_TYPE = NULL
+cdef bint SPAN_SLOTS_INITIALIZED = False
+
+
+cdef Py_ssize_t span_slot_offset(object span_class, str name):
+    """Return the offset of a slot in the Span object structure, or 0 if it is not a slot."""
+    descr = span_class.__dict__.get(name)
+    if not isinstance(descr, MemberDescriptorType):
+        return 0
+    return (<PyMemberDescrObject *> descr).d_member.offset
+
+
+cdef init_span_slots():
+    """Look up the slots of the Span class.
+
+    This cannot be done when the module is imported, as ddtrace.span
+    indirectly depends on it.
+    """
+    global SPAN_TYPE, SPAN_SLOTS_INITIALIZED
+    from ddtrace.span import Span
+
+    SPAN_SLOTS_INITIALIZED = True
+    SPAN_SLOTS.service = span_slot_offset(Span, "service")
+    SPAN_SLOTS.name = span_slot_offset(Span, "name")
+    SPAN_SLOTS.resource = span_slot_offset(Span, "_resource")
+    SPAN_SLOTS.trace_id = span_slot_offset(Span, "trace_id")
+    SPAN_SLOTS.span_id = span_slot_offset(Span, "span_id")
+    SPAN_SLOTS.parent_id = span_slot_offset(Span, "parent_id")
+    SPAN_SLOTS.start_ns = span_slot_offset(Span, "start_ns")
+    SPAN_SLOTS.duration_ns = span_slot_offset(Span, "duration_ns")
+    SPAN_SLOTS.error = span_slot_offset(Span, "error")
+    SPAN_SLOTS.span_type = span_slot_offset(Span, "span_type")
+    SPAN_SLOTS.meta = span_slot_offset(Span, "_meta")
+    SPAN_SLOTS.metrics = span_slot_offset(Span, "_metrics")
+
+    # Spans are only read through their slots if all of them could be found
+    if (
+        SPAN_SLOTS.service and SPAN_SLOTS.name and SPAN_SLOTS.resource and SPAN_SLOTS.trace_id
+        and SPAN_SLOTS.span_id and SPAN_SLOTS.parent_id and SPAN_SLOTS.start_ns and SPAN_SLOTS.duration_ns
+        and SPAN_SLOTS.error and SPAN_SLOTS.span_type and SPAN_SLOTS.meta and SPAN_SLOTS.metrics
+    ):
+        # Span is a module global, so the reference stays valid
+        SPAN_TYPE = <PyTypeObject *> Span
+
+
+cdef inline bint is_plain_span(object span):
+    """Whether the span can be read through the slots of the Span class.
+
+    Subclasses of Span might override the attributes with properties, so they
+    are read with the generic attribute lookup.
+    """
+    return SPAN_TYPE != NULL and Py_TYPE(span) == SPAN_TYPE
+
+
+cdef inline object span_get(object span, bint plain, Py_ssize_t offset, str name):
+    """Get a span attribute, reading its slot directly for plain spans."""
+    cdef PyObject *value
+
+    if plain:
+        value = (<PyObject **> ((<char *> <PyObject *> span) + offset))[0]
+        if value != NULL:
+            return <object> value
+    # Let the generic lookup raise if the attribute is not set
+    return getattr(span, name)
+
+
+cdef inline object span_resource(object span, bint plain):
+    """Get the span resource, which plain spans store in the ``_resource`` slot."""
+    if plain:
+        return span_get(span, plain, SPAN_SLOTS.resource, "_resource")
+    return span.resource
+
+
+# Shared by the spans that have no tags or metrics, which must not be modified
+cdef dict NO_ITEMS = {}
+
+
+cdef inline object span_items(object span, bint plain, Py_ssize_t offset, str name):
+    """Get the meta or metrics of a span, which are not allocated until the first item is set."""
+    cdef object items = span_get(span, plain, offset, name)
+    return NO_ITEMS if items is None else items
+
+
+cdef inline int check_dict_size(dict d, Py_ssize_t size) except -1:
+    """Make sure that a dict did not change size while it was packed, as its map header was already packed."""
+    if PyDict_Size(d) != size:
+        raise RuntimeError("dictionary changed size during iteration")
+    return 0
+
+
 cdef inline int array_prefix_size(stdint.uint32_t l):
     if l < 16:
         return 1
@@ -115,6 +302,14 @@ cdef inline int pack_text(msgpack_packer *pk, object text) except? -1:
     if text is None:
         return msgpack_pack_nil(pk)
 
+    IF PY_MAJOR_VERSION >= 3:
+        # Most of the strings are plain str objects
+        if PyUnicode_CheckExact(text):
+            ret = msgpack_pack_unicode(pk, text, ITEM_LIMIT)
+            if ret == -2:
+                raise ValueError("unicode string is too large")
+            return ret
+
     if PyBytesLike_Check(text):
         L = len(text)
         if L > ITEM_LIMIT:
@@ -145,6 +340,10 @@ cdef inline int pack_text(msgpack_packer *pk, object text) except? -1:
 cdef class StringTable(object):
     cdef dict _table
     cdef stdint.uint32_t _next_id
+    # Number of strings the table has been seeded with on reset, and whether
+    # they have been looked up since.
+    cdef stdint.uint32_t _seeded
+    cdef unsigned char *_used
 
     def __init__(self):
         self._table = {"": 0}
@@ -156,12 +355,17 @@ cdef class StringTable(object):
 
     cdef stdint.uint32_t _index(self, object string):
         cdef stdint.uint32_t _id
+        cdef PyObject *value
 
         if string is None:
             return 0
 
-        if PyDict_Contains(self._table, string):
-            return PyLong_AsLong(<object>PyDict_GetItem(self._table, string))
+        value = PyDict_GetItem(self._table, string)
+        if value != NULL:
+            _id = PyLong_AsLong(<object> value)
+            if _id < self._seeded:
+                self._used[_id] = 1
+            return _id
 
         _id = self._next_id
         PyDict_SetItem(self._table, string, PyLong_FromLong(_id))
@@ -199,6 +403,138 @@ cdef class ListStringTable(StringTable):
         return iter(self._list)
 
 
+cdef bytes pack_string(object string):
+    cdef msgpack_packer pk
+    cdef int ret
+
+    pk.buf_size = len(string) + 5
+    pk.buf = <char*> PyMem_Malloc(pk.buf_size)
+    if pk.buf == NULL:
+        raise MemoryError("Unable to allocate string buffer.")
+    pk.length = 0
+    try:
+        ret = pack_text(&pk, string)
+        if ret != 0:
+            raise RuntimeError("Failed to pack string")
+        return PyBytes_FromStringAndSize(pk.buf, pk.length)
+    finally:
+        PyMem_Free(pk.buf)
+
+
+cdef class HotStrings(object):
+    """Strings that string tables keep across flushes.
+
+    Every ``period`` flushes, the strings that had to be inserted in the
+    flushed table are counted in an LFU cache. Those that show up in most of
+    these sampled payloads become hot: they are inserted up front in the
+    tables as they are reset, so that they do not need to be inserted and
+    packed again in the next payloads. As every payload carries the whole
+    table, hot strings that have been used in less than half of the payloads
+    of a period are dropped.
+    """
+
+    cdef readonly size_t size
+    cdef readonly size_t period
+    cdef size_t _flushes
+    cdef size_t _samples
+    cdef object _counts
+    cdef bytes _base_block
+    cdef list strings
+    cdef list _packed
+    cdef dict table
+    cdef bytes block
+    # Number of payloads that used each hot string during the current period
+    cdef stdint.uint16_t *_hits
+
+    def __cinit__(self, size_t size, size_t period=MSGPACK_STRING_TABLE_HOT_STRINGS_PERIOD):
+        self._hits = <stdint.uint16_t*> PyMem_Malloc((size or 1) * sizeof(stdint.uint16_t))
+        if self._hits == NULL:
+            raise MemoryError("Unable to allocate internal buffer.")
+        memset(self._hits, 0, size * sizeof(stdint.uint16_t))
+
+    def __init__(self, size_t size, size_t period=MSGPACK_STRING_TABLE_HOT_STRINGS_PERIOD):
+        self.size = size
+        self.period = min(period or 1, 1 << 15)
+        self._flushes = 0
+        self._samples = 0
+        self._counts = LFUCache(maxsize=size << 2 or 1)
+        # The empty string and the origin key are always in the tables
+        self._base_block = pack_string("") + pack_string(ORIGIN_KEY)
+        self.strings = []
+        self._packed = []
+        self.table = {"": 0, ORIGIN_KEY: 1}
+        self.block = self._base_block
+
+    def __dealloc__(self):
+        PyMem_Free(self._hits)
+        self._hits = NULL
+
+    cdef update(self, MsgpackStringTable st):
+        cdef dict table
+        cdef list strings
+        cdef list packed
+        cdef list candidates
+        cdef size_t i
+        cdef size_t n = len(self.strings)
+        cdef bint changed
+
+        if st._seeded_strings is self.strings:
+            for i in range(n):
+                if st._used[i + 2]:
+                    self._hits[i] += 1
+
+        self._flushes += 1
+        if self._flushes % self.period:
+            return
+
+        # Keep the hot strings that have been used often enough during the
+        # period. The others have to become hot again to be kept.
+        counts = self._counts
+        table = {"": 0, ORIGIN_KEY: 1}
+        strings = []
+        packed = []
+        for i in range(n):
+            if self._hits[i] >= self.period >> 1:
+                table[self.strings[i]] = len(table)
+                strings.append(self.strings[i])
+                packed.append(self._packed[i])
+        changed = len(packed) != n
+        memset(self._hits, 0, self.size * sizeof(stdint.uint16_t))
+
+        # Strings are inserted in the order in which they are first used, so
+        # the frequently used ones come first. Only count a quarter of the
+        # free slots, to bound the work done on flush.
+        candidates = []
+        for string in st._inserted[:(self.size - len(packed) + 3) >> 2]:
+            if string in table:
+                continue
+            value = counts.get(string, pack_string)
+            count = counts[string][1]
+            if count >= MSGPACK_STRING_TABLE_HOT_STRINGS_MIN_SAMPLES:
+                candidates.append((count, string, value))
+
+        # Only count the samples of the current window
+        self._samples += 1
+        if self._samples % MSGPACK_STRING_TABLE_HOT_STRINGS_WINDOW == 0:
+            counts.clear()
+
+        if candidates:
+            candidates.sort(key=itemgetter(0), reverse=True)
+            for _, string, value in candidates[:self.size - len(packed)]:
+                table[string] = len(table)
+                strings.append(string)
+                packed.append(value)
+            changed = True
+
+        if not changed:
+            return
+
+        self.table = table
+        self.strings = strings
+        self._packed = packed
+        self.block = b"".join([self._base_block] + packed)
+
+
 cdef class MsgpackStringTable(StringTable):
     cdef msgpack_packer pk
     cdef int max_size
@@ -206,8 +542,13 @@ cdef class MsgpackStringTable(StringTable):
     cdef stdint.uint32_t _sp_id
     cdef object _lock
     cdef size_t _reset_size
+    cdef HotStrings _hot
+    # The hot strings the table has been reset with, and the strings that
+    # have been inserted since (up to the number of hot strings).
+    cdef list _seeded_strings
+    cdef list _inserted
 
-    def __init__(self, max_size):
+    def __init__(self, max_size, HotStrings hot=None):
         self.pk.buf_size = min(max_size, 1 << 20)
         self.pk.buf = <char*> PyMem_Malloc(self.pk.buf_size)
         if self.pk.buf == NULL:
@@ -216,14 +557,25 @@ cdef class MsgpackStringTable(StringTable):
         self.pk.length = MSGPACK_STRING_TABLE_LENGTH_PREFIX_SIZE
         self._sp_len = 0
         self._lock = threading.RLock()
+        self._hot = hot
+        self._seeded = 0
+        self._seeded_strings = []
+        self._inserted = []
+        if hot is not None:
+            self._used = <unsigned char*> PyMem_Malloc(hot.size + 2)
+            if self._used == NULL:
+                raise MemoryError("Unable to allocate internal buffer.")
         super(MsgpackStringTable, self).__init__()
 
         assert self.index(ORIGIN_KEY) == 1
         self._reset_size = self.pk.length
+        del self._inserted[:]
 
     def __dealloc__(self):
         PyMem_Free(self.pk.buf)
         self.pk.buf = NULL
+        PyMem_Free(self._used)
+        self._used = NULL
 
     cdef insert(self, object string):
         cdef int ret
@@ -239,6 +591,9 @@ cdef class MsgpackStringTable(StringTable):
         if ret != 0:
             raise RuntimeError("Failed to add string to msgpack string table")
 
+        if self._hot is not None and len(self._inserted) < self._hot.size:
+            self._inserted.append(string)
+
     cdef savepoint(self):
         self._sp_len = self.pk.length
         self._sp_id = self._next_id
@@ -247,28 +602,56 @@ cdef class MsgpackStringTable(StringTable):
         if self._sp_len > 0:
             self.pk.length = self._sp_len
             self._next_id = self._sp_id
-
-    cdef get_bytes(self):
+            # Forget the strings inserted since the savepoint, so that their
+            # ids are not handed out again for other strings.
+            for string, _id in list(self._table.items()):
+                if _id >= self._sp_id:
+                    PyDict_DelItem(self._table, string)
+            if self._hot is not None:
+                self._inserted = [s for s in self._inserted if s in self._table]
+
+    cdef int _update_prefix(self) except -1:
+        """Update the table and root array size prefixes and return the offset of the data."""
         cdef int ret;
         cdef stdint.uint32_t l = self._next_id
         cdef int offset = MSGPACK_STRING_TABLE_LENGTH_PREFIX_SIZE - array_prefix_size(l)
         cdef int old_pos = self.pk.length
-        
+
+        # Update table size prefix
+        self.pk.length = offset
+        ret = msgpack_pack_array(&self.pk, l)
+        if ret:
+            return -1
+        # Add root array size prefix
+        self.pk.length = offset = offset - 1
+        ret = msgpack_pack_array(&self.pk, 2)
+        if ret:
+            return -1
+        self.pk.length = old_pos
+        return offset
+
+    cdef get_bytes(self):
+        cdef int offset = 0
+
         with self._lock:
-            # Update table size prefix
-            self.pk.length = offset
-            ret = msgpack_pack_array(&self.pk, l)
-            if ret:
-                return None
-            # Add root array size prefix
-            self.pk.length = offset = offset - 1
-            ret = msgpack_pack_array(&self.pk, 2)
-            if ret:
+            try:
+                offset = self._update_prefix()
+            except Exception:
                 return None
-            self.pk.length = old_pos
-        
+
         return PyBytes_FromStringAndSize(self.pk.buf + offset, self.pk.length - offset)
 
+    cdef detach(self):
+        """Return a view on the table and reset it, without copying its contents."""
+        cdef int offset
+
+        with self._lock:
+            offset = self._update_prefix()
+            try:
+                return memoryview(detach_buffer(&self.pk, self._reset_size))[offset:]
+            finally:
+                self.reset()
+
     @property
     def size(self):
         with self._lock:
@@ -283,12 +666,31 @@ cdef class MsgpackStringTable(StringTable):
                 raise RuntimeError("Failed to append raw bytes to msgpack string table")
 
     cdef reset(self):
-        StringTable.reset(self)
-        assert self._next_id == 1
+        cdef HotStrings hot = self._hot
+        cdef int ret
+
+        if hot is None:
+            StringTable.reset(self)
+            assert self._next_id == 1
+
+            PyDict_SetItem(self._table, ORIGIN_KEY, 1)
+            self._next_id = 2
+            self.pk.length = self._reset_size
+            self._sp_len = 0
+            return
 
-        PyDict_SetItem(self._table, ORIGIN_KEY, 1)
-        self._next_id = 2
-        self.pk.length = self._reset_size
+        # Start over with the hot strings
+        hot.update(self)
+        self._table = PyDict_Copy(hot.table)
+        self._next_id = len(self._table)
+        self.pk.length = MSGPACK_STRING_TABLE_LENGTH_PREFIX_SIZE
+        ret = msgpack_pack_raw_body(&self.pk, <char *> hot.block, len(hot.block))
+        if ret != 0:
+            raise RuntimeError("Failed to reset msgpack string table")
+        self._seeded = self._next_id
+        self._seeded_strings = hot.strings
+        memset(self._used, 0, self._seeded)
+        del self._inserted[:]
         self._sp_len = 0
 
     cpdef flush(self):
@@ -306,7 +708,7 @@ cdef class BufferedEncoder(object):
     cdef public size_t max_item_size
     cdef object _lock
 
-    def __cinit__(self, size_t max_size, size_t max_item_size):
+    def __cinit__(self, size_t max_size, size_t max_item_size, *args, **kwargs):
         self.max_size = max_size
         self.max_item_size = max_item_size
         self._lock = threading.Lock()
@@ -324,7 +726,7 @@ cdef class ListBufferedEncoder(BufferedEncoder):
     cdef list _buffer
     cdef Py_ssize_t _size
 
-    def __cinit__(self, size_t max_size, size_t max_item_size):
+    def __cinit__(self, size_t max_size, size_t max_item_size, *args, **kwargs):
         self._buffer = []
         self._size = 0
 
@@ -371,22 +773,40 @@ cdef class MsgpackEncoderBase(BufferedEncoder):
 
     cdef msgpack_packer pk
     cdef stdint.uint32_t _count
-
-    def __cinit__(self, size_t max_size, size_t max_item_size):
+    # Spare buffer that is swapped with the active one on flush so that
+    # concurrent calls to put() never wait on the serialization of a payload.
+    cdef msgpack_packer _flush_pk
+    cdef stdint.uint32_t _flush_count
+    cdef object _flush_lock
+    # Buffer offsets of the end of each trace, used to split payloads
+    cdef list _offsets
+    cdef list _flush_offsets
+
+    def __cinit__(self, size_t max_size, size_t max_item_size, *args, **kwargs):
         cdef int buf_size = 1024*1024
         self.pk.buf = <char*> PyMem_Malloc(buf_size)
         if self.pk.buf == NULL:
             raise MemoryError("Unable to allocate internal buffer.")
+        self._flush_pk.buf = <char*> PyMem_Malloc(buf_size)
+        if self._flush_pk.buf == NULL:
+            raise MemoryError("Unable to allocate internal buffer.")
 
         self.max_size = max_size
         self.pk.buf_size = buf_size
+        self._flush_pk.buf_size = buf_size
         self.max_item_size = max_item_size if max_item_size < max_size else max_size
         self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._offsets = []
+        self._flush_offsets = []
         self._reset_buffer()
+        self._reset_flush_buffer()
 
     def __dealloc__(self):
         PyMem_Free(self.pk.buf)
         self.pk.buf = NULL
+        PyMem_Free(self._flush_pk.buf)
+        self._flush_pk.buf = NULL
 
     def __len__(self):  # TODO: Use a better name?
         return self._count
@@ -400,34 +820,140 @@ cdef class MsgpackEncoderBase(BufferedEncoder):
     cdef _reset_buffer(self):
         self._count = 0
         self.pk.length = MSGPACK_ARRAY_LENGTH_PREFIX_SIZE  # Leave room for array length prefix
+        del self._offsets[:]
+
+    cdef _reset_flush_buffer(self):
+        self._flush_count = 0
+        self._flush_pk.length = MSGPACK_ARRAY_LENGTH_PREFIX_SIZE  # Leave room for array length prefix
+        del self._flush_offsets[:]
+
+    cdef _swap_buffers(self):
+        """Make the spare buffer the active one.
+
+        This must be called with the buffer lock held. The traces collected so
+        far are then available from the flush buffer, which can be serialized
+        without holding the buffer lock.
+        """
+        cdef msgpack_packer pk = self.pk
+
+        self.pk = self._flush_pk
+        self._flush_pk = pk
+        self._flush_count = self._count
+        self._offsets, self._flush_offsets = self._flush_offsets, self._offsets
+        self._reset_buffer()
 
     cpdef encode(self):
-        with self._lock:
-            if not self._count:
-                return None
+        with self._flush_lock:
+            with self._lock:
+                if not self._count:
+                    return None
+
+                self._swap_buffers()
 
-            return self.flush()
+            try:
+                return self._serialize()
+            finally:
+                self._reset_flush_buffer()
+
+    cpdef encode_segments(self):
+        """Encode the buffered traces without copying them.
+
+        Return the payload as a list of buffers to be sent one after the
+        other, or ``None`` if there are no traces.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._count:
+                    return None
+
+                self._swap_buffers()
+
+            try:
+                return self._serialize_segments()
+            finally:
+                self._reset_flush_buffer()
+
+    cpdef encode_split(self, size_t max_size, stdint.uint32_t max_traces):
+        """Encode the buffered traces into several payloads without copying them.
+
+        Each payload holds at most ``max_traces`` traces (if non-zero) and is
+        at most ``max_size`` bytes, unless a single trace is larger than that.
+        Return a list of ``(segments, n_traces)`` pairs, where ``segments`` is
+        the list of buffers making up the payload, or ``None`` if there are no
+        traces.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._count:
+                    return None
+
+                self._swap_buffers()
+
+            try:
+                return self._serialize_split(max_size, max_traces)
+            finally:
+                self._reset_flush_buffer()
+
+    cdef detach_flush_buffer(self):
+        """Return a view on the traces array of the flush buffer.
+
+        The flush buffer is handed over to the view and replaced by a new one.
+        """
+        cdef int offset = self._update_array_len()
+
+        return memoryview(detach_buffer(&self._flush_pk, 0))[offset:]
+
+    cdef list _split_flush_buffer(self, list prefix, size_t max_size, stdint.uint32_t max_traces):
+        """Cut the flush buffer into payloads at trace boundaries.
+
+        Each payload is made of the ``prefix`` segments followed by an array of
+        traces, made of its header and a view on the flush buffer.
+        """
+        cdef list payloads = []
+        cdef size_t start = MSGPACK_ARRAY_LENGTH_PREFIX_SIZE
+        cdef size_t end = start
+        cdef size_t offset
+        cdef stdint.uint32_t count = 0
+        cdef Py_ssize_t prefix_size = sum(len(_) for _ in prefix)
+        cdef object view = memoryview(detach_buffer(&self._flush_pk, 0))
+
+        for o in self._flush_offsets:
+            offset = o
+            if count and (
+                (max_traces and count >= max_traces)
+                or prefix_size + MSGPACK_ARRAY_LENGTH_PREFIX_SIZE + offset - start > max_size
+            ):
+                payloads.append((prefix + [array_header(count), view[start:end]], count))
+                start = end
+                count = 0
+            end = offset
+            count += 1
+
+        payloads.append((prefix + [array_header(count), view[start:end]], count))
+        return payloads
 
     cdef inline int _update_array_len(self):
-        """Update traces array size prefix"""
-        cdef int offset = MSGPACK_ARRAY_LENGTH_PREFIX_SIZE - array_prefix_size(self._count)
-        cdef int old_pos = self.pk.length
+        """Update traces array size prefix of the flush buffer"""
+        cdef int offset = MSGPACK_ARRAY_LENGTH_PREFIX_SIZE - array_prefix_size(self._flush_count)
+        cdef int old_pos = self._flush_pk.length
 
-        with self._lock:
-            self.pk.length = offset
-            msgpack_pack_array(&self.pk, self._count)
-            self.pk.length = old_pos
-            return offset
+        self._flush_pk.length = offset
+        msgpack_pack_array(&self._flush_pk, self._flush_count)
+        self._flush_pk.length = old_pos
+        return offset
 
     cdef get_bytes(self):
-        """Return internal buffer contents as bytes object"""
+        """Return flush buffer contents as bytes object"""
         cdef int offset = self._update_array_len()
-        with self._lock:
-            return PyBytes_FromStringAndSize(self.pk.buf + offset, self.pk.length - offset)
+        return PyBytes_FromStringAndSize(self._flush_pk.buf + offset, self._flush_pk.length - offset)
 
     cdef char * get_buffer(self):
-        """Return internal buffer."""
-        return self.pk.buf + self._update_array_len()
+        """Return flush buffer."""
+        return self._flush_pk.buf + self._update_array_len()
+
+    cdef inline Py_ssize_t get_flush_size(self):
+        """Return the size in bytes of the flush buffer."""
+        return self._flush_pk.length + array_prefix_size(self._flush_count) - MSGPACK_ARRAY_LENGTH_PREFIX_SIZE
 
     cdef void * get_dd_origin_ref(self, str dd_origin):
         raise NotImplementedError()
@@ -457,6 +983,9 @@ cdef class MsgpackEncoderBase(BufferedEncoder):
         """Put a trace (i.e. a list of spans) in the buffer."""
         cdef int ret
 
+        if not SPAN_SLOTS_INITIALIZED:
+            init_span_slots()
+
         with self._lock:
             len_before = self.pk.length
             size_before = self.size
@@ -477,6 +1006,7 @@ cdef class MsgpackEncoderBase(BufferedEncoder):
                     raise BufferFull(self.size - size_before)
 
                 self._count += 1
+                self._offsets.append(self.pk.length)
             except:
                 # rollback
                 self.pk.length = len_before
@@ -488,9 +1018,25 @@ cdef class MsgpackEncoderBase(BufferedEncoder):
         with self._lock:
             return self.pk.length + array_prefix_size(self._count) - MSGPACK_ARRAY_LENGTH_PREFIX_SIZE
 
+    cpdef flush(self):
+        with self._flush_lock:
+            with self._lock:
+                self._swap_buffers()
+
+            try:
+                return self._serialize()
+            finally:
+                self._reset_flush_buffer()
+
     # ---- Abstract methods ----
 
-    cpdef flush(self):
+    cdef _serialize(self):
+        raise NotImplementedError()
+
+    cdef _serialize_segments(self):
+        raise NotImplementedError()
+
+    cdef _serialize_split(self, size_t max_size, stdint.uint32_t max_traces):
         raise NotImplementedError()
 
     cdef int pack_span(self, object span, void *dd_origin) except? -1:
@@ -498,36 +1044,40 @@ cdef class MsgpackEncoderBase(BufferedEncoder):
 
 
 cdef class MsgpackEncoderV03(MsgpackEncoderBase):
-    cpdef flush(self):
-        with self._lock:
-            try:
-                return self.get_bytes()
-            finally:
-                self._reset_buffer()
+    cdef _serialize(self):
+        return self.get_bytes()
+
+    cdef _serialize_segments(self):
+        return [self.detach_flush_buffer()]
+
+    cdef _serialize_split(self, size_t max_size, stdint.uint32_t max_traces):
+        return self._split_flush_buffer([], max_size, max_traces)
 
     cdef void * get_dd_origin_ref(self, str dd_origin):
         return string_to_buff(dd_origin)
 
     cdef inline int _pack_meta(self, object meta, char *dd_origin) except? -1:
         cdef Py_ssize_t L
+        cdef Py_ssize_t pos = 0
+        cdef PyObject *k
+        cdef PyObject *v
         cdef int ret
         cdef dict d
 
         if PyDict_CheckExact(meta):
             d = <dict> meta
-            L = len(d)
-            if dd_origin is not NULL:
-                L += 1
-            if L > ITEM_LIMIT:
+            L = PyDict_Size(d)
+            if L + (dd_origin is not NULL) > ITEM_LIMIT:
                 raise ValueError("dict is too large")
 
-            ret = msgpack_pack_map(&self.pk, L)
+            ret = msgpack_pack_map(&self.pk, L + (dd_origin is not NULL))
             if ret == 0:
-                for k, v in d.items():
-                    ret = pack_text(&self.pk, k)
+                while PyDict_Next(d, &pos, &k, &v):
+                    ret = pack_text(&self.pk, <object> k)
                     if ret != 0: break
-                    ret = pack_text(&self.pk, v)
+                    ret = pack_text(&self.pk, <object> v)
                     if ret != 0: break
+                check_dict_size(d, L)
                 if dd_origin is not NULL:
                     ret = pack_bytes(&self.pk, _ORIGIN_KEY, _ORIGIN_KEY_LEN)
                     if ret == 0:
@@ -538,22 +1088,26 @@ cdef class MsgpackEncoderV03(MsgpackEncoderBase):
 
     cdef inline int _pack_metrics(self, object metrics) except? -1:
         cdef Py_ssize_t L
+        cdef Py_ssize_t pos = 0
+        cdef PyObject *k
+        cdef PyObject *v
         cdef int ret
         cdef dict d
 
         if PyDict_CheckExact(metrics):
             d = <dict> metrics
-            L = len(d)
+            L = PyDict_Size(d)
             if L > ITEM_LIMIT:
                 raise ValueError("dict is too large")
 
             ret = msgpack_pack_map(&self.pk, L)
             if ret == 0:
-                for k, v in d.items():
-                    ret = pack_text(&self.pk, k)
+                while PyDict_Next(d, &pos, &k, &v):
+                    ret = pack_text(&self.pk, <object> k)
                     if ret != 0: break
-                    ret = pack_number(&self.pk, v)
+                    ret = pack_number(&self.pk, <object> v)
                     if ret != 0: break
+                check_dict_size(d, L)
             return ret
 
         raise TypeError("Unhandled metrics type: %r" % type(metrics))
@@ -564,12 +1118,19 @@ cdef class MsgpackEncoderV03(MsgpackEncoderBase):
         cdef int has_span_type
         cdef int has_meta
         cdef int has_metrics
+        cdef bint plain = is_plain_span(span)
 
-        has_error = <bint> (span.error != 0)
-        has_span_type = <bint> (span.span_type is not None)
-        has_meta = <bint> (len(span._meta) > 0 or dd_origin is not NULL)
-        has_metrics = <bint> (len(span._metrics) > 0)
-        has_parent_id = <bint> (span.parent_id is not None)
+        error = span_get(span, plain, SPAN_SLOTS.error, "error")
+        span_type = span_get(span, plain, SPAN_SLOTS.span_type, "span_type")
+        meta = span_items(span, plain, SPAN_SLOTS.meta, "_meta")
+        metrics = span_items(span, plain, SPAN_SLOTS.metrics, "_metrics")
+        parent_id = span_get(span, plain, SPAN_SLOTS.parent_id, "parent_id")
+
+        has_error = <bint> (error != 0)
+        has_span_type = <bint> (span_type is not None)
+        has_meta = <bint> (len(meta) > 0 or dd_origin is not NULL)
+        has_metrics = <bint> (len(metrics) > 0)
+        has_parent_id = <bint> (parent_id is not None)
 
         L = 7 + has_span_type + has_meta + has_metrics + has_error + has_parent_id
 
@@ -578,43 +1139,43 @@ cdef class MsgpackEncoderV03(MsgpackEncoderBase):
         if ret == 0:
             ret = pack_bytes(&self.pk, <char *> b"trace_id", 8)
             if ret != 0: return ret
-            ret = pack_number(&self.pk, span.trace_id)
+            ret = pack_number(&self.pk, span_get(span, plain, SPAN_SLOTS.trace_id, "trace_id"))
             if ret != 0: return ret
 
             if has_parent_id:
                 ret = pack_bytes(&self.pk, <char *> b"parent_id", 9)
                 if ret != 0: return ret
-                ret = pack_number(&self.pk, span.parent_id)
+                ret = pack_number(&self.pk, parent_id)
                 if ret != 0: return ret
 
             ret = pack_bytes(&self.pk, <char *> b"span_id", 7)
             if ret != 0: return ret
-            ret = pack_number(&self.pk, span.span_id)
+            ret = pack_number(&self.pk, span_get(span, plain, SPAN_SLOTS.span_id, "span_id"))
             if ret != 0: return ret
 
             ret = pack_bytes(&self.pk, <char *> b"service", 7)
             if ret != 0: return ret
-            ret = pack_text(&self.pk, span.service)
+            ret = pack_text(&self.pk, span_get(span, plain, SPAN_SLOTS.service, "service"))
             if ret != 0: return ret
 
             ret = pack_bytes(&self.pk, <char *> b"resource", 8)
             if ret != 0: return ret
-            ret = pack_text(&self.pk, span.resource)
+            ret = pack_text(&self.pk, span_resource(span, plain))
             if ret != 0: return ret
 
             ret = pack_bytes(&self.pk, <char *> b"name", 4)
             if ret != 0: return ret
-            ret = pack_text(&self.pk, span.name)
+            ret = pack_text(&self.pk, span_get(span, plain, SPAN_SLOTS.name, "name"))
             if ret != 0: return ret
 
             ret = pack_bytes(&self.pk, <char *> b"start", 5)
             if ret != 0: return ret
-            ret = pack_number(&self.pk, span.start_ns)
+            ret = pack_number(&self.pk, span_get(span, plain, SPAN_SLOTS.start_ns, "start_ns"))
             if ret != 0: return ret
 
             ret = pack_bytes(&self.pk, <char *> b"duration", 8)
             if ret != 0: return ret
-            ret = pack_number(&self.pk, span.duration_ns)
+            ret = pack_number(&self.pk, span_get(span, plain, SPAN_SLOTS.duration_ns, "duration_ns"))
             if ret != 0: return ret
 
             if has_error:
@@ -626,19 +1187,19 @@ cdef class MsgpackEncoderV03(MsgpackEncoderBase):
             if has_span_type:
                 ret = pack_bytes(&self.pk, <char *> b"type", 4)
                 if ret != 0: return ret
-                ret = pack_text(&self.pk, span.span_type)
+                ret = pack_text(&self.pk, span_type)
                 if ret != 0: return ret
 
             if has_meta:
                 ret = pack_bytes(&self.pk, <char *> b"meta", 4)
                 if ret != 0: return ret
-                ret = self._pack_meta(span._meta, <char *> dd_origin)
+                ret = self._pack_meta(meta, <char *> dd_origin)
                 if ret != 0: return ret
 
             if has_metrics:
                 ret = pack_bytes(&self.pk, <char *> b"metrics", 7)
                 if ret != 0: return ret
-                ret = self._pack_metrics(span._metrics)
+                ret = self._pack_metrics(metrics)
                 if ret != 0: return ret
 
         return ret
@@ -646,17 +1207,30 @@ cdef class MsgpackEncoderV03(MsgpackEncoderBase):
 
 cdef class MsgpackEncoderV05(MsgpackEncoderBase):
     cdef MsgpackStringTable _st
+    cdef MsgpackStringTable _flush_st
 
-    def __cinit__(self, size_t max_size, size_t max_item_size):
-        self._st = MsgpackStringTable(max_size)
+    def __cinit__(self, size_t max_size, size_t max_item_size, size_t hot_strings=MSGPACK_STRING_TABLE_HOT_STRINGS):
+        # The hot strings are shared by the two tables used for double buffering
+        cdef HotStrings hot = HotStrings(hot_strings) if hot_strings else None
 
-    cpdef flush(self):
-        with self._lock:
-            try:
-                self._st.append_raw(PyLong_FromLong(<long> self.get_buffer()), <Py_ssize_t> super(MsgpackEncoderV05, self).size)
-                return self._st.flush()
-            finally:
-                self._reset_buffer()
+        self._st = MsgpackStringTable(max_size, hot)
+        self._flush_st = MsgpackStringTable(max_size, hot)
+
+    cdef _swap_buffers(self):
+        MsgpackEncoderBase._swap_buffers(self)
+        self._st, self._flush_st = self._flush_st, self._st
+
+    cdef _serialize(self):
+        self._flush_st.append_raw(PyLong_FromLong(<long> self.get_buffer()), self.get_flush_size())
+        return self._flush_st.flush()
+
+    cdef _serialize_segments(self):
+        # The string table and the traces are sent one after the other
+        return [self._flush_st.detach(), self.detach_flush_buffer()]
+
+    cdef _serialize_split(self, size_t max_size, stdint.uint32_t max_traces):
+        # Every payload carries the whole string table
+        return self._split_flush_buffer([self._flush_st.detach()], max_size, max_traces)
 
     @property
     def size(self):
@@ -679,72 +1253,661 @@ cdef class MsgpackEncoderV05(MsgpackEncoderBase):
     cdef void * get_dd_origin_ref(self, str dd_origin):
         return <void *> PyLong_AsLong(self._st._index(dd_origin))
 
+    cdef inline int _pack_meta(self, object meta, void *dd_origin) except? -1:
+        cdef Py_ssize_t L
+        cdef Py_ssize_t pos = 0
+        cdef PyObject *k
+        cdef PyObject *v
+        cdef int ret
+
+        L = len(meta)
+        ret = msgpack_pack_map(&self.pk, L + (dd_origin is not NULL))
+        if ret != 0: return ret
+        if PyDict_CheckExact(meta):
+            while PyDict_Next(meta, &pos, &k, &v):
+                ret = self._pack_string(<object> k)
+                if ret != 0: return ret
+                ret = self._pack_string(<object> v)
+                if ret != 0: return ret
+            check_dict_size(<dict> meta, L)
+        elif L:
+            for k_, v_ in meta.items():
+                ret = self._pack_string(k_)
+                if ret != 0: return ret
+                ret = self._pack_string(v_)
+                if ret != 0: return ret
+        if dd_origin is not NULL:
+            ret = msgpack_pack_uint32(&self.pk, <stdint.uint32_t> 1)
+            if ret != 0: return ret
+            ret = msgpack_pack_uint32(&self.pk, <stdint.uint32_t> dd_origin)
+        return ret
+
+    cdef inline int _pack_metrics(self, object metrics) except? -1:
+        cdef Py_ssize_t L
+        cdef Py_ssize_t pos = 0
+        cdef PyObject *k
+        cdef PyObject *v
+        cdef int ret
+
+        L = len(metrics)
+        ret = msgpack_pack_map(&self.pk, L)
+        if ret != 0: return ret
+        if PyDict_CheckExact(metrics):
+            while PyDict_Next(metrics, &pos, &k, &v):
+                ret = self._pack_string(<object> k)
+                if ret != 0: return ret
+                ret = pack_number(&self.pk, <object> v)
+                if ret != 0: return ret
+            check_dict_size(<dict> metrics, L)
+        elif L:
+            for k_, v_ in metrics.items():
+                ret = self._pack_string(k_)
+                if ret != 0: return ret
+                ret = pack_number(&self.pk, v_)
+                if ret != 0: return ret
+        return ret
+
     cdef int pack_span(self, object span, void *dd_origin) except? -1:
         cdef int ret
+        cdef bint plain = is_plain_span(span)
 
         ret = msgpack_pack_array(&self.pk, 12)
         if ret != 0: return ret
 
-        ret = self._pack_string(span.service)
+        ret = self._pack_string(span_get(span, plain, SPAN_SLOTS.service, "service"))
         if ret != 0: return ret
-        ret = self._pack_string(span.name)
+        ret = self._pack_string(span_get(span, plain, SPAN_SLOTS.name, "name"))
         if ret != 0: return ret
-        ret = self._pack_string(span.resource)
+        ret = self._pack_string(span_resource(span, plain))
         if ret != 0: return ret
 
-        _ = span.trace_id
+        _ = span_get(span, plain, SPAN_SLOTS.trace_id, "trace_id")
         ret = msgpack_pack_uint64(&self.pk, _ if _ is not None else 0)
         if ret != 0: return ret
-        
-        _ = span.span_id
+
+        _ = span_get(span, plain, SPAN_SLOTS.span_id, "span_id")
         ret = msgpack_pack_uint64(&self.pk, _ if _ is not None else 0)
         if ret != 0: return ret
-        
-        _ = span.parent_id
+
+        _ = span_get(span, plain, SPAN_SLOTS.parent_id, "parent_id")
         ret = msgpack_pack_uint64(&self.pk, _ if _ is not None else 0)
         if ret != 0: return ret
-        
-        _ = span.start_ns
+
+        _ = span_get(span, plain, SPAN_SLOTS.start_ns, "start_ns")
         ret = msgpack_pack_int64(&self.pk, _ if _ is not None else 0)
         if ret != 0: return ret
-        
-        _ = span.duration_ns
+
+        _ = span_get(span, plain, SPAN_SLOTS.duration_ns, "duration_ns")
         ret = msgpack_pack_int64(&self.pk, _ if _ is not None else 0)
         if ret != 0: return ret
-        
-        _ = span.error
+
+        _ = span_get(span, plain, SPAN_SLOTS.error, "error")
         ret = msgpack_pack_int32(&self.pk, _ if _ is not None else 0)
         if ret != 0: return ret
 
-        ret = msgpack_pack_map(&self.pk, len(span._meta) + (dd_origin is not NULL))
+        ret = self._pack_meta(span_items(span, plain, SPAN_SLOTS.meta, "_meta"), dd_origin)
         if ret != 0: return ret
-        if span._meta:
-            for k, v in span._meta.items():
-                ret = self._pack_string(k)
-                if ret != 0: return ret
-                ret = self._pack_string(v)
-                if ret != 0: return ret
-        if dd_origin is not NULL:
-            ret = msgpack_pack_uint32(&self.pk, <stdint.uint32_t> 1)
-            if ret != 0: return ret
-            ret = msgpack_pack_uint32(&self.pk, <stdint.uint32_t> dd_origin)
-            if ret != 0: return ret
-        
-        ret = msgpack_pack_map(&self.pk, len(span._metrics))
+
+        ret = self._pack_metrics(span_items(span, plain, SPAN_SLOTS.metrics, "_metrics"))
         if ret != 0: return ret
-        if span._metrics:
-            for k, v in span._metrics.items():
-                ret = self._pack_string(k)
-                if ret != 0: return ret
-                ret = pack_number(&self.pk, v)
-                if ret != 0: return ret
 
-        ret = self._pack_string(span.span_type)
+        ret = self._pack_string(span_get(span, plain, SPAN_SLOTS.span_type, "span_type"))
         if ret != 0: return ret
 
         return 0
 
 
+# OTLP span kinds by span.kind tag value
+cdef dict OTLP_SPAN_KINDS = {
+    "internal": 1,
+    "server": 2,
+    "client": 3,
+    "producer": 4,
+    "consumer": 5,
+}
+# OTLP status code of spans with an error
+DEF OTLP_STATUS_CODE_ERROR = 2
+DEF OTLP_MAX_CACHED_RESOURCES = 1024
+
+
+cdef inline int pb_varint_to(char *buf, int n, stdint.uint64_t value):
+    """Write a varint at position ``n`` of ``buf`` and return the position after it."""
+    while value >= 0x80:
+        buf[n] = <char> ((value & 0x7F) | 0x80)
+        value >>= 7
+        n += 1
+    buf[n] = <char> value
+    return n + 1
+
+
+cdef inline int pb_varint(msgpack_packer *pk, stdint.uint64_t value):
+    cdef char buf[10]
+    return msgpack_pack_write(pk, buf, pb_varint_to(buf, 0, value))
+
+
+cdef inline int pb_key(msgpack_packer *pk, stdint.uint32_t field, int wire_type):
+    return pb_varint(pk, (field << 3) | wire_type)
+
+
+cdef inline int pb_fixed64(msgpack_packer *pk, stdint.uint32_t field, stdint.uint64_t value):
+    cdef char buf[9]
+    cdef int i
+    cdef int n = pb_varint_to(buf, 0, (field << 3) | PB_FIXED64)
+
+    # Fixed size values are little endian
+    for i in range(8):
+        buf[n + i] = <char> ((value >> (i << 3)) & 0xFF)
+    return msgpack_pack_write(pk, buf, n + 8)
+
+
+cdef inline int pb_double(msgpack_packer *pk, stdint.uint32_t field, double value):
+    cdef stdint.uint64_t bits
+
+    memcpy(&bits, &value, 8)
+    return pb_fixed64(pk, field, bits)
+
+
+cdef inline int pb_id(msgpack_packer *pk, stdint.uint32_t field, stdint.uint64_t high, stdint.uint64_t low, int size):
+    """Write a 64 or 128 bit identifier as big endian bytes."""
+    cdef char buf[18]
+    cdef int i
+    cdef int n = pb_varint_to(buf, 0, (field << 3) | PB_LEN)
+
+    buf[n] = <char> size
+    n += 1
+    if size == 16:
+        for i in range(8):
+            buf[n + i] = <char> ((high >> ((7 - i) << 3)) & 0xFF)
+        n += 8
+    for i in range(8):
+        buf[n + i] = <char> ((low >> ((7 - i) << 3)) & 0xFF)
+    return msgpack_pack_write(pk, buf, n + 8)
+
+
+cdef inline int pb_varint_size(stdint.uint64_t value):
+    cdef int n = 1
+
+    while value >= 0x80:
+        value >>= 7
+        n += 1
+    return n
+
+
+cdef inline int pb_reserve(msgpack_packer *pk, size_t l) except -1:
+    """Make room for ``l`` more bytes in the buffer of a packer."""
+    cdef char *buf
+    cdef size_t buf_size
+
+    if pk.length + l > pk.buf_size:
+        buf_size = (pk.length + l) * 2
+        buf = <char *> PyMem_Realloc(pk.buf, buf_size)
+        if buf == NULL:
+            raise MemoryError("Unable to grow internal buffer.")
+        pk.buf = buf
+        pk.buf_size = buf_size
+    return 0
+
+
+cdef object pb_text_data(object text, const char **data, Py_ssize_t *size):
+    """Get the UTF-8 data of a text value.
+
+    Return the object that owns the data, which must be kept alive while the
+    data is used.
+    """
+    IF PY_MAJOR_VERSION >= 3:
+        if PyUnicode_Check(text):
+            data[0] = PyUnicode_AsUTF8AndSize(text, size)
+            return text
+    ELSE:
+        if PyUnicode_Check(text):
+            text = PyUnicode_AsEncodedString(text, "utf-8", NULL)
+    if PyBytesLike_Check(text):
+        data[0] = <char *> text
+        size[0] = len(text)
+        return text
+    raise TypeError("Unhandled text type: %r" % type(text))
+
+
+cdef int pb_text(msgpack_packer *pk, stdint.uint32_t field, object text) except -1:
+    cdef Py_ssize_t L
+    cdef const char *data
+
+    owner = pb_text_data(text, &data, &L)
+    if pb_key(pk, field, PB_LEN) or pb_varint(pk, L) or msgpack_pack_write(pk, data, L):
+        return -1
+    return 0
+
+
+cdef int pb_close(msgpack_packer *pk, size_t start, stdint.uint32_t field) except -1:
+    """Turn the bytes written since ``start`` into a length-delimited field.
+
+    The field key and length are inserted before the message, which is moved
+    forward to make room for them.
+    """
+    cdef char header[15]
+    cdef size_t size = pk.length - start
+    cdef int n = pb_varint_to(header, 0, (field << 3) | PB_LEN)
+
+    n = pb_varint_to(header, n, size)
+    # Grow the buffer, if needed, before moving the message
+    if msgpack_pack_write(pk, header, n):
+        return -1
+    memmove(pk.buf + start + n, pk.buf + start, size)
+    memcpy(pk.buf + start, header, n)
+    return 0
+
+
+cdef class OTLPEncoder(BufferedEncoder):
+    """Encoder of traces to OTLP protobuf export requests.
+
+    Each trace is encoded as the ``resource_spans`` of an
+    ``ExportTraceServiceRequest``, one for each service of the trace. As
+    protobuf messages are just sequences of fields, the buffer of encoded
+    traces is itself an export request, which is sent without being copied.
+
+    Span tags and metrics are exported as span attributes, along with the
+    ``resource.name`` and ``span.type`` of the span.
+    """
+
+    content_type = "application/x-protobuf"
+
+    cdef msgpack_packer pk
+    cdef stdint.uint32_t _count
+    # Buffer offsets of the end of each trace, used to split payloads
+    cdef list _offsets
+    # Resource attributes shared by all the traces, and instrumentation scope
+    cdef bytes _resource_attributes
+    cdef bytes _scope
+    # Encoded resources by service
+    cdef dict _resources
+
+    def __cinit__(self, size_t max_size, size_t max_item_size, *args, **kwargs):
+        cdef msgpack_packer pk
+        cdef int buf_size = 1024*1024
+
+        self.pk.buf = <char*> PyMem_Malloc(buf_size)
+        if self.pk.buf == NULL:
+            raise MemoryError("Unable to allocate internal buffer.")
+        self.pk.buf_size = buf_size
+        self.pk.length = 0
+        self.max_item_size = max_item_size if max_item_size < max_size else max_size
+        self._count = 0
+        self._offsets = []
+        self._resources = {}
+
+        from ddtrace.version import get_version
+
+        pk.buf = NULL
+        pk.buf_size = 0
+        pk.length = 0
+        try:
+            self._pack_attribute(&pk, 1, "telemetry.sdk.language", "python")
+            self._pack_attribute(&pk, 1, "telemetry.sdk.name", "ddtrace")
+            self._pack_attribute(&pk, 1, "telemetry.sdk.version", get_version())
+            self._resource_attributes = PyBytes_FromStringAndSize(pk.buf, pk.length)
+
+            pk.length = 0
+            pb_text(&pk, 1, "ddtrace")
+            pb_text(&pk, 2, get_version())
+            pb_close(&pk, 0, 1)
+            self._scope = PyBytes_FromStringAndSize(pk.buf, pk.length)
+        finally:
+            PyMem_Free(pk.buf)
+
+    def __dealloc__(self):
+        PyMem_Free(self.pk.buf)
+        self.pk.buf = NULL
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size(self):
+        """Return the size in bytes of the encoder buffer."""
+        with self._lock:
+            return self.pk.length
+
+    cdef int _pack_attribute(self, msgpack_packer *pk, stdint.uint32_t field, object key, object value) except -1:
+        """Pack a KeyValue attribute.
+
+        Attributes are the bulk of spans, so the sizes of the nested messages
+        are computed upfront and the attribute is written in one go.
+        """
+        cdef const char *key_data
+        cdef const char *value_data = NULL
+        cdef Py_ssize_t key_size
+        cdef Py_ssize_t value_size = 0
+        cdef int value_field
+        cdef stdint.uint64_t value_bits = 0
+        cdef stdint.int64_t int_value
+        cdef double double_value
+        cdef size_t any_size
+        cdef size_t kv_size
+        cdef char *buf
+        cdef int n
+        cdef int i
+
+        key_owner = pb_text_data(key, &key_data, &key_size)
+        if PyUnicode_Check(value) or PyBytesLike_Check(value):
+            value_owner = pb_text_data(value, &value_data, &value_size)
+            value_field = 1
+            any_size = 1 + pb_varint_size(value_size) + value_size
+        elif PyBool_Check(value):
+            value_field = 2
+            value_bits = 1 if value else 0
+            any_size = 2
+        elif PyFloat_Check(value):
+            value_field = 4
+            double_value = value
+            memcpy(&value_bits, &double_value, 8)
+            any_size = 9
+        elif PyLong_Check(value) or PyInt_Check(value):
+            try:
+                int_value = value
+            except OverflowError:
+                # Integers that do not fit in an int64 are exported as doubles
+                value_field = 4
+                double_value = value
+                memcpy(&value_bits, &double_value, 8)
+                any_size = 9
+            else:
+                value_field = 3
+                value_bits = <stdint.uint64_t> int_value
+                any_size = 1 + pb_varint_size(value_bits)
+        else:
+            raise TypeError("Unhandled attribute value type: %r" % type(value))
+
+        kv_size = 1 + pb_varint_size(key_size) + key_size + 1 + pb_varint_size(any_size) + any_size
+        pb_reserve(pk, 15 + kv_size)
+
+        buf = pk.buf + pk.length
+        n = pb_varint_to(buf, 0, (field << 3) | PB_LEN)
+        n = pb_varint_to(buf, n, kv_size)
+        # KeyValue.key
+        buf[n] = (1 << 3) | PB_LEN
+        n = pb_varint_to(buf, n + 1, key_size)
+        memcpy(buf + n, key_data, key_size)
+        n += key_size
+        # KeyValue.value
+        buf[n] = (2 << 3) | PB_LEN
+        n = pb_varint_to(buf, n + 1, any_size)
+        if value_field == 1:
+            buf[n] = (1 << 3) | PB_LEN
+            n = pb_varint_to(buf, n + 1, value_size)
+            memcpy(buf + n, value_data, value_size)
+            n += value_size
+        elif value_field == 4:
+            buf[n] = (4 << 3) | PB_FIXED64
+            n += 1
+            for i in range(8):
+                buf[n + i] = <char> ((value_bits >> (i << 3)) & 0xFF)
+            n += 8
+        else:
+            buf[n] = (value_field << 3) | PB_VARINT
+            n = pb_varint_to(buf, n + 1, value_bits)
+        pk.length += n
+        return 0
+
+    cdef int _pack_attributes(self, object attributes, object key_type) except -1:
+        cdef Py_ssize_t pos = 0
+        cdef PyObject *k
+        cdef PyObject *v
+
+        if not PyDict_CheckExact(attributes):
+            raise TypeError("Unhandled %s type: %r" % (key_type, type(attributes)))
+        while PyDict_Next(attributes, &pos, &k, &v):
+            self._pack_attribute(&self.pk, 9, <object> k, <object> v)
+        return 0
+
+    cdef int pack_span(self, object span, object dd_origin, stdint.uint64_t trace_id_high) except -1:
+        cdef msgpack_packer *pk = &self.pk
+        cdef size_t start = pk.length
+        cdef size_t status_start
+        cdef bint plain = is_plain_span(span)
+        cdef stdint.uint64_t start_ns
+        cdef stdint.uint64_t trace_id_low
+        cdef PyObject *kind_tag
+
+        trace_id = span_get(span, plain, SPAN_SLOTS.trace_id, "trace_id") or 0
+        try:
+            trace_id_low = trace_id
+        except OverflowError:
+            trace_id_high = trace_id >> 64
+            trace_id_low = trace_id & 0xFFFFFFFFFFFFFFFF
+        if pb_id(pk, 1, trace_id_high, trace_id_low, 16):
+            return -1
+        if pb_id(pk, 2, 0, span_get(span, plain, SPAN_SLOTS.span_id, "span_id") or 0, 8):
+            return -1
+        parent_id = span_get(span, plain, SPAN_SLOTS.parent_id, "parent_id")
+        if parent_id and pb_id(pk, 4, 0, parent_id, 8):
+            return -1
+
+        name = span_get(span, plain, SPAN_SLOTS.name, "name")
+        if name is not None:
+            pb_text(pk, 5, name)
+
+        meta = span_items(span, plain, SPAN_SLOTS.meta, "_meta")
+        if PyDict_CheckExact(meta):
+            kind_tag = PyDict_GetItem(meta, SPAN_KIND)
+            kind = OTLP_SPAN_KINDS.get(<object> kind_tag) if kind_tag != NULL else None
+        else:
+            kind = OTLP_SPAN_KINDS.get(meta.get(SPAN_KIND))
+        if kind is not None:
+            if pb_key(pk, 6, PB_VARINT) or pb_varint(pk, kind):
+                return -1
+
+        start_ns = span_get(span, plain, SPAN_SLOTS.start_ns, "start_ns") or 0
+        if pb_fixed64(pk, 7, start_ns):
+            return -1
+        if pb_fixed64(pk, 8, start_ns + (span_get(span, plain, SPAN_SLOTS.duration_ns, "duration_ns") or 0)):
+            return -1
+
+        resource = span_resource(span, plain)
+        if resource is not None:
+            self._pack_attribute(pk, 9, "resource.name", resource)
+        span_type = span_get(span, plain, SPAN_SLOTS.span_type, "span_type")
+        if span_type is not None:
+            self._pack_attribute(pk, 9, "span.type", span_type)
+        self._pack_attributes(meta, "meta")
+        if dd_origin is not None:
+            self._pack_attribute(pk, 9, ORIGIN_KEY, dd_origin)
+        self._pack_attributes(span_items(span, plain, SPAN_SLOTS.metrics, "_metrics"), "metrics")
+
+        if span_get(span, plain, SPAN_SLOTS.error, "error"):
+            status_start = pk.length
+            message = meta.get(ERROR_MSG)
+            if message is not None:
+                pb_text(pk, 2, message)
+            if pb_key(pk, 3, PB_VARINT) or pb_varint(pk, OTLP_STATUS_CODE_ERROR):
+                return -1
+            pb_close(pk, status_start, 15)
+
+        # Span are the field 2 of ScopeSpans
+        return pb_close(pk, start, 2)
+
+    cdef bytes _resource(self, object service):
+        """Return the encoded Resource of the spans of a service."""
+        cdef msgpack_packer pk
+
+        resource = self._resources.get(service)
+        if resource is not None:
+            return resource
+
+        pk.buf = NULL
+        pk.buf_size = 0
+        pk.length = 0
+        try:
+            if service is not None:
+                self._pack_attribute(&pk, 1, "service.name", service)
+            if msgpack_pack_write(&pk, <char *> self._resource_attributes, len(self._resource_attributes)):
+                raise MemoryError("Unable to allocate resource buffer.")
+            pb_close(&pk, 0, 1)
+            resource = PyBytes_FromStringAndSize(pk.buf, pk.length)
+        finally:
+            PyMem_Free(pk.buf)
+
+        if len(self._resources) >= OTLP_MAX_CACHED_RESOURCES:
+            self._resources.clear()
+        self._resources[service] = resource
+        return resource
+
+    cdef int pack_trace(self, list trace) except -1:
+        cdef msgpack_packer *pk = &self.pk
+        cdef size_t resource_spans_start
+        cdef size_t start
+        cdef dict services
+        cdef bytes resource
+        cdef bint plain
+        cdef stdint.uint64_t trace_id_high = 0
+
+        if not trace:
+            return 0
+
+        context = trace[0].context
+        dd_origin = context.dd_origin if context is not None else None
+
+        # The higher 64 bits of 128-bit trace ids are a tag of the chunk root
+        meta = trace[0]._meta
+        tid = meta.get(HIGHER_ORDER_TRACE_ID_BITS) if meta else None
+        if tid is not None:
+            try:
+                trace_id_high = int(tid, 16)
+            except (TypeError, ValueError, OverflowError):
+                trace_id_high = 0
+
+        # Spans are grouped by service, which is a resource attribute in OTLP.
+        # Most traces have a single service, so they do not need grouping.
+        service = trace[0].service
+        groups = ((service, trace),)
+        for span in trace:
+            plain = is_plain_span(span)
+            if span_get(span, plain, SPAN_SLOTS.service, "service") != service:
+                services = {}
+                for span in trace:
+                    plain = is_plain_span(span)
+                    service = span_get(span, plain, SPAN_SLOTS.service, "service")
+                    spans = services.get(service)
+                    if spans is None:
+                        services[service] = [span]
+                    else:
+                        spans.append(span)
+                groups = services.items()
+                break
+
+        for service, spans in groups:
+            resource_spans_start = pk.length
+
+            resource = self._resource(service)
+            if msgpack_pack_write(pk, <char *> resource, len(resource)):
+                return -1
+
+            # ScopeSpans
+            start = pk.length
+            if msgpack_pack_write(pk, <char *> self._scope, len(self._scope)):
+                return -1
+            for span in spans:
+                self.pack_span(span, dd_origin, trace_id_high)
+            pb_close(pk, start, 2)
+
+            # ResourceSpans are the field 1 of ExportTraceServiceRequest
+            pb_close(pk, resource_spans_start, 1)
+
+        return 0
+
+    cpdef put(self, list trace):
+        """Put a trace (i.e. a list of spans) in the buffer."""
+        cdef size_t len_before
+        cdef size_t item_size
+
+        if not SPAN_SLOTS_INITIALIZED:
+            init_span_slots()
+
+        with self._lock:
+            len_before = self.pk.length
+            try:
+                self.pack_trace(trace)
+
+                item_size = self.pk.length - len_before
+                if item_size > self.max_item_size:
+                    raise BufferItemTooLarge(item_size)
+
+                if self.pk.length > self.max_size:
+                    raise BufferFull(item_size)
+
+                self._count += 1
+                self._offsets.append(self.pk.length)
+            except:
+                # rollback
+                self.pk.length = len_before
+                raise
+
+    cdef _reset(self):
+        self._count = 0
+        self.pk.length = 0
+        self._offsets = []
+
+    cpdef encode(self):
+        with self._lock:
+            if not self._count:
+                return None
+
+            try:
+                return PyBytes_FromStringAndSize(self.pk.buf, self.pk.length)
+            finally:
+                self._reset()
+
+    cpdef encode_segments(self):
+        """Encode the buffered traces without copying them.
+
+        Return the payload as a list of buffers to be sent one after the
+        other, or ``None`` if there are no traces.
+        """
+        with self._lock:
+            if not self._count:
+                return None
+
+            try:
+                return [memoryview(detach_buffer(&self.pk, 0))]
+            finally:
+                self._reset()
+
+    cpdef encode_split(self, size_t max_size, stdint.uint32_t max_traces):
+        """Encode the buffered traces into several payloads without copying them.
+
+        Each payload holds at most ``max_traces`` traces (if non-zero) and is
+        at most ``max_size`` bytes, unless a single trace is larger than that.
+        Return a list of ``([payload], n_traces)`` pairs, or ``None`` if there
+        are no traces.
+        """
+        cdef list payloads = []
+        cdef size_t start = 0
+        cdef size_t end = 0
+        cdef size_t offset
+        cdef stdint.uint32_t count = 0
+
+        with self._lock:
+            if not self._count:
+                return None
+
+            try:
+                view = memoryview(detach_buffer(&self.pk, 0))
+                offsets = self._offsets
+            finally:
+                self._reset()
+
+        for o in offsets:
+            offset = o
+            if count and ((max_traces and count >= max_traces) or offset - start > max_size):
+                payloads.append(([view[start:end]], count))
+                start = end
+                count = 0
+            end = offset
+            count += 1
+
+        payloads.append(([view[start:end]], count))
+        return payloads
+
+
 cdef class Packer(object):
     """Slightly modified version of the v0.6.2 msgpack Packer
     which only supports basic Python types (int, bool, float, dict, list).
@@ -1,2 +1,3 @@
 def seed() -> None: ...
-def rand64bits(check_pid: bool = True) -> int: ...
+def rand64bits() -> int: ...
+def rand128bits() -> int: ...
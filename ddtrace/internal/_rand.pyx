@@ -28,6 +28,13 @@ Warning: this RNG needs to be reseeded on fork() if collisions are to be
 avoided across processes. Reseeding is accomplished simply by calling seed().
 
 
+The numbers are generated ahead of time in blocks of 256, so that most calls
+only read the next number of the block. As the block is filled without
+releasing the GIL, it is shared safely by all the threads of the process.
+Reseeding discards the numbers left in the block, so that a forked process
+does not reuse the numbers of its parent.
+
+
 Benchmarks (run on 2019 13-inch macbook pro 2.8 GHz quad-core i7)::
 
     $  pytest --benchmark-enable tests/benchmark.py
@@ -51,8 +58,8 @@ test_randbits_stdlib          114.1084 (1.90)     169.3871 (1.71)     125.7419 (
 test_rand64bits_pid_check     121.8156 (2.03)     168.9837 (1.71)     130.3854 (2.00)      8.5097 (1.54)     127.8620 (2.01)     7.8514 (1.56)          9;5        7.6696 (0.50)         81      100000
 -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 """
-import os
 import random
+import time
 
 from ddtrace.internal import compat
 from ddtrace.internal import forksafe
@@ -61,7 +68,12 @@ from ddtrace.internal import forksafe
 cdef extern from "_stdint.h" nogil:
     ctypedef unsigned long long uint64_t
 
+cdef enum:
+    BLOCK_SIZE = 256
+
 cdef uint64_t state
+cdef uint64_t block[BLOCK_SIZE]
+cdef Py_ssize_t block_index = BLOCK_SIZE
 
 
 cpdef _getstate():
@@ -69,9 +81,10 @@ cpdef _getstate():
 
 
 cpdef seed():
-    global state
+    global state, block_index
     random.seed()
     state = <uint64_t>compat.getrandbits(64) ^ <uint64_t>4101842887655102017
+    block_index = BLOCK_SIZE
 
 
 # We have to reseed the RNG or we will get collisions between the processes as
@@ -79,12 +92,37 @@ cpdef seed():
 forksafe.register(seed)
 
 
+cdef void fill_block():
+    global state, block_index
+    cdef Py_ssize_t i
+    for i in range(BLOCK_SIZE):
+        state ^= state >> 21
+        state ^= state << 35
+        state ^= state >> 4
+        block[i] = state * <uint64_t>2685821657736338717
+    block_index = 0
+
+
+cdef inline uint64_t next_id():
+    global block_index
+    if block_index == BLOCK_SIZE:
+        fill_block()
+    block_index += 1
+    return block[block_index - 1]
+
+
 cpdef rand64bits():
-    global state
-    state ^= state >> 21
-    state ^= state << 35
-    state ^= state >> 4
-    return <uint64_t>(state * <uint64_t>2685821657736338717)
+    return next_id()
+
+
+cpdef rand128bits():
+    """Return a random 128-bit trace id.
+
+    Following the convention of 128-bit trace ids, the 32 highest bits are the
+    current unix time in seconds and the next 32 bits are zeros, so that only
+    the 64 lowest bits are random.
+    """
+    return (<object>(<uint64_t>time.time()) << 96) | <object>next_id()
 
 
 seed()
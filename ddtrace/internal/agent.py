@@ -1,9 +1,16 @@
+from contextlib import contextmanager
 import os
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Tuple
 from typing import TypeVar
 from typing import Union
 
+from ddtrace.internal.compat import monotonic
 from ddtrace.internal.compat import parse
 
+from . import forksafe
 from .http import HTTPConnection
 from .http import HTTPSConnection
 from .uds import UDSHTTPConnection
@@ -16,6 +23,8 @@ DEFAULT_UNIX_DSD_PATH = "/var/run/datadog/dsd.socket"
 DEFAULT_STATS_PORT = 8125
 DEFAULT_TRACE_URL = "http://%s:%s" % (DEFAULT_HOSTNAME, DEFAULT_TRACE_PORT)
 DEFAULT_TIMEOUT = 2.0
+DEFAULT_CONNECTION_IDLE_TIMEOUT = 10.0
+DEFAULT_MAX_IDLE_CONNECTIONS = 4
 
 ConnectionType = Union[HTTPSConnection, HTTPConnection, UDSHTTPConnection]
 
@@ -127,3 +136,100 @@ def get_connection(url, timeout=DEFAULT_TIMEOUT):
         return UDSHTTPConnection(path, hostname, parsed.port, timeout=timeout)
 
     raise ValueError("Unsupported protocol '%s'" % parsed.scheme)
+
+
+class ConnectionPool(object):
+    """Pool of persistent HTTP connections.
+
+    Connections are kept alive between requests and are shared by all the
+    clients that talk to the same URL, e.g. the trace writer, the span stats
+    processor, the telemetry writer and the profiler exporter all reuse the
+    connections to the agent. Connections that have been idle for longer than
+    ``idle_timeout`` seconds are closed rather than reused, and at most
+    ``max_idle_connections`` idle connections are kept per URL.
+    """
+
+    def __init__(
+        self,
+        idle_timeout=DEFAULT_CONNECTION_IDLE_TIMEOUT,  # type: float
+        max_idle_connections=DEFAULT_MAX_IDLE_CONNECTIONS,  # type: int
+    ):
+        # type: (...) -> None
+        self.idle_timeout = idle_timeout
+        self.max_idle_connections = max_idle_connections
+        # Idle connections by URL, from the least to the most recently used
+        self._idle = {}  # type: Dict[str, List[Tuple[ConnectionType, float]]]
+        self._lock = forksafe.Lock()
+
+    def _acquire(self, url, timeout):
+        # type: (str, float) -> ConnectionType
+        now = monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(url)
+            if idle:
+                while idle and now - idle[0][1] >= self.idle_timeout:
+                    stale.append(idle.pop(0)[0])
+                if idle:
+                    conn = idle.pop()[0]
+
+        for c in stale:
+            c.close()
+
+        if conn is None:
+            return get_connection(url, timeout)
+
+        # Connections are shared by clients that might use different timeouts
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def _release(self, url, conn):
+        # type: (str, ConnectionType) -> None
+        with self._lock:
+            idle = self._idle.setdefault(url, [])
+            if len(idle) < self.max_idle_connections:
+                idle.append((conn, monotonic()))
+                return
+
+        conn.close()
+
+    @contextmanager
+    def connection(self, url, timeout=DEFAULT_TIMEOUT, reuse=True):
+        # type: (str, float, bool) -> Iterator[ConnectionType]
+        """Return a context manager that provides a connection to the given URL.
+
+        The response of a request must be read entirely before exiting the
+        context for the connection to be reusable. The connection is closed
+        instead of being returned to the pool if an exception is raised or if
+        ``reuse`` is false.
+        """
+        conn = self._acquire(url, timeout) if reuse else get_connection(url, timeout)
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+
+        if reuse:
+            self._release(url, conn)
+        else:
+            conn.close()
+
+    def reset(self):
+        # type: () -> None
+        """Close all the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+
+connection_pool = ConnectionPool()
+
+# Connections must not be shared with the parent process
+forksafe.register(connection_pool.reset)
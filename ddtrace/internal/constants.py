@@ -10,3 +10,11 @@ PROPAGATION_STYLE_ALL = frozenset(
 
 
 DEFAULT_SERVICE_NAME = "unnamed_python_service"
+
+# The 64 highest bits of 128-bit trace ids, as 16 hexadecimal digits, the span
+# trace_id being the 64 lowest bits
+HIGHER_ORDER_TRACE_ID_BITS = "_dd.p.tid"
+
+# Trace tag set when the context of a trace is injected while tail sampling is
+# enabled, as the sampling decision can no longer be changed once propagated
+SAMPLING_DECISION_PROPAGATED_KEY = "_dd.py.sampling_propagated"
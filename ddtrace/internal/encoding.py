@@ -4,17 +4,20 @@ from typing import Dict
 from typing import List
 from typing import Optional
 from typing import TYPE_CHECKING
+from typing import Type
 
 from ._encoding import ListStringTable
+from ._encoding import MsgpackEncoderBase
 from ._encoding import MsgpackEncoderV03
 from ._encoding import MsgpackEncoderV05
+from ._encoding import OTLPEncoder
 from .compat import PY3
 from .compat import binary_type
 from .compat import ensure_text
 from .logger import get_logger
 
 
-__all__ = ["MsgpackEncoderV03", "MsgpackEncoderV05", "ListStringTable", "MSGPACK_ENCODERS"]
+__all__ = ["MsgpackEncoderV03", "MsgpackEncoderV05", "OTLPEncoder", "ListStringTable", "MSGPACK_ENCODERS"]
 
 
 if TYPE_CHECKING:
@@ -160,4 +163,4 @@ MSGPACK_ENCODERS = {
     "v0.3": MsgpackEncoderV03,
     "v0.4": MsgpackEncoderV03,
     "v0.5": MsgpackEncoderV05,
-}
+}  # type: Dict[str, Type[MsgpackEncoderBase]]
@@ -103,12 +103,17 @@ class AwakeablePeriodicThread(PeriodicThread):
         if self.is_alive():
             self.awake()
 
-    def awake(self):
-        """Awake the thread."""
+    def awake(self, wait=True):
+        # type: (bool) -> None
+        """Awake the thread.
+
+        :param wait: Whether to wait for the thread to have served the request.
+        """
         with self.awake_lock:
             self.served.clear()
             self.request.set()
-            self.served.wait()
+            if wait:
+                self.served.wait()
 
     def run(self):
         """Run the target function periodically or on demand."""
@@ -231,11 +236,11 @@ class _GeventAwakeablePeriodicThread(_GeventPeriodicThread):
         super(_GeventAwakeablePeriodicThread, self).stop()
         self.request = True
 
-    def awake(self):
+    def awake(self, wait=True):
         with self.awake_lock:
             self.served = False
             self.request = True
-            while not self.served:
+            while wait and not self.served:
                 nogevent.sleep(self.SLEEP_INTERVAL)
 
     def run(self):
@@ -372,6 +377,6 @@ class AwakeablePeriodicService(PeriodicService):
 
     __thread_class__ = (AwakeablePeriodicRealThreadClass, AwakeablePeriodicThread)
 
-    def awake(self):
-        # type: (...) -> None
-        self._worker.awake()
+    def awake(self, wait=True):
+        # type: (bool) -> None
+        self._worker.awake(wait)
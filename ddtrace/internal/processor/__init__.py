@@ -1,4 +1,5 @@
 import abc
+from typing import List
 from typing import Optional
 
 import attr
@@ -13,7 +14,14 @@ log = get_logger(__name__)
 
 @attr.s
 class SpanProcessor(six.with_metaclass(abc.ABCMeta)):
-    """A Processor is used to process spans as they are created and finished by a tracer."""
+    """A Processor is used to process spans as they are created and finished by a tracer.
+
+    When the tracer processes finished spans in batches, processors that set
+    ``inline`` to ``True`` still see each span as soon as it finishes, before
+    the processors that run over batches.
+    """
+
+    inline = False  # type: bool
 
     def __attrs_post_init__(self):
         # type: () -> None
@@ -53,6 +61,17 @@ class SpanProcessor(six.with_metaclass(abc.ABCMeta)):
         """
         pass
 
+    def on_span_finish_batch(self, spans):
+        # type: (List[Span]) -> None
+        """Called with a batch of finished spans, in the order they finished,
+        when the tracer processes finished spans in batches.
+
+        Processors can override this method to process the spans of a batch
+        together.
+        """
+        for span in spans:
+            self.on_span_finish(span)
+
     def shutdown(self, timeout):
         # type: (Optional[float]) -> None
         """Called when the processor is done being used.
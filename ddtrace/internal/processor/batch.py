@@ -0,0 +1,100 @@
+from collections import deque
+import threading
+from typing import Deque
+from typing import List
+from typing import Sequence
+import weakref
+
+from ddtrace.internal.logger import get_logger
+from ddtrace.span import Span
+
+from . import SpanProcessor
+
+
+log = get_logger(__name__)
+
+
+class _ThreadQueue(object):
+    """The spans queued by a thread, with a weak reference to the thread."""
+
+    __slots__ = ("thread", "spans")
+
+    def __init__(self):
+        # type: () -> None
+        self.thread = weakref.ref(threading.current_thread())
+        self.spans = deque()  # type: Deque[Span]
+
+
+class _LocalQueue(threading.local):
+    def __init__(self, queues, lock):
+        # type: (List[_ThreadQueue], threading.Lock) -> None
+        self.queue = _ThreadQueue()
+        with lock:
+            queues.append(self.queue)
+
+
+class SpanBatchDispatcher(object):
+    """Queue finished spans per thread and run span processors over them in batches.
+
+    The queue of a thread is processed by the thread once it holds
+    ``batch_size`` spans. When a span without a local parent finishes, the
+    queues of all the threads are processed, so that the spans of a trace
+    finished by other threads are not held back.
+
+    The spans are only taken out of the queues under the lock, which is
+    released before the processors run.
+    """
+
+    def __init__(self, processors, batch_size):
+        # type: (Sequence[SpanProcessor], int) -> None
+        self.processors = processors
+        self.batch_size = batch_size
+        # The queues of the threads
+        self._queues = []  # type: List[_ThreadQueue]
+        # Guards taking spans out of the queues, never held while processing them
+        self._lock = threading.Lock()
+        self._local = _LocalQueue(self._queues, self._lock)
+
+    def on_span_finish(self, span):
+        # type: (Span) -> None
+        spans = self._local.queue.spans
+        spans.append(span)
+        if span._parent is None:
+            self.flush_all()
+        elif len(spans) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # type: () -> None
+        """Process the spans queued by the calling thread."""
+        queue = self._local.queue
+        with self._lock:
+            # Only the calling thread appends to its queue, so it can be swapped
+            spans, queue.spans = queue.spans, deque()
+        # Processors may finish spans themselves, which are queued after these
+        self._process(list(spans))
+
+    def flush_all(self):
+        # type: () -> None
+        """Process the spans queued by all the threads."""
+        spans = []  # type: List[Span]
+        with self._lock:
+            for queue in self._queues:
+                # The other threads may be appending to their queue, only pop
+                # the spans that are there now
+                popleft = queue.spans.popleft
+                for _ in range(len(queue.spans)):
+                    spans.append(popleft())
+            # Forget the empty queues of the threads that are gone
+            self._queues[:] = [q for q in self._queues if q.spans or q.thread() is not None]
+        self._process(spans)
+
+    def _process(self, spans):
+        # type: (List[Span]) -> None
+        if not spans:
+            return
+        for processor in self.processors:
+            try:
+                processor.on_span_finish_batch(spans)
+            except Exception:
+                log.error("error applying processor %r", processor, exc_info=True)
@@ -0,0 +1,113 @@
+"""Sketches of span durations for the span statistics.
+
+The sketches use the logarithmic index mapping of the DDSketch used by the
+Datadog backend, and are encoded directly to the bytes of its protobuf
+message, without the ``ddsketch`` and ``protobuf`` packages.
+"""
+import math
+import struct
+import sys
+from typing import Dict
+
+
+# Match the relative accuracy of the sketch implementation used in the backend
+# which is 0.775%.
+RELATIVE_ACCURACY = 0.00775
+
+# Maximum number of bins of an encoded sketch, the lowest bins are collapsed
+# beyond that
+BIN_LIMIT = 2048
+
+# Same computations as ddsketch.mapping.LogarithmicMapping
+_GAMMA_MANTISSA = 2 * RELATIVE_ACCURACY / (1 - RELATIVE_ACCURACY)
+_GAMMA = 1 + _GAMMA_MANTISSA
+_MULTIPLIER = 1 / math.log1p(_GAMMA_MANTISSA) * math.log(2)
+_MIN_POSSIBLE = sys.float_info.min * _GAMMA
+
+_pack_double = struct.Struct("<d").pack
+
+# DDSketch.mapping: IndexMapping(gamma=_GAMMA), the offset and interpolation
+# are zero and thus omitted
+_ENCODED_MAPPING = b"\x0a\x09\x09" + _pack_double(_GAMMA)
+# DDSketch.negativeValues: an empty Store
+_ENCODED_NEGATIVE_VALUES = b"\x1a\x00"
+
+
+def _encode_varint(value):
+    # type: (int) -> bytes
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _encode_store(bins):
+    # type: (Dict[int, int]) -> bytes
+    """Encode the bins of a sketch as a Store message with contiguous bin counts."""
+    if not bins:
+        return b""
+
+    max_key = max(bins)
+    min_key = min(bins)
+    if max_key - min_key >= BIN_LIMIT:
+        # Collapse the lowest bins into the lowest bin that is kept
+        min_key = max_key - BIN_LIMIT + 1
+        bins = bins.copy()
+        collapsed = sum(bins.pop(key) for key in [key for key in bins if key < min_key])
+        bins[min_key] = bins.get(min_key, 0) + collapsed
+
+    counts = [0] * (max_key - min_key + 1)
+    for key, count in bins.items():
+        counts[key - min_key] = count
+    packed = struct.pack("<%dd" % len(counts), *counts)
+    # contiguousBinCounts, packed repeated doubles
+    encoded = b"\x12" + _encode_varint(len(packed)) + packed
+    if min_key:
+        # contiguousBinIndexOffset, zigzag encoded sint32
+        encoded += b"\x18" + _encode_varint((min_key << 1) ^ (min_key >> 31))
+    return encoded
+
+
+class DurationSketch(object):
+    """Distribution of span durations, with the bins that have values only."""
+
+    __slots__ = ("bins", "zero_count")
+
+    def __init__(self):
+        # type: () -> None
+        self.bins = {}  # type: Dict[int, int]
+        self.zero_count = 0
+
+    def add(self, value):
+        # type: (float) -> None
+        if value > _MIN_POSSIBLE:
+            # Same key as ddsketch.mapping.LogarithmicMapping.key
+            key = int(math.ceil(math.log(value, 2) * _MULTIPLIER))
+            bins = self.bins
+            bins[key] = bins.get(key, 0) + 1
+        else:
+            self.zero_count += 1
+
+    def merge(self, other):
+        # type: (DurationSketch) -> None
+        """Add the values of another sketch to this sketch."""
+        bins = self.bins
+        for key, count in other.bins.items():
+            bins[key] = bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+
+    def encode(self):
+        # type: () -> bytes
+        """Return the sketch encoded as a DDSketch protobuf message."""
+        store = _encode_store(self.bins)
+        encoded = _ENCODED_MAPPING + b"\x12" + _encode_varint(len(store)) + store + _ENCODED_NEGATIVE_VALUES
+        if self.zero_count:
+            # zeroCount
+            encoded += b"\x21" + _pack_double(self.zero_count)
+        return encoded
+
+
+EMPTY_SKETCH = DurationSketch().encode()
+"""The encoding of a sketch without any value."""
@@ -1,10 +1,14 @@
 # coding: utf-8
+from array import array
 from collections import defaultdict
+import heapq
+from itertools import chain
+from itertools import count
 import os
+import threading
 import typing
+import weakref
 
-from ddsketch import LogCollapsingLowestDenseDDSketch
-from ddsketch.pb.proto import DDSketchProto
 import six
 import tenacity
 
@@ -15,21 +19,26 @@ from ddtrace.span import _is_top_level
 from . import SpanProcessor
 from ...constants import SPAN_MEASURED_KEY
 from .._encoding import packb
-from ..agent import get_connection
+from ..agent import connection_pool
 from ..compat import get_connection_response
 from ..compat import httplib
 from ..forksafe import Lock
 from ..hostname import get_hostname
 from ..logger import get_logger
 from ..periodic import PeriodicService
+from ..telemetry import telemetry_writer
 from ..writer import _human_size
+from .sketch import EMPTY_SKETCH
+from .sketch import DurationSketch
 
 
 if typing.TYPE_CHECKING:
     from typing import DefaultDict
     from typing import Dict
     from typing import List
+    from typing import Iterator
     from typing import Optional
+    from typing import Tuple
     from typing import Union
 
     from ddtrace import Span
@@ -41,7 +50,7 @@ log = get_logger(__name__)
 def _is_measured(span):
     # type: (Span) -> bool
     """Return whether the span is flagged to be measured or not."""
-    return span._metrics.get(SPAN_MEASURED_KEY) == 1
+    return span.get_metric(SPAN_MEASURED_KEY) == 1
 
 
 """
@@ -71,30 +80,259 @@ class SpanAggrStats(object):
         self.top_level_hits = 0
         self.errors = 0
         self.duration = 0
-        # Match the relative accuracy of the sketch implementation used in the backend
-        # which is 0.775%.
-        self.ok_distribution = LogCollapsingLowestDenseDDSketch(0.00775, bin_limit=2048)
-        self.err_distribution = LogCollapsingLowestDenseDDSketch(0.00775, bin_limit=2048)
+        self.ok_distribution = DurationSketch()
+        # Most aggregations never see an error
+        self.err_distribution = None  # type: Optional[DurationSketch]
+
+    def merge(self, other):
+        # type: (SpanAggrStats) -> None
+        """Add the statistics of other to these statistics."""
+        self.hits += other.hits
+        self.top_level_hits += other.top_level_hits
+        self.errors += other.errors
+        self.duration += other.duration
+        self.ok_distribution.merge(other.ok_distribution)
+        if other.err_distribution is not None:
+            if self.err_distribution is None:
+                self.err_distribution = DurationSketch()
+            self.err_distribution.merge(other.err_distribution)
 
 
-def _span_aggr_key(span):
-    # type: (Span) -> SpanAggrKey
+"""
+The attributes of a span that its aggregation key is made of, as they are on
+the span. Spans are aggregated per thread with this key, which is cheaper to
+build, and it is mapped to the aggregation key when the statistics of the
+threads are merged.
+"""
+SpanRawAggrKey = typing.Tuple[
+    str,  # name
+    typing.Optional[str],  # service
+    typing.Optional[str],  # resource
+    typing.Optional[str],  # type
+    typing.Optional[str],  # http status code tag
+    bool,  # synthetics request
+]
+
+# Maximum number of cached aggregation keys
+_AGGR_KEYS_MAX_SIZE = 4096
+
+
+def _span_raw_aggr_key(span):
+    # type: (Span) -> SpanRawAggrKey
     """Return a hashable key that can be used to aggregate similar spans."""
-    service = span.service or ""
-    resource = span.resource or ""
-    _type = span.span_type or ""
-    status_code = span.get_tag("http.status_code") or 0
-    synthetics = span.context.dd_origin == "synthetics"
-    return span.name, service, resource, _type, int(status_code), synthetics
+    meta = span._meta
+    status_code = meta.get("http.status_code") if meta is not None else None
+    ctx = span._context
+    synthetics = ctx is not None and ctx.dd_origin == "synthetics"
+    return span.name, span.service, span.resource, span.span_type, status_code, synthetics
+
+
+def _aggr_key(raw_key):
+    # type: (SpanRawAggrKey) -> SpanAggrKey
+    """Return the aggregation key of spans with the given raw aggregation key."""
+    name, service, resource, _type, status_code, synthetics = raw_key
+    try:
+        http_status = int(status_code or 0)
+    except ValueError:
+        http_status = 0
+    return name, service or "", resource or "", _type or "", http_status, synthetics
+
+
+# Resource of the aggregations that the spans beyond the maximum number of
+# aggregation keys of a bucket are folded into
+OVERFLOW_RESOURCE = "_dd.stats.overflow"
+
+# Number of rows of the count-min sketches estimating the frequency of folded
+# keys, SpanAggrBucket._count is unrolled for that many rows
+_CMS_DEPTH = 4
+
+
+class SpanAggrBucket(object):
+    """The statistics of the spans of a time bucket, aggregated by key.
+
+    At most ``max_keys`` keys are aggregated separately. Past that, the spans
+    of the other keys are folded into an overflow aggregation per span name,
+    service and type, with the ``OVERFLOW_RESOURCE`` resource. As in the
+    space-saving algorithm, a folded key that becomes more frequent than the
+    least frequent key aggregated separately takes its place, and the
+    statistics of that key are folded in turn, so that the most frequent keys
+    stay aggregated separately.
+
+    The frequency of the folded keys is estimated with a count-min sketch.
+    Its estimates grow with the number of folded spans, so a folded key must
+    be twice as frequent as the least frequent key to replace it, otherwise
+    the keys of the long tail would keep replacing each other.
+    """
+
+    __slots__ = ("max_keys", "stats", "overflow", "folded", "_counts", "_base", "_heap", "_seq")
+
+    def __init__(self, max_keys):
+        # type: (int) -> None
+        self.max_keys = max_keys
+        self.stats = {}  # type: Dict[typing.Any, SpanAggrStats]
+        self.overflow = {}  # type: Dict[typing.Any, SpanAggrStats]
+        # Number of spans folded into the overflow aggregations
+        self.folded = 0
+        # Only created once the bucket is full
+        self._counts = None  # type: Optional[array]
+        # Number of spans of the keys that replaced a folded key, before that
+        self._base = {}  # type: Dict[typing.Any, int]
+        # Heap of the aggregated keys by number of spans, which is a lower
+        # bound of their current number of spans
+        self._heap = []  # type: List[Tuple[int, int, typing.Any]]
+        self._seq = count()
+
+    def items(self):
+        # type: () -> Iterator[Tuple[typing.Any, SpanAggrStats]]
+        return chain(self.stats.items(), self.overflow.items())
+
+    def new_stats(self, key):
+        # type: (SpanRawAggrKey) -> SpanAggrStats
+        """Return the statistics to add a span with a key that is not aggregated yet to."""
+        stats = self.stats
+        if len(stats) < self.max_keys:
+            new_stats = stats[key] = SpanAggrStats()
+            return new_stats
+
+        if self._counts is None:
+            self._counts = array("l", [0]) * (_CMS_DEPTH * 2 * self.max_keys)
+            self._heap = [(s.hits, next(self._seq), k) for k, s in stats.items()]
+            heapq.heapify(self._heap)
+
+        estimate = self._count(key)
+        if self._heap and estimate > 2 * self._heap[0][0]:
+            priority, key_min = self._min()
+            if estimate > 2 * priority:
+                # Take the place of the least frequent key
+                heapq.heappop(self._heap)
+                self._base.pop(key_min, None)
+                self._fold(key_min, stats.pop(key_min))
+                # The current span is added by the caller
+                self._base[key] = estimate - 1
+                heapq.heappush(self._heap, (estimate - 1, next(self._seq), key))
+                new_stats = stats[key] = SpanAggrStats()
+                return new_stats
+
+        self.folded += 1
+        return self._overflow_stats(key)
+
+    def _count(self, key):
+        # type: (SpanRawAggrKey) -> int
+        """Count a span of a folded key and return the estimated number of spans of the key."""
+        counts = self._counts
+        assert counts is not None
+        width = len(counts) // _CMS_DEPTH
+        h = hash(key)
+        # Derive the hashes of the rows from the two halves of the hash of the key
+        h1, h2 = h & 0xFFFFFFFF, ((h >> 32) & 0xFFFFFFFF) | 1
+        i0 = h1 % width
+        i1 = width + (h1 + h2) % width
+        i2 = 2 * width + (h1 + 2 * h2) % width
+        i3 = 3 * width + (h1 + 3 * h2) % width
+        counts[i0] += 1
+        counts[i1] += 1
+        counts[i2] += 1
+        counts[i3] += 1
+        return min(counts[i0], counts[i1], counts[i2], counts[i3])
+
+    def _min(self):
+        # type: () -> Tuple[int, typing.Any]
+        """Return the least frequent aggregated key, with its number of spans."""
+        heap = self._heap
+        base = self._base
+        stats = self.stats
+        while True:
+            priority, _, key = heap[0]
+            current = base.get(key, 0) + stats[key].hits
+            if current == priority:
+                return priority, key
+            heapq.heapreplace(heap, (current, next(self._seq), key))
+
+    def _overflow_stats(self, key):
+        # type: (typing.Any) -> SpanAggrStats
+        """Return the overflow statistics that the spans of a key are folded into."""
+        name, service, _, _type, _, _ = key
+        overflow_key = (name, service, OVERFLOW_RESOURCE, _type, 0, False)
+        stats = self.overflow.get(overflow_key)
+        if stats is None:
+            stats = self.overflow[overflow_key] = SpanAggrStats()
+        return stats
+
+    def _fold(self, key, stats):
+        # type: (typing.Any, SpanAggrStats) -> None
+        self.folded += stats.hits
+        self._overflow_stats(key).merge(stats)
+
+    def merge(self, other, keys):
+        # type: (SpanAggrBucket, Dict[SpanRawAggrKey, SpanAggrKey]) -> None
+        """Add the statistics of the bucket of a thread to this bucket.
+
+        The raw aggregation keys of the bucket of the thread are mapped to
+        their aggregation key with ``keys``, which caches them.
+        """
+        for aggr, other_aggr in ((self.stats, other.stats), (self.overflow, other.overflow)):
+            for raw_key, other_stats in other_aggr.items():
+                key = keys.get(raw_key)
+                if key is None:
+                    key = keys[raw_key] = _aggr_key(raw_key)
+                stats = aggr.get(key)
+                if stats is None:
+                    aggr[key] = other_stats
+                else:
+                    stats.merge(other_stats)
+        self.folded += other.folded
+
+    def trim(self):
+        # type: () -> None
+        """Fold the least frequent keys beyond the maximum number of keys."""
+        if len(self.stats) <= self.max_keys:
+            return
+        kept = dict(heapq.nlargest(self.max_keys, self.stats.items(), key=lambda item: item[1].hits))
+        for key, stats in self.stats.items():
+            if key not in kept:
+                self._fold(key, stats)
+        self.stats = kept
+
+
+class _ThreadBuckets(object):
+    """The statistics of the spans finished by a thread since the last flush."""
+
+    __slots__ = ("lock", "buckets")
+
+    def __init__(self, max_keys):
+        # type: (int) -> None
+        # Only contended while the statistics are flushed. The tracer creates
+        # new processors after a fork, so these locks are never reused by the
+        # child process.
+        self.lock = threading.Lock()
+        self.buckets = defaultdict(lambda: SpanAggrBucket(max_keys))  # type: DefaultDict[int, SpanAggrBucket]
+
+
+class _LocalBuckets(threading.local):
+    def __init__(self, threads_buckets, lock, max_keys):
+        # type: (List[Tuple[weakref.ReferenceType, _ThreadBuckets]], threading.Lock, int) -> None
+        self.thread_buckets = _ThreadBuckets(max_keys)
+        with lock:
+            threads_buckets.append((weakref.ref(threading.current_thread()), self.thread_buckets))
 
 
 class SpanStatsProcessorV06(PeriodicService, SpanProcessor):
-    """SpanProcessor for computing, collecting and submitting span metrics to the Datadog Agent."""
+    """SpanProcessor for computing, collecting and submitting span metrics to the Datadog Agent.
+
+    The statistics of the spans are aggregated by each thread on its own, and
+    only merged together when they are flushed, so that threads finishing
+    spans do not wait for each other.
 
-    def __init__(self, agent_url, interval=None, timeout=1.0, retry_attempts=3):
-        # type: (str, Optional[float], float, int) -> None
+    The spans of a time bucket are aggregated by at most ``max_keys`` keys,
+    the spans of the least frequent keys beyond that are folded into overflow
+    aggregations (see :class:`SpanAggrBucket`).
+    """
+
+    def __init__(self, agent_url, interval=None, timeout=1.0, retry_attempts=3, max_keys=None):
+        # type: (str, Optional[float], float, int, Optional[int]) -> None
         if interval is None:
             interval = float(os.getenv("_DD_TRACE_STATS_WRITER_INTERVAL") or 10.0)
+        bucket_max_keys = config._trace_stats_max_keys if max_keys is None else max_keys  # type: int
         super(SpanStatsProcessorV06, self).__init__(interval=interval)
         self._agent_url = agent_url
         self._endpoint = "/v0.6/stats"
@@ -102,9 +340,8 @@ class SpanStatsProcessorV06(PeriodicService, SpanProcessor):
         self._timeout = timeout
         # Have the bucket size match the interval in which flushes occur.
         self._bucket_size_ns = int(interval * 1e9)  # type: int
-        self._buckets = defaultdict(
-            lambda: defaultdict(SpanAggrStats)
-        )  # type: DefaultDict[int, DefaultDict[SpanAggrKey, SpanAggrStats]]
+        self._max_keys = bucket_max_keys
+        self._buckets = defaultdict(lambda: SpanAggrBucket(bucket_max_keys))  # type: DefaultDict[int, SpanAggrBucket]
         self._headers = {
             "Datadog-Meta-Lang": "python",
             "Datadog-Meta-Tracer-Version": ddtrace.__version__,
@@ -112,6 +349,10 @@ class SpanStatsProcessorV06(PeriodicService, SpanProcessor):
         }  # type: Dict[str, str]
         self._hostname = six.ensure_text(get_hostname())
         self._lock = Lock()
+        # The buckets of the threads, with a weak reference to their thread
+        self._threads_buckets = []  # type: List[Tuple[weakref.ReferenceType, _ThreadBuckets]]
+        self._local = _LocalBuckets(self._threads_buckets, self._lock, bucket_max_keys)
+        self._aggr_keys = {}  # type: Dict[SpanRawAggrKey, SpanAggrKey]
         self._enabled = True
         self._retry_request = tenacity.Retrying(
             # Use a Fibonacci policy with jitter, same as AgentWriter.
@@ -136,23 +377,67 @@ class SpanStatsProcessorV06(PeriodicService, SpanProcessor):
         if not is_top_level and not _is_measured(span):
             return
 
-        with self._lock:
-            # Align the span into the corresponding stats bucket
-            assert span.duration_ns is not None
-            span_end_ns = span.start_ns + span.duration_ns
-            bucket_time_ns = span_end_ns - (span_end_ns % self._bucket_size_ns)
-            aggr_key = _span_aggr_key(span)
-            stats = self._buckets[bucket_time_ns][aggr_key]
-
-            stats.hits += 1
-            stats.duration += span.duration_ns
-            if is_top_level:
-                stats.top_level_hits += 1
-            if span.error:
-                stats.errors += 1
-                stats.err_distribution.add(span.duration_ns)
-            else:
-                stats.ok_distribution.add(span.duration_ns)
+        thread_buckets = self._local.thread_buckets
+        with thread_buckets.lock:
+            self._add_span(thread_buckets.buckets, span, is_top_level)
+
+    def on_span_finish_batch(self, spans):
+        # type: (List[Span]) -> None
+        if not self._enabled:
+            return
+
+        # Update the stats of the whole batch with a single lock acquisition
+        thread_buckets = self._local.thread_buckets
+        with thread_buckets.lock:
+            buckets = thread_buckets.buckets
+            for span in spans:
+                is_top_level = _is_top_level(span)
+                if is_top_level or _is_measured(span):
+                    self._add_span(buckets, span, is_top_level)
+
+    def _add_span(self, buckets, span, is_top_level):
+        # type: (DefaultDict[int, SpanAggrBucket], Span, bool) -> None
+        # Align the span into the corresponding stats bucket
+        assert span.duration_ns is not None
+        span_end_ns = span.start_ns + span.duration_ns
+        bucket_time_ns = span_end_ns - (span_end_ns % self._bucket_size_ns)
+        bucket = buckets[bucket_time_ns]
+        raw_key = _span_raw_aggr_key(span)
+        stats = bucket.stats.get(raw_key)
+        if stats is None:
+            stats = bucket.new_stats(raw_key)
+
+        stats.hits += 1
+        stats.duration += span.duration_ns
+        if is_top_level:
+            stats.top_level_hits += 1
+        if span.error:
+            stats.errors += 1
+            if stats.err_distribution is None:
+                stats.err_distribution = DurationSketch()
+            stats.err_distribution.add(span.duration_ns)
+        else:
+            stats.ok_distribution.add(span.duration_ns)
+
+    def _merge_threads_buckets(self):
+        # type: () -> None
+        """Move the statistics aggregated by the threads to the buckets."""
+        threads_buckets = []
+        for _, thread_buckets in self._threads_buckets:
+            with thread_buckets.lock:
+                buckets = thread_buckets.buckets
+                if buckets:
+                    thread_buckets.buckets = defaultdict(lambda: SpanAggrBucket(self._max_keys))
+                    threads_buckets.append(buckets)
+        # Forget the empty buckets of the threads that are gone
+        self._threads_buckets[:] = [(t, b) for t, b in self._threads_buckets if b.buckets or t() is not None]
+
+        aggr_keys = self._aggr_keys
+        if len(aggr_keys) > _AGGR_KEYS_MAX_SIZE:
+            aggr_keys.clear()
+        for buckets in threads_buckets:
+            for bucket_time_ns, thread_bucket in buckets.items():
+                self._buckets[bucket_time_ns].merge(thread_bucket, aggr_keys)
 
     def _serialize_buckets(self):
         # type: () -> List[Dict]
@@ -160,11 +445,16 @@ class SpanStatsProcessorV06(PeriodicService, SpanProcessor):
 
         The current bucket is left in case any other spans are added.
         """
+        self._merge_threads_buckets()
         serialized_buckets = []
         serialized_bucket_keys = []
+        folded = 0
         for bucket_time_ns, bucket in self._buckets.items():
             bucket_aggr_stats = []
             serialized_bucket_keys.append(bucket_time_ns)
+            # The statistics of several threads may add up to more keys
+            bucket.trim()
+            folded += bucket.folded
 
             for aggr_key, stat_aggr in bucket.items():
                 name, service, resource, _type, http_status, synthetics = aggr_key
@@ -177,8 +467,10 @@ class SpanStatsProcessorV06(PeriodicService, SpanProcessor):
                     u"TopLevelHits": stat_aggr.top_level_hits,
                     u"Duration": stat_aggr.duration,
                     u"Errors": stat_aggr.errors,
-                    u"OkSummary": DDSketchProto.to_proto(stat_aggr.ok_distribution).SerializeToString(),
-                    u"ErrorSummary": DDSketchProto.to_proto(stat_aggr.err_distribution).SerializeToString(),
+                    u"OkSummary": stat_aggr.ok_distribution.encode(),
+                    u"ErrorSummary": (
+                        stat_aggr.err_distribution.encode() if stat_aggr.err_distribution is not None else EMPTY_SKETCH
+                    ),
                 }
                 if service:
                     serialized_bucket[u"Service"] = six.ensure_text(service)
@@ -197,14 +489,20 @@ class SpanStatsProcessorV06(PeriodicService, SpanProcessor):
         for key in serialized_bucket_keys:
             del self._buckets[key]
 
+        if folded:
+            log.debug("folded %d spans into overflow span stats, above %d keys per bucket", folded, self._max_keys)
+            telemetry_writer.add_count_metric("tracers", "stats.folded_spans", folded)
+
         return serialized_buckets
 
     def _flush_stats(self, payload):
         # type: (bytes) -> None
         try:
-            conn = get_connection(self._agent_url, self._timeout)
-            conn.request("PUT", self._endpoint, payload, self._headers)
-            resp = get_connection_response(conn)
+            with connection_pool.connection(self._agent_url, self._timeout) as conn:
+                conn.request("PUT", self._endpoint, payload, self._headers)
+                resp = get_connection_response(conn)
+                # The response must be read for the connection to be reused
+                body = resp.read()
         except Exception:
             log.error("failed to submit span stats to the Datadog agent at %s", self._agent_endpoint, exc_info=True)
             raise
@@ -220,7 +518,7 @@ class SpanStatsProcessorV06(PeriodicService, SpanProcessor):
                     "failed to send stats payload, %s (%s) (%s) response from Datadog agent at %s",
                     resp.status,
                     resp.reason,
-                    resp.read(),
+                    body,
                     self._agent_endpoint,
                 )
             else:
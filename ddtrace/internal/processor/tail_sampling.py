@@ -0,0 +1,160 @@
+import threading
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import attr
+from ddsketch import LogCollapsingLowestDenseDDSketch
+
+from ddtrace.constants import AUTO_KEEP
+from ddtrace.constants import AUTO_REJECT
+from ddtrace.constants import USER_KEEP
+from ddtrace.internal import compat
+from ddtrace.internal.constants import SAMPLING_DECISION_PROPAGATED_KEY
+from ddtrace.internal.logger import get_logger
+from ddtrace.internal.processor.trace import TraceProcessor
+from ddtrace.internal.rate_limiter import RateLimiter
+from ddtrace.span import Span
+
+
+log = get_logger(__name__)
+
+# (service, name, resource) of the root span of a trace, None for the
+# resources above the max number of resources
+_ResourceKey = Optional[Tuple[Optional[str], str, str]]
+
+# Relative accuracy of the latency sketches
+_RELATIVE_ACCURACY = 0.00775
+
+TAIL_SAMPLING_DECISION_KEY = "_dd.py.tail_sampling"
+"""Tag set on the root span of the traces kept by the tail sampling processor, with the reason why."""
+
+
+class _ResourceLatencies(object):
+    """Distribution of the durations of the root spans of a resource."""
+
+    __slots__ = ("sketch", "count", "threshold")
+
+    def __init__(self):
+        # type: () -> None
+        self.sketch = LogCollapsingLowestDenseDDSketch(_RELATIVE_ACCURACY, bin_limit=2048)
+        self.count = 0
+        # The duration above which a trace is an outlier, once known
+        self.threshold = None  # type: Optional[float]
+
+
+@attr.s
+class TailSamplingProcessor(TraceProcessor):
+    """Processor sampling complete traces once they have finished.
+
+    Traces with errors, and traces whose root span takes longer than the
+    ``latency_quantile`` quantile of the durations of the root spans of the
+    same service, name and resource, are always kept, even if they were
+    rejected by the head sampler. The other traces rejected by the head
+    sampler stay rejected, and the rest are kept up to ``rate_limit`` traces
+    per second, the others being rejected.
+
+    The sampling priority of a trace is only changed if its sampling decision
+    was not propagated, that is if the trace did not come from an upstream
+    service and its context was not injected, so that distributed traces are
+    kept or rejected as a whole.
+
+    Rejected traces are only dropped when ``compute_stats_enabled`` is set, as
+    the trace metrics must otherwise be computed by the agent from all the
+    traces. The rejected traces are then still sent to the agent, which drops
+    them, and tail sampling does not reduce the traffic to the agent.
+
+    The latency quantile of a resource is computed from an in-process sketch
+    of the durations seen so far, every ``min_samples`` traces, so no trace
+    of a resource is considered an outlier until ``min_samples`` of them have
+    been seen. At most ``max_resources`` resources are tracked separately, the
+    others share the same sketch.
+
+    Trace chunks sent by partial flushing, and traces with a user sampling
+    decision, are left as they are.
+    """
+
+    rate_limit = attr.ib(type=int)
+    _compute_stats_enabled = attr.ib(type=bool, default=False)
+    latency_quantile = attr.ib(type=float, default=0.99)
+    min_samples = attr.ib(type=int, default=100)
+    max_resources = attr.ib(type=int, default=1000)
+    _limiter = attr.ib(type=RateLimiter, init=False, repr=False)
+    _latencies = attr.ib(type=Dict[_ResourceKey, _ResourceLatencies], factory=dict, init=False, repr=False)
+    _lock = attr.ib(factory=threading.Lock, init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        # type: () -> None
+        self._limiter = RateLimiter(self.rate_limit)
+        super(TailSamplingProcessor, self).__attrs_post_init__()
+
+    def process_trace(self, trace):
+        # type: (List[Span]) -> Optional[List[Span]]
+        if not trace:
+            return trace
+
+        root = trace[0]
+        if root._local_root is not root or root.get_metric("_dd.py.partial_flush") is not None:
+            # Not a complete trace
+            return trace
+
+        ctx = root._context
+        priority = ctx.sampling_priority if ctx is not None else None
+        if priority is not None and (priority < AUTO_REJECT or priority >= USER_KEEP):
+            # Keep the decision of the user
+            return trace
+
+        # The decision of the head sampler is final once propagated
+        propagated = root.parent_id is not None or (
+            ctx is not None and (ctx.dd_origin is not None or SAMPLING_DECISION_PROPAGATED_KEY in ctx._meta)
+        )
+        if not propagated:
+            if any(span.error for span in trace):
+                reason = "error"  # type: Optional[str]
+            elif self._is_latency_outlier(root):
+                reason = "latency"
+            else:
+                reason = None
+            if reason is not None:
+                if ctx is not None and priority == AUTO_REJECT:
+                    ctx.sampling_priority = priority = AUTO_KEEP
+                root._set_str_tag(TAIL_SAMPLING_DECISION_KEY, reason)
+            elif priority != AUTO_REJECT and not self._limiter.is_allowed(compat.monotonic_ns()):
+                log.debug("tail sampling rejecting trace %d with %d spans", root.trace_id, len(trace))
+                root.context.sampling_priority = priority = AUTO_REJECT
+
+        if priority == AUTO_REJECT and self._compute_stats_enabled:
+            # The trace metrics include the trace already
+            log.debug("tail sampling dropping trace %d with %d spans", root.trace_id, len(trace))
+            return None
+        return trace
+
+    def _is_latency_outlier(self, span):
+        # type: (Span) -> bool
+        """Add the duration of a root span to the latencies of its resource and
+        return whether it is above the latency quantile of the resource.
+        """
+        duration = span.duration_ns
+        if duration is None:
+            return False
+
+        key = (span.service, span.name, span.resource)  # type: _ResourceKey
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                if len(self._latencies) >= self.max_resources:
+                    key = None
+                    latencies = self._latencies.get(key)
+                if latencies is None:
+                    latencies = self._latencies[key] = _ResourceLatencies()
+
+            latencies.sketch.add(duration)
+            latencies.count += 1
+            if latencies.count % self.min_samples == 0:
+                quantile = latencies.sketch.get_quantile_value(self.latency_quantile)
+                if quantile is not None:
+                    # The highest duration the quantile can stand for given
+                    # the relative accuracy of the sketch
+                    latencies.threshold = quantile * (1 + _RELATIVE_ACCURACY)
+            return latencies.threshold is not None and duration > latencies.threshold
@@ -1,16 +1,19 @@
 import abc
-from collections import defaultdict
 import threading
-from typing import DefaultDict
+from typing import Dict
 from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Set
+from typing import Tuple
 
 import attr
 import six
 
 from ddtrace.internal.logger import get_logger
 from ddtrace.internal.processor import SpanProcessor
+from ddtrace.internal.processor.truncator import normalize_span
+from ddtrace.internal.processor.truncator import truncate_span
 from ddtrace.internal.service import ServiceStatusError
 from ddtrace.internal.writer import TraceWriter
 from ddtrace.span import Span
@@ -131,6 +134,74 @@ class TraceTagsProcessor(TraceProcessor):
         return trace
 
 
+@attr.s
+class TraceChunkProcessor(TraceProcessor):
+    """Processor doing the work of ``TraceTagsProcessor``,
+    ``TraceSamplingProcessor`` and ``TraceTopLevelSpanProcessor``, and
+    optionally of ``TruncateSpanProcessor`` and ``NormalizeSpanProcessor``, in
+    a single pass over the spans of a trace chunk.
+
+    The spans are expected in start order, as written by the ``SpanAggregator``,
+    so that the parent of a span comes before it when in the same chunk.
+    """
+
+    _compute_stats_enabled = attr.ib(type=bool)
+    _truncate = attr.ib(type=bool, default=False)
+    _normalize = attr.ib(type=bool, default=False)
+
+    def process_trace(self, trace):
+        # type: (List[Span]) -> Optional[List[Span]]
+        if not trace:
+            return None
+
+        chunk_root = trace[0]
+        ctx = chunk_root._context
+        if ctx:
+            # Propagate the trace tags, including the sampling priority, to the chunk
+            ctx._update_tags(chunk_root)
+            # When stats computation is enabled in the tracer then we can
+            # safely drop the traces.
+            if self._compute_stats_enabled:
+                priority = ctx.sampling_priority
+                if priority is not None and priority <= 0:
+                    return None
+
+        for span in trace:
+            if span.sampled:
+                break
+        else:
+            log.debug("dropping trace %d with %d spans", chunk_root.trace_id, len(trace))
+            return None
+
+        truncate, normalize = self._truncate, self._normalize
+        span_ids = set()  # type: Set[int]
+        add_span_id = span_ids.add
+        for span in trace:
+            # Same as _is_top_level(span)
+            parent = span._parent
+            if span._local_root is span or (
+                parent is not None and parent.service != span.service and span.service is not None
+            ):
+                top_level = 1  # type: Optional[int]
+            elif span.parent_id and span.parent_id not in span_ids:
+                top_level = 0
+            else:
+                top_level = None
+            if top_level is not None:
+                # The metric is internal, there is no need for the checks of set_metric
+                if span._metrics is None:
+                    span._metrics = {"_dd.top_level": top_level}
+                else:
+                    span._metrics["_dd.top_level"] = top_level
+            add_span_id(span.span_id)
+            if truncate:
+                truncate_span(span)
+            if normalize:
+                normalize_span(span)
+
+        return trace
+
+
 @attr.s
 class SpanAggregator(SpanProcessor):
     """Processor that aggregates spans together by trace_id and writes the
@@ -140,76 +211,104 @@ class SpanAggregator(SpanProcessor):
           the trace_id have finished; or
         - A minimum threshold of spans (``partial_flush_min_spans``) have been
           finished in the collection and ``partial_flush_enabled`` is True.
+
+    Traces are spread over shards by trace_id, each with its own lock, so that
+    threads working on different traces rarely contend for the same lock.
+    Finished spans are processed and written outside of the shard lock.
     """
 
-    @attr.s
+    # Number of shards, must be a power of 2
+    SHARDS = 64
+
+    @attr.s(slots=True)
     class _Trace(object):
-        spans = attr.ib(default=attr.Factory(list))  # type: List[Span]
+        # Unflushed spans by span id, in start order
+        spans = attr.ib(factory=dict)  # type: Dict[int, Span]
         num_finished = attr.ib(type=int, default=0)  # type: int
+        # With partial flushing, the finished spans and the start sequence
+        # numbers of the unflushed spans, so that a partial flush only looks
+        # at the spans it flushes.
+        finished = attr.ib(factory=list)  # type: List[Span]
+        seqs = attr.ib(factory=dict)  # type: Dict[int, int]
+        num_started = attr.ib(type=int, default=0)  # type: int
 
     _partial_flush_enabled = attr.ib(type=bool)
     _partial_flush_min_spans = attr.ib(type=int)
     _trace_processors = attr.ib(type=Iterable[TraceProcessor])
     _writer = attr.ib(type=TraceWriter)
-    _traces = attr.ib(
-        factory=lambda: defaultdict(lambda: SpanAggregator._Trace()),
+    _shards = attr.ib(
+        factory=lambda: [(threading.Lock(), {}) for _ in range(SpanAggregator.SHARDS)],
         init=False,
-        type=DefaultDict[int, "_Trace"],
+        type=List[Tuple[threading.Lock, Dict[int, "SpanAggregator._Trace"]]],
         repr=False,
     )
-    _lock = attr.ib(init=False, factory=threading.Lock, repr=False)
 
     def on_span_start(self, span):
         # type: (Span) -> None
-        with self._lock:
-            trace = self._traces[span.trace_id]
-            trace.spans.append(span)
+        trace_id = span.trace_id
+        lock, traces = self._shards[trace_id & (self.SHARDS - 1)]
+        with lock:
+            trace = traces.get(trace_id)
+            if trace is None:
+                trace = traces[trace_id] = self._Trace()
+            span_id = span.span_id
+            trace.spans[span_id] = span
+            if self._partial_flush_enabled:
+                trace.seqs[span_id] = trace.num_started
+                trace.num_started += 1
 
     def on_span_finish(self, span):
         # type: (Span) -> None
-        with self._lock:
-            trace = self._traces[span.trace_id]
-            trace.num_finished += 1
-            should_partial_flush = self._partial_flush_enabled and trace.num_finished >= self._partial_flush_min_spans
-            if trace.num_finished == len(trace.spans) or should_partial_flush:
-                trace_spans = trace.spans
-                trace.spans = []
-                if trace.num_finished < len(trace_spans):
-                    finished = []
-                    for s in trace_spans:
-                        if s.finished:
-                            finished.append(s)
-                        else:
-                            trace.spans.append(s)
+        trace_id = span.trace_id
+        lock, traces = self._shards[trace_id & (self.SHARDS - 1)]
+        with lock:
+            trace = traces.get(trace_id)
+            if trace is None:
+                log.debug("span %d of trace %d was not started by this processor", span.span_id, trace_id)
+                return None
+            started = trace.spans.get(span.span_id)
+            if started is None:
+                log.debug("span %d of trace %d was not started by this processor", span.span_id, trace_id)
+                return None
 
-                else:
-                    finished = trace_spans
-
-                num_finished = len(finished)
-
-                if should_partial_flush:
-                    log.debug("Partially flushing %d spans for trace %d", num_finished, span.trace_id)
-                    finished[0].set_metric("_dd.py.partial_flush", num_finished)
-
-                trace.num_finished -= num_finished
-
-                if len(trace.spans) == 0:
-                    del self._traces[span.trace_id]
-
-                spans = finished  # type: Optional[List[Span]]
-                for tp in self._trace_processors:
-                    try:
-                        if spans is None:
-                            return
-                        spans = tp.process_trace(spans)
-                    except Exception:
-                        log.error("error applying processor %r", tp, exc_info=True)
-
-                self._writer.write(spans)
-                return
-
-            log.debug("trace %d has %d spans, %d finished", span.trace_id, len(trace.spans), trace.num_finished)
-            return None
+            trace.num_finished += 1
+            should_partial_flush = False
+            if self._partial_flush_enabled:
+                trace.finished.append(started)
+                should_partial_flush = trace.num_finished >= self._partial_flush_min_spans
+
+            if trace.num_finished == len(trace.spans):
+                # All the spans have finished
+                finished = list(trace.spans.values())
+                del traces[trace_id]
+            elif should_partial_flush:
+                finished = trace.finished
+                trace.finished = []
+                trace.num_finished = 0
+                trace_spans, seqs = trace.spans, trace.seqs
+                for s in finished:
+                    del trace_spans[s.span_id]
+                # Flushed spans are in start order, like complete traces
+                finished.sort(key=lambda s: seqs.pop(s.span_id))
+            else:
+                log.debug("trace %d has %d spans, %d finished", trace_id, len(trace.spans), trace.num_finished)
+                return None
+
+        num_finished = len(finished)
+        if should_partial_flush:
+            log.debug("Partially flushing %d spans for trace %d", num_finished, trace_id)
+            finished[0].set_metric("_dd.py.partial_flush", num_finished)
+
+        spans = finished  # type: Optional[List[Span]]
+        for tp in self._trace_processors:
+            try:
+                if spans is None:
+                    return
+                spans = tp.process_trace(spans)
+            except Exception:
+                log.error("error applying processor %r", tp, exc_info=True)
+
+        self._writer.write(spans)
 
     def shutdown(self, timeout):
         # type: (Optional[float]) -> None
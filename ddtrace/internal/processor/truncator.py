@@ -48,27 +48,39 @@ def truncate_to_length(value, max_length):
     return value[:max_length]
 
 
-class TruncateSpanProcessor(SpanProcessor):
-    def on_span_start(self, span):
-        pass
-
-    def on_span_finish(self, span):
-        span.resource = truncate_to_length(span.resource, MAX_RESOURCE_NAME_LENGTH)
+def truncate_span(span):
+    """Truncate the resource, tags and metric names of a span to the lengths accepted by the agent."""
+    span.resource = truncate_to_length(span.resource, MAX_RESOURCE_NAME_LENGTH)
+    if span._meta:
         span._meta = {
             truncate_to_length(k, MAX_META_KEY_LENGTH): truncate_to_length(v, MAX_META_VALUE_LENGTH)
             for k, v in span._meta.items()
         }
+    if span._metrics:
         span._metrics = {truncate_to_length(k, MAX_METRIC_KEY_LENGTH): v for k, v in span._metrics.items()}
 
 
+def normalize_span(span):
+    """Set the default values and truncate the service, name and type of a span like the agent does."""
+    span.service = truncate_to_length(span.service or DEFAULT_SERVICE_NAME, MAX_SERVICE_LENGTH)
+    span.name = truncate_to_length(span.name or DEFAULT_SPAN_NAME, MAX_NAME_LENGTH)
+    if not span.resource:
+        span.resource = span.name
+    if span.span_type:
+        span.span_type = span.span_type[:MAX_TYPE_LENGTH]
+
+
+class TruncateSpanProcessor(SpanProcessor):
+    def on_span_start(self, span):
+        pass
+
+    def on_span_finish(self, span):
+        truncate_span(span)
+
+
 class NormalizeSpanProcessor(SpanProcessor):
     def on_span_start(self, span):
         pass
 
     def on_span_finish(self, span):
-        span.service = truncate_to_length(span.service or DEFAULT_SERVICE_NAME, MAX_SERVICE_LENGTH)
-        span.name = truncate_to_length(span.name or DEFAULT_SPAN_NAME, MAX_NAME_LENGTH)
-        if not span.resource:
-            span.resource = span.name
-        if span.span_type:
-            span.span_type = span.span_type[:MAX_TYPE_LENGTH]
+        normalize_span(span)
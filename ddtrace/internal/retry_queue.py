@@ -0,0 +1,204 @@
+"""Bounded queue of encoded payloads waiting to be sent again."""
+from collections import deque
+import mmap
+import os
+import tempfile
+from typing import Deque
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from ddtrace.internal import forksafe
+from ddtrace.internal.compat import monotonic
+from ddtrace.internal.logger import get_logger
+
+
+log = get_logger(__name__)
+
+
+class _SpilledPayload(object):
+    """A payload stored in a file of the spill directory."""
+
+    __slots__ = ("path", "size")
+
+    def __init__(self, directory, payload):
+        # type: (str, bytes) -> None
+        fd, self.path = tempfile.mkstemp(prefix="ddtrace-payload-", dir=directory)
+        try:
+            os.write(fd, payload)
+        finally:
+            os.close(fd)
+        self.size = len(payload)
+
+    def load(self):
+        # type: () -> bytes
+        with open(self.path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return mapped[:]
+            finally:
+                mapped.close()
+
+    def discard(self):
+        # type: () -> None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            log.debug("failed to remove spilled payload %s", self.path, exc_info=True)
+
+
+# (payload, number of traces, enqueue time)
+_Item = Tuple[Union[bytes, _SpilledPayload], int, float]
+
+
+class PayloadRetryQueue(object):
+    """FIFO of encoded payloads that failed to be sent.
+
+    The queue holds at most ``max_size`` bytes of payloads in memory. When a
+    spill directory is given, payloads that do not fit in memory are written
+    to files in that directory, up to another ``max_size`` bytes, and read
+    back with ``mmap`` when they are sent again. Payloads older than
+    ``max_age`` seconds are dropped.
+
+    Methods that drop payloads return the list of ``(size, n_traces)`` of the
+    dropped payloads so that the caller can account for them.
+    """
+
+    def __init__(
+        self,
+        max_size,  # type: int
+        max_age,  # type: float
+        spill_dir=None,  # type: Optional[str]
+    ):
+        # type: (...) -> None
+        self.max_size = max_size
+        self.max_age = max_age
+        self.spill_dir = spill_dir
+        self._items = deque()  # type: Deque[_Item]
+        self._memory_size = 0
+        self._spilled_size = 0
+        self._lock = forksafe.Lock()
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._items)
+
+    @property
+    def size(self):
+        # type: () -> int
+        """The size in bytes of the queued payloads."""
+        return self._memory_size + self._spilled_size
+
+    def _drop(self, item):
+        # type: (_Item) -> Tuple[int, int]
+        payload, n_traces, _ = item
+        if isinstance(payload, _SpilledPayload):
+            self._spilled_size -= payload.size
+            payload.discard()
+            return payload.size, n_traces
+        self._memory_size -= len(payload)
+        return len(payload), n_traces
+
+    def _expire(self, now):
+        # type: (float) -> List[Tuple[int, int]]
+        dropped = []
+        while self._items and now - self._items[0][2] > self.max_age:
+            dropped.append(self._drop(self._items.popleft()))
+        return dropped
+
+    def put(self, payload, n_traces):
+        # type: (bytes, int) -> List[Tuple[int, int]]
+        """Queue a payload, dropping the oldest payloads to make room if needed.
+
+        A payload larger than the queue itself is dropped straight away.
+        """
+        size = len(payload)
+        if size > self.max_size:
+            return [(size, n_traces)]
+
+        with self._lock:
+            now = monotonic()
+            dropped = self._expire(now)
+            dropped.extend(self._make_room(size))
+            self._items.append((payload, n_traces, now))
+            self._memory_size += size
+            return dropped
+
+    def requeue(self, payload, n_traces, queued_at):
+        # type: (bytes, int, float) -> List[Tuple[int, int]]
+        """Put a payload obtained from :meth:`get` back at the front of the queue.
+
+        Payloads queued in the meantime may have taken its room, in which case
+        the oldest payloads are spilled or dropped like with :meth:`put`.
+        """
+        with self._lock:
+            self._items.appendleft((payload, n_traces, queued_at))
+            self._memory_size += len(payload)
+            return self._make_room(0)
+
+    def _first_in_memory(self):
+        # type: () -> Optional[int]
+        """Return the index of the oldest payload held in memory, if any."""
+        for i, (queued, _, _) in enumerate(self._items):
+            if not isinstance(queued, _SpilledPayload):
+                return i
+        return None
+
+    def _make_room(self, size):
+        # type: (int) -> List[Tuple[int, int]]
+        """Spill or drop the oldest payloads until ``size`` more bytes fit in memory."""
+        dropped = []
+        while self._items and self._memory_size + size > self.max_size:
+            if self.spill_dir is not None:
+                i = self._first_in_memory()
+                if i is not None:
+                    queued, queued_traces, queued_at = self._items[i]
+                    assert not isinstance(queued, _SpilledPayload)
+                    if self._spilled_size + len(queued) <= self.max_size:
+                        try:
+                            # Move the oldest payload in memory to the spill directory
+                            self._items[i] = (_SpilledPayload(self.spill_dir, queued), queued_traces, queued_at)
+                        except (IOError, OSError):
+                            log.warning("failed to spill payload to %s", self.spill_dir, exc_info=True)
+                        else:
+                            self._memory_size -= len(queued)
+                            self._spilled_size += len(queued)
+                            continue
+            dropped.append(self._drop(self._items.popleft()))
+        return dropped
+
+    def get(self):
+        # type: () -> Tuple[Optional[Tuple[bytes, int, float]], List[Tuple[int, int]]]
+        """Remove the oldest payload that has not expired from the queue.
+
+        Return the ``(payload, n_traces, queued_at)`` triple, or ``None`` if the
+        queue is empty, together with the list of expired payloads.
+        """
+        with self._lock:
+            dropped = self._expire(monotonic())
+            while self._items:
+                item = self._items.popleft()
+                payload, n_traces, queued_at = item
+                if not isinstance(payload, _SpilledPayload):
+                    self._memory_size -= len(payload)
+                    return (payload, n_traces, queued_at), dropped
+                self._spilled_size -= payload.size
+                try:
+                    data = payload.load()
+                except (IOError, OSError, ValueError):
+                    log.warning("failed to load spilled payload %s", payload.path, exc_info=True)
+                    dropped.append((payload.size, n_traces))
+                    continue
+                finally:
+                    payload.discard()
+                return (data, n_traces, queued_at), dropped
+            return None, dropped
+
+    def clear(self):
+        # type: () -> List[Tuple[int, int]]
+        """Drop all the queued payloads."""
+        with self._lock:
+            dropped = [self._drop(item) for item in self._items]
+            self._items.clear()
+            return dropped
@@ -0,0 +1,188 @@
+"""Recycling of the spans of the traces sent by the writer."""
+from collections import Counter
+from operator import attrgetter
+import platform
+import sys
+import sysconfig
+import threading
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+import weakref
+
+from six.moves._thread import get_ident
+
+from ddtrace.internal.logger import get_logger
+from ddtrace.span import Span
+
+
+log = get_logger(__name__)
+
+# Maximum number of traces whose finishing thread is tracked
+_MAX_PENDING_TRACES = 10000
+
+
+_get_parent = attrgetter("_parent")
+_get_local_root = attrgetter("_local_root")
+_get_duration_ns = attrgetter("duration_ns")
+
+
+def _total_refcount(trace):
+    # type: (List[Span]) -> int
+    return sum(map(sys.getrefcount, trace))
+
+
+# The value returned by _total_refcount for a span only referenced by its trace
+_UNREFERENCED = _total_refcount([Span("probe")])
+
+
+def _is_unreferenced(trace):
+    # type: (List[Span]) -> bool
+    """Return whether the spans of a trace are only referenced by the trace
+    and by the other spans of the trace.
+    """
+    internal_refs = Counter(map(id, map(_get_parent, trace)))
+    internal_refs.update(map(id, map(_get_local_root, trace)))
+    n_internal_refs = sum(internal_refs.get(id(span), 0) for span in trace)
+    # Each span has at least that many references, so any other reference to
+    # a span of the trace makes the total higher
+    return _total_refcount(trace) == _UNREFERENCED * len(trace) + n_internal_refs
+
+
+def _probe_trace():
+    # type: () -> List[Span]
+    root, child = Span("probe"), Span("probe")
+    root._local_root = child._local_root = child._parent = root
+    return [root, child]
+
+
+def _refcounts_reliable():
+    # type: () -> bool
+    """Return whether the reference counts of the interpreter tell the spans
+    referenced outside of their trace apart, as :func:`_is_unreferenced`
+    expects.
+    """
+    if platform.python_implementation() != "CPython" or sysconfig.get_config_var("Py_GIL_DISABLED"):
+        return False
+    trace = _probe_trace()
+    if not _is_unreferenced(trace):
+        return False
+    # References from a frame, a closure and a container must all be seen
+    kept = trace[1]
+    if _is_unreferenced(trace):
+        return False
+    del kept
+    get_child = (lambda span: lambda: span)(trace[1])
+    if _is_unreferenced(trace):
+        return False
+    del get_child
+    spans = {"child": trace[1]}
+    if _is_unreferenced(trace):
+        return False
+    del spans
+    return _is_unreferenced(trace)
+
+
+# Checked once, the reference counts only depend on the interpreter
+_REFCOUNTS_RELIABLE = _refcounts_reliable()
+
+
+class _FreeLists(threading.local):
+    def __init__(self):
+        # type: () -> None
+        self.free = []  # type: List[Span]
+        self.pending = None  # type: Optional[List[Span]]
+
+
+class SpanPool(object):
+    """Per-thread free lists of spans that can be reused by the tracer.
+
+    The writer gives the traces it has encoded to :meth:`recycle`. Only the
+    traces whose spans were all finished by the thread recycling them are
+    considered, as the other threads may still be running the code that
+    finished them. A trace is only checked the next time a trace is recycled
+    by the same thread, once the code that finished it has returned. Its spans
+    are added to the free list of the thread if nothing but the trace
+    references them, and :meth:`new_span` reinitializes them instead of
+    creating new spans.
+
+    Recycling is disabled on the interpreters whose reference counts do not
+    reveal all the references to a span, like PyPy or free-threaded builds.
+    Traces with spans that are weakly referenced, like by the profiler, are
+    never recycled. Recycling is disabled for good the first time a span of a
+    trace is still referenced, as this means that the application keeps
+    references to the spans it creates.
+    """
+
+    def __init__(self, max_size=1000):
+        # type: (int) -> None
+        self.max_size = max_size
+        self.enabled = _REFCOUNTS_RELIABLE
+        if not self.enabled:
+            log.debug("span recycling disabled, the reference counts of the interpreter cannot be relied on")
+        self._local = _FreeLists()
+        # trace id -> ident of the thread that finished its spans, None if
+        # they were finished by several threads
+        self._finished_by = {}  # type: Dict[int, Optional[int]]
+
+    def on_span_finish(self, span):
+        # type: (Span) -> None
+        """Record the thread finishing a span."""
+        if not self.enabled:
+            return
+        finished_by = self._finished_by
+        if len(finished_by) >= _MAX_PENDING_TRACES:
+            # Traces that are not sent, like the ones that are sampled out,
+            # are never recycled. Forget them all, in the worst case a few
+            # traces will not be recycled.
+            finished_by.clear()
+        thread = get_ident()
+        if finished_by.setdefault(span.trace_id, thread) != thread:
+            finished_by[span.trace_id] = None
+
+    def new_span(self, *args, **kwargs):
+        # type: (Any, Any) -> Span
+        """Return a span created with the given arguments, reusing a span of
+        the free list of the thread if there is one.
+        """
+        free = self._local.free
+        if free:
+            span = free.pop()
+            span.__init__(*args, **kwargs)  # type: ignore[misc]
+            return span
+        return Span(*args, **kwargs)
+
+    def recycle(self, trace):
+        # type: (List[Span]) -> None
+        """Recycle the spans of a trace that was encoded by the writer."""
+        if not self.enabled:
+            return
+
+        if self._finished_by.pop(trace[0].trace_id, None) != get_ident():
+            # Finished by another thread
+            return
+
+        local = self._local
+        previous = local.pending
+        local.pending = trace
+        if previous is None or len(local.free) + len(previous) > self.max_size:
+            return
+
+        if (
+            any(type(span) is not Span for span in previous)
+            or None in map(_get_duration_ns, previous)
+            or any(map(weakref.getweakrefcount, previous))
+        ):
+            return
+
+        if not _is_unreferenced(previous):
+            log.debug("span recycling disabled, the spans of a trace are still referenced after being sent")
+            self.enabled = False
+            return
+
+        for span in previous:
+            # Spans of the free lists must not reference each other, or they
+            # would look referenced by the application once reused
+            span._parent = span._local_root = None
+        local.free.extend(previous)
@@ -3,11 +3,12 @@ import time
 from typing import Dict
 from typing import List
 from typing import Optional
+from typing import Tuple
 
 from ...internal import atexit
 from ...internal import forksafe
 from ...settings import _config as config
-from ..agent import get_connection
+from ..agent import connection_pool
 from ..agent import get_trace_url
 from ..compat import get_connection_response
 from ..compat import httplib
@@ -50,6 +51,8 @@ class TelemetryWriter(PeriodicService):
         self._encoder = JSONEncoderV2()
         self._events_queue = []  # type: List[Dict]
         self._integrations_queue = []  # type: List[Dict]
+        # Sums of the count metrics by namespace, name and tags
+        self._metrics_queue = {}  # type: Dict[Tuple[str, str, Tuple[str, ...]], float]
         self._lock = forksafe.Lock()  # type: forksafe.ResetObject
         self._forked = False  # type: bool
 
@@ -64,12 +67,13 @@ class TelemetryWriter(PeriodicService):
         # type: (Dict) -> httplib.HTTPResponse
         """Sends a telemetry request to the trace agent"""
         with StopWatch() as sw:
-            try:
-                conn = get_connection(self._agent_url)
+            with connection_pool.connection(self._agent_url) as conn:
                 rb_json = self._encoder.encode(request)
                 conn.request("POST", self.ENDPOINT, rb_json, self._create_headers(request["request_type"]))
 
                 resp = get_connection_response(conn)
+                # The response must be read for the connection to be reused
+                resp.read()
                 log.debug(
                     "sent %d in %.5fs to %s/%s. response: %s",
                     len(rb_json),
@@ -79,8 +83,6 @@ class TelemetryWriter(PeriodicService):
                     resp.status,
                 )
                 return resp
-            finally:
-                conn.close()
 
     def _flush_integrations_queue(self):
         # type: () -> List[Dict]
@@ -90,6 +92,14 @@ class TelemetryWriter(PeriodicService):
             self._integrations_queue = []
         return integrations
 
+    def _flush_metrics_queue(self):
+        # type: () -> Dict[Tuple[str, str, Tuple[str, ...]], float]
+        """Returns the count metrics queued by add_count_metric"""
+        with self._lock:
+            metrics = self._metrics_queue
+            self._metrics_queue = {}
+        return metrics
+
     def _flush_events_queue(self):
         # type: () -> List[Dict]
         """Returns a list of all integrations queued by classmethods"""
@@ -103,12 +113,17 @@ class TelemetryWriter(PeriodicService):
         with self._lock:
             self._integrations_queue = []
             self._events_queue = []
+            self._metrics_queue = {}
 
     def periodic(self):
         integrations = self._flush_integrations_queue()
         if integrations:
             self._app_integrations_changed_event(integrations)
 
+        metrics = self._flush_metrics_queue()
+        if metrics:
+            self._generate_metrics_event(metrics)
+
         telemetry_requests = self._flush_events_queue()
 
         for telemetry_request in telemetry_requests:
@@ -182,6 +197,23 @@ class TelemetryWriter(PeriodicService):
             }
             self._integrations_queue.append(integration)
 
+    def add_count_metric(self, namespace, name, value=1, tags=None):
+        # type: (str, str, float, Optional[Dict[str, str]]) -> None
+        """
+        Adds a value to a count metric, which is sent with the next generate-metrics telemetry request
+
+        :param str namespace: namespace of the metric, like tracers
+        :param str name: name of the metric
+        :param float value: value to add to the metric
+        :param Dict tags: tags of the metric
+        """
+        with self._lock:
+            if self._enabled is not None and not self._enabled:
+                return
+
+            key = (namespace, name, tuple(sorted("%s:%s" % tag for tag in tags.items())) if tags else ())
+            self._metrics_queue[key] = self._metrics_queue.get(key, 0) + value
+
     def app_started_event(self):
         # type: () -> None
         """Sent when TelemetryWriter is enabled or forks"""
@@ -212,6 +244,24 @@ class TelemetryWriter(PeriodicService):
         }
         self.add_event(payload, "app-integrations-change")
 
+    def _generate_metrics_event(self, metrics):
+        # type: (Dict[Tuple[str, str, Tuple[str, ...]], float]) -> None
+        """Adds a Telemetry request per namespace with the count metrics queued since the last one"""
+        timestamp = int(time.time())
+        series = {}  # type: Dict[str, List[Dict]]
+        for (namespace, name, tags), value in metrics.items():
+            series.setdefault(namespace, []).append(
+                {
+                    "metric": name,
+                    "points": [[timestamp, value]],
+                    "tags": list(tags),
+                    "common": False,
+                    "type": "count",
+                }
+            )
+        for namespace, namespace_series in series.items():
+            self.add_event({"namespace": namespace, "series": namespace_series}, "generate-metrics")
+
     def _create_headers(self, payload_type):
         # type: (str) -> Dict
         """Creates request headers"""
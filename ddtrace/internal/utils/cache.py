@@ -1,6 +1,9 @@
-from threading import RLock
+from collections import OrderedDict
+from collections import namedtuple
+from threading import Lock
 from typing import Any
 from typing import Callable
+from typing import Dict
 from typing import Optional
 from typing import Type
 from typing import TypeVar
@@ -13,20 +16,46 @@ S = TypeVar("S")
 F = Callable[[T], S]
 M = Callable[[Any, T], S]
 
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+# Keys used more than this many times are all considered equally frequently used
+_MAX_USES = 64
+
 
 class LFUCache(dict):
     """Simple LFU cache implementation.
 
     This cache is designed for memoizing functions with a single hashable
-    argument. The eviction policy is LFU, i.e. the least frequently used values
-    are evicted when the cache is full. The amortized cost of shrinking the
-    cache when it grows beyond the requested size is O(log(size)).
+    argument. The eviction policy is LFU, i.e. the least frequently used value
+    is evicted when the cache is full, the oldest one first among the values
+    used as frequently.
+
+    The keys are kept in buckets by number of uses. Getting a value only counts
+    the use, and the keys are moved to the bucket of their number of uses when
+    they are about to be evicted, so that the amortized cost of evicting a
+    value is O(1).
+
+    Values are computed once, under the lock. Cache hits do not take the lock,
+    so the hit counter and the numbers of uses are approximate when threads
+    get values concurrently, as some of their updates may be lost. This only
+    affects the statistics and the choice of the value to evict.
     """
 
     def __init__(self, maxsize=256):
         # type: (int) -> None
         self.maxsize = maxsize
-        self.lock = RLock()
+        self.lock = Lock()
+        # Updated without the lock, approximate when threads get values concurrently
+        self.hits = 0
+        # Updated under the lock
+        self.misses = 0
+        # The bucket of the new keys
+        self._new = OrderedDict()  # type: OrderedDict
+        # Number of uses -> keys used at least that many times, oldest first
+        self._buckets = {1: self._new}  # type: Dict[int, OrderedDict]
+        # No bucket below this number of uses has keys
+        self._min_uses = 1
 
     def get(self, key, f):  # type: ignore[override]
         # type: (T, F) -> S
@@ -36,28 +65,72 @@ class LFUCache(dict):
         function ``f`` is called on the key to generate it. The return value is
         then stored in the cache and returned to the caller.
         """
-        if len(self) >= self.maxsize:
-            for _, h in zip(range(self.maxsize >> 1), sorted(self, key=lambda h: self[h][1])):
-                del self[h]
-
-        _ = super(LFUCache, self).get(key, miss)
-        if _ is not miss:
-            value, count = _
-            self[key] = (value, count + 1)
-            return value
+        # DEV: dict.get is used directly on the hot path, it is faster than super()
+        entry = dict.get(self, key, miss)  # type: Any
+        if entry is not miss:
+            self.hits += 1
+            entry[1] += 1
+            return entry[0]
 
         with self.lock:
-            _ = super(LFUCache, self).get(key, miss)
-            if _ is not miss:
-                value, count = _
-                self[key] = (value, count + 1)
-                return value
-
+            # Another thread may have computed the value in the meantime
+            entry = dict.get(self, key, miss)
+            if entry is not miss:
+                self.hits += 1
+                entry[1] += 1
+                return entry[0]
+
+            self.misses += 1
             value = f(key)
+            if len(self) >= self.maxsize and self:
+                self._evict()
+            self[key] = [value, 1]
+            self._new[key] = None
+            self._min_uses = 1
+
+        return value
+
+    def _evict(self):
+        # type: () -> None
+        """Evict the oldest of the least frequently used values."""
+        buckets = self._buckets
+        while True:
+            bucket = buckets.get(self._min_uses)
+            if not bucket:
+                self._min_uses += 1
+                continue
+
+            key, _ = bucket.popitem(last=False)
+            uses = self[key][1]
+            if uses > self._min_uses and self._min_uses < _MAX_USES:
+                # The key was used since it was put in this bucket
+                uses = min(uses, _MAX_USES)
+                other = buckets.get(uses)
+                if other is None:
+                    other = buckets[uses] = OrderedDict()
+                other[key] = None
+                continue
+
+            del self[key]
+            return
+
+    def clear(self):
+        # type: () -> None
+        """Remove all the values from the cache and reset the counters."""
+        with self.lock:
+            super(LFUCache, self).clear()
+            self._new.clear()
+            self._buckets = {1: self._new}
+            self._min_uses = 1
+            self.hits = self.misses = 0
 
-            self[key] = (value, 1)
+    def info(self):
+        # type: () -> CacheInfo
+        """Return the hit and miss counters, the maximum and the current size of the cache.
 
-            return value
+        The number of hits is approximate when threads use the cache concurrently.
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self))
 
 
 def cached(maxsize=256):
@@ -73,6 +146,7 @@ def cached(maxsize=256):
             return cache.get(key, f)
 
         cached_f.invalidate = cache.clear  # type: ignore[attr-defined]
+        cached_f.cache_info = cache.info  # type: ignore[attr-defined]
 
         return cached_f
 
@@ -1,16 +1,23 @@
 import abc
 import binascii
 from collections import defaultdict
+from collections import deque
 from json import loads
 import logging
 import os
 import sys
-import threading
+from typing import Any
+from typing import Callable
+from typing import Deque
 from typing import Dict
 from typing import List
 from typing import Optional
 from typing import TYPE_CHECKING
 from typing import TextIO
+from typing import Tuple
+from typing import Type
+from typing import Union
+import zlib
 
 import six
 import tenacity
@@ -20,6 +27,8 @@ from ddtrace.vendor.dogstatsd import DogStatsd
 
 from . import agent
 from . import compat
+from . import forksafe
+from . import nogevent
 from . import periodic
 from . import service
 from ..constants import KEEP_SPANS_RATE_KEY
@@ -30,19 +39,20 @@ from ..sampler import BasePrioritySampler
 from ..sampler import BaseSampler
 from ._encoding import BufferFull
 from ._encoding import BufferItemTooLarge
-from .agent import get_connection
+from ._encoding import MsgpackEncoderBase
 from .encoding import JSONEncoderV2
 from .encoding import MSGPACK_ENCODERS
+from .encoding import OTLPEncoder
 from .logger import get_logger
+from .retry_queue import PayloadRetryQueue
 from .runtime import container
 from .sma import SimpleMovingAverage
+from .span_pool import SpanPool
 
 
 if TYPE_CHECKING:
     from ddtrace import Span
 
-    from .agent import ConnectionType
-
 
 log = get_logger(__name__)
 
@@ -57,7 +67,60 @@ DEFAULT_SMA_WINDOW = 10
 DEFAULT_BUFFER_SIZE = 8 << 20  # 8 MB
 DEFAULT_MAX_PAYLOAD_SIZE = 8 << 20  # 8 MB
 DEFAULT_PROCESSING_INTERVAL = 1.0
-DEFAULT_REUSE_CONNECTIONS = False
+DEFAULT_REUSE_CONNECTIONS = True
+DEFAULT_BUFFER_FLUSH_THRESHOLD = 0.75
+DEFAULT_CONCURRENT_REQUESTS = 1
+DEFAULT_SPLIT_PAYLOAD_SIZE = 0  # disabled
+DEFAULT_SPLIT_PAYLOAD_TRACES = 0  # disabled
+DEFAULT_RETRY_QUEUE_SIZE = 0  # disabled
+DEFAULT_RETRY_QUEUE_MAX_AGE = 60.0
+# Upper bound of the delay between two attempts at draining the retry queue
+MAX_RETRY_QUEUE_BACKOFF = 30.0
+
+
+# A payload is made of segments that are sent one after the other. The
+# msgpack encoders hand over views on their internal buffers so that payloads
+# are not copied before being written to the socket.
+Payload = List[Union[bytes, memoryview]]
+
+# Uploads a payload with its number of traces, returns the error if it could not be sent
+_Upload = Callable[[Payload, int], Optional[tenacity.RetryError]]
+
+
+def _payload_size(payload):
+    # type: (Payload) -> int
+    return sum(len(segment) for segment in payload)
+
+
+def _join_payload(payload):
+    # type: (Payload) -> bytes
+    if six.PY2:
+        return b"".join(segment.tobytes() if isinstance(segment, memoryview) else segment for segment in payload)
+    return b"".join(payload)
+
+
+def _gzip_compress(payload, level):
+    # type: (Payload, Optional[int]) -> bytes
+    # A window size of 16 + MAX_WBITS produces a gzip container
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+    )
+    return b"".join([compressor.compress(segment) for segment in payload] + [compressor.flush()])
+
+
+def _zstd_compress(payload, level):
+    # type: (Payload, Optional[int]) -> bytes
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    return b"".join([compressor.compress(segment) for segment in payload] + [compressor.flush()])
+
+
+# Supported payload compressions by Content-Encoding
+COMPRESSORS = {
+    "gzip": _gzip_compress,
+    "zstd": _zstd_compress,
+}  # type: Dict[str, Callable[[Payload, Optional[int]], bytes]]
 
 
 def get_writer_buffer_size():
@@ -80,6 +143,52 @@ def get_writer_reuse_connections():
     return asbool(os.getenv("DD_TRACE_WRITER_REUSE_CONNECTIONS", DEFAULT_REUSE_CONNECTIONS))
 
 
+def get_writer_buffer_flush_threshold():
+    # type: () -> float
+    return float(os.getenv("DD_TRACE_WRITER_BUFFER_FLUSH_THRESHOLD", default=DEFAULT_BUFFER_FLUSH_THRESHOLD))
+
+
+def get_writer_concurrent_requests():
+    # type: () -> int
+    return int(os.getenv("DD_TRACE_WRITER_CONCURRENT_REQUESTS", default=DEFAULT_CONCURRENT_REQUESTS))
+
+
+def get_writer_split_payload_size():
+    # type: () -> int
+    return int(os.getenv("DD_TRACE_WRITER_SPLIT_PAYLOAD_SIZE_BYTES", default=DEFAULT_SPLIT_PAYLOAD_SIZE))
+
+
+def get_writer_split_payload_traces():
+    # type: () -> int
+    return int(os.getenv("DD_TRACE_WRITER_SPLIT_PAYLOAD_TRACES", default=DEFAULT_SPLIT_PAYLOAD_TRACES))
+
+
+def get_writer_retry_queue_size():
+    # type: () -> int
+    return int(os.getenv("DD_TRACE_WRITER_RETRY_QUEUE_SIZE_BYTES", default=DEFAULT_RETRY_QUEUE_SIZE))
+
+
+def get_writer_retry_queue_max_age():
+    # type: () -> float
+    return float(os.getenv("DD_TRACE_WRITER_RETRY_QUEUE_MAX_AGE_SECONDS", default=DEFAULT_RETRY_QUEUE_MAX_AGE))
+
+
+def get_writer_retry_queue_spill_dir():
+    # type: () -> Optional[str]
+    return os.getenv("DD_TRACE_WRITER_RETRY_QUEUE_SPILL_DIR") or None
+
+
+def get_writer_compression():
+    # type: () -> Optional[str]
+    return os.getenv("DD_TRACE_WRITER_COMPRESSION") or None
+
+
+def get_writer_compression_level():
+    # type: () -> Optional[int]
+    level = os.getenv("DD_TRACE_WRITER_COMPRESSION_LEVEL")
+    return int(level) if level else None
+
+
 def _human_size(nbytes):
     """Return a human-readable size."""
     i = 0
@@ -225,13 +334,116 @@ class LogWriter(TraceWriter):
         pass
 
 
-class AgentWriter(periodic.PeriodicService, TraceWriter):
+class _UploadBatch(object):
+    """The payloads of a flush uploaded by the upload workers and the flushing thread."""
+
+    __slots__ = ("errors", "exc_info", "_remaining", "_lock", "_done")
+
+    def __init__(self, n_payloads):
+        # type: (int) -> None
+        self.errors = []  # type: List[tenacity.RetryError]
+        # The first unexpected exception raised by an upload
+        self.exc_info = None  # type: Optional[Any]
+        self._remaining = n_payloads
+        # Real thread locks, the workers are real threads under gevent too
+        self._lock = nogevent.Lock()
+        self._done = nogevent.Lock()
+        self._done.acquire()
+        if not n_payloads:
+            self._done.release()
+
+    def run(self, upload, encoded, n_traces):
+        # type: (_Upload, Payload, int) -> None
+        try:
+            error = upload(encoded, n_traces)
+            if error is not None:
+                self.errors.append(error)
+        except Exception:
+            if self.exc_info is None:
+                self.exc_info = sys.exc_info()
+        finally:
+            with self._lock:
+                self._remaining -= 1
+                if not self._remaining:
+                    self._done.release()
+
+    def wait(self):
+        # type: () -> None
+        """Wait for all the payloads of the batch to be uploaded."""
+        self._done.acquire()
+
+
+class _UploadWorkers(object):
+    """Long-lived real threads uploading payloads alongside the thread flushing the writer.
+
+    At most ``size`` payloads wait for a worker, the flushing thread uploads the
+    next payloads itself when the queue is full. The threads are started on
+    the first upload.
+    """
+
+    def __init__(self, size, interval, name):
+        # type: (int, float, str) -> None
+        self.size = size
+        self._interval = interval
+        self._name = name
+        self._tasks = deque()  # type: Deque[Tuple[_UploadBatch, _Upload, Payload, int]]
+        self._threads = []  # type: List[periodic.PeriodicThread]
+
+    def _run_tasks(self):
+        # type: () -> None
+        while True:
+            try:
+                batch, upload, encoded, n_traces = self._tasks.popleft()
+            except IndexError:
+                return
+            batch.run(upload, encoded, n_traces)
+
+    def _wake(self):
+        # type: () -> None
+        if not self._threads:
+            thread_class = periodic.AwakeablePeriodicRealThreadClass()
+            self._threads = [
+                thread_class(self._interval, self._run_tasks, name="%s:%d" % (self._name, i)) for i in range(self.size)
+            ]
+            for thread in self._threads:
+                thread.start()
+        for thread in self._threads:
+            thread.awake(wait=False)  # type: ignore[attr-defined]
+
+    def upload(self, payloads, upload):
+        # type: (List[Tuple[Payload, int]], _Upload) -> _UploadBatch
+        """Upload the payloads and wait for them to be sent."""
+        batch = _UploadBatch(len(payloads))
+        for encoded, n_traces in payloads:
+            if len(self._tasks) < self.size:
+                self._tasks.append((batch, upload, encoded, n_traces))
+                self._wake()
+            else:
+                batch.run(upload, encoded, n_traces)
+        # Help with the payloads that are still waiting for a worker
+        self._run_tasks()
+        batch.wait()
+        return batch
+
+    def stop(self, timeout=None):
+        # type: (Optional[float]) -> None
+        threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.stop()
+        for thread in threads:
+            thread.join(timeout)
+
+
+class AgentWriter(periodic.AwakeablePeriodicService, TraceWriter):
     """Writer to the Datadog Agent.
 
     The Datadog Agent supports (at the time of writing this) receiving trace
     payloads up to 50MB. A trace payload is just a list of traces and the agent
     expects a trace to be complete. That is, all spans with the same trace_id
     should be in the same trace.
+
+    The buffer is flushed every processing interval, or as soon as its size
+    crosses the flush threshold, whichever comes first.
     """
 
     RETRY_ATTEMPTS = 3
@@ -253,6 +465,16 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
         api_version=None,  # type: Optional[str]
         reuse_connections=None,  # type: Optional[bool]
         headers=None,  # type: Optional[Dict[str, str]]
+        buffer_flush_threshold=None,  # type: Optional[float]
+        compression=None,  # type: Optional[str]
+        compression_level=None,  # type: Optional[int]
+        retry_queue_size=None,  # type: Optional[int]
+        retry_queue_max_age=None,  # type: Optional[float]
+        retry_queue_spill_dir=None,  # type: Optional[str]
+        concurrent_requests=None,  # type: Optional[int]
+        split_payload_size=None,  # type: Optional[int]
+        split_payload_traces=None,  # type: Optional[int]
+        span_pool=None,  # type: Optional[SpanPool]
     ):
         # type: (...) -> None
         # Pre-conditions:
@@ -260,11 +482,38 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
             raise ValueError("Writer buffer size must be positive")
         if max_payload_size is not None and max_payload_size <= 0:
             raise ValueError("Max payload size must be positive")
+        if buffer_flush_threshold is None:
+            buffer_flush_threshold = get_writer_buffer_flush_threshold()
+        if not 0 < buffer_flush_threshold <= 1:
+            raise ValueError("Buffer flush threshold must be in the range (0, 1]")
+        if concurrent_requests is None:
+            concurrent_requests = get_writer_concurrent_requests()
+        if concurrent_requests < 1:
+            raise ValueError("Concurrent requests must be positive")
 
         super(AgentWriter, self).__init__(interval=processing_interval)
         self.agent_url = agent_url
         self._buffer_size = buffer_size or get_writer_buffer_size()
         self._max_payload_size = max_payload_size or get_writer_max_payload_size()
+        self._buffer_flush_threshold = buffer_flush_threshold
+        # Size in bytes above which the periodic thread is awakened to flush
+        # the buffer before the end of the current interval.
+        self._buffer_flush_size = int(self._buffer_size * buffer_flush_threshold)
+        # The buffer can be split into several payloads that are uploaded
+        # concurrently. A value of 0 disables the corresponding limit.
+        self._concurrent_requests = concurrent_requests
+        self._upload_workers = (
+            _UploadWorkers(concurrent_requests - 1, processing_interval, "%s:upload" % self.__class__.__name__)
+            if concurrent_requests > 1
+            else None
+        )  # type: Optional[_UploadWorkers]
+        self._split_payload_size = get_writer_split_payload_size() if split_payload_size is None else split_payload_size
+        self._split_payload_traces = (
+            get_writer_split_payload_traces() if split_payload_traces is None else split_payload_traces
+        )
+        # Payloads are only uploaded concurrently once the agent has accepted
+        # one, so that API downgrades and compression fallbacks happen once.
+        self._payload_accepted = False
         self._sampler = sampler
         self._priority_sampler = priority_sampler
         self._headers = {
@@ -280,15 +529,40 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
         self._api_version = (
             api_version or os.getenv("DD_TRACE_API_VERSION") or ("v0.4" if priority_sampler is not None else "v0.3")
         )
-        try:
-            Encoder = MSGPACK_ENCODERS[self._api_version]
-        except KeyError:
-            raise ValueError(
-                "Unsupported api version: '%s'. The supported versions are: %r"
-                % (self._api_version, ", ".join(sorted(MSGPACK_ENCODERS.keys())))
-            )
+        if self._api_version == "otlp":
+            # Traces are exported to an OpenTelemetry collector with the
+            # OTLP/HTTP protocol instead of being sent to the Datadog agent.
+            Encoder = OTLPEncoder  # type: Union[Type[MsgpackEncoderBase], Type[OTLPEncoder]]
+            self._endpoint = "v1/traces"
+            self._method = "POST"
+        else:
+            try:
+                Encoder = MSGPACK_ENCODERS[self._api_version]
+            except KeyError:
+                raise ValueError(
+                    "Unsupported api version: '%s'. The supported versions are: %r"
+                    % (self._api_version, ", ".join(sorted(list(MSGPACK_ENCODERS.keys()) + ["otlp"])))
+                )
 
-        self._endpoint = "%s/traces" % self._api_version
+            self._endpoint = "%s/traces" % self._api_version
+            self._method = "PUT"
+
+        self._compression = compression or get_writer_compression()
+        self._compression_level = (
+            compression_level if compression_level is not None else get_writer_compression_level()
+        )
+        if self._compression is not None:
+            if self._compression not in COMPRESSORS:
+                raise ValueError(
+                    "Unsupported compression: '%s'. The supported compressions are: %s"
+                    % (self._compression, ", ".join(sorted(COMPRESSORS.keys())))
+                )
+            if self._compression == "zstd":
+                try:
+                    import zstandard  # noqa: F401
+                except ImportError:
+                    log.warning("zstd compression requires the zstandard package, disabling trace payload compression")
+                    self._compression = None
 
         self._container_info = container.get_container_info()
         if self._container_info and self._container_info.container_id:
@@ -308,14 +582,10 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
             self._headers.update(parse_tags_str(additional_header_str))
         self.dogstatsd = dogstatsd
         self._report_metrics = report_metrics
+        self._metrics_lock = forksafe.Lock()
         self._metrics_reset()
         self._drop_sma = SimpleMovingAverage(DEFAULT_SMA_WINDOW)
         self._sync_mode = sync_mode
-        self._conn = None  # type: Optional[ConnectionType]
-        # The connection has to be locked since there exists a race between
-        # the periodic thread of AgentWriter and other threads that might
-        # force a flush with `flush_queue()`.
-        self._conn_lck = threading.RLock()  # type: threading.RLock
         self._retry_upload = tenacity.Retrying(
             # Retry RETRY_ATTEMPTS times within the first half of the processing
             # interval, using a Fibonacci policy with jitter
@@ -328,14 +598,33 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
         self._log_error_payloads = asbool(os.environ.get("_DD_TRACE_WRITER_LOG_ERROR_PAYLOADS", False))
         self._reuse_connections = get_writer_reuse_connections() if reuse_connections is None else reuse_connections
 
+        # Payloads that could not be sent are kept in the retry queue, if
+        # enabled, and sent again on the next periodic ticks.
+        retry_queue_size = get_writer_retry_queue_size() if retry_queue_size is None else retry_queue_size
+        self._retry_queue = (
+            PayloadRetryQueue(
+                retry_queue_size,
+                get_writer_retry_queue_max_age() if retry_queue_max_age is None else retry_queue_max_age,
+                retry_queue_spill_dir or get_writer_retry_queue_spill_dir(),
+            )
+            if retry_queue_size > 0
+            else None
+        )  # type: Optional[PayloadRetryQueue]
+        self._retry_queue_failures = 0
+        self._retry_queue_next_attempt = 0.0
+        # The spans of the traces are recycled once encoded, if enabled
+        self._span_pool = span_pool
+
     @property
     def _agent_endpoint(self):
         return "{}/{}".format(self.agent_url, self._endpoint)
 
     def _metrics_dist(self, name, count=1, tags=None):
-        self._metrics[name]["count"] += count
-        if tags:
-            self._metrics[name]["tags"].extend(tags)
+        # Payloads can be sent concurrently by several threads
+        with self._metrics_lock:
+            self._metrics[name]["count"] += count
+            if tags:
+                self._metrics[name]["tags"].extend(tags)
 
     def _metrics_reset(self):
         self._metrics = defaultdict(lambda: {"count": 0, "tags": []})
@@ -377,42 +666,36 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
             report_metrics=self._report_metrics,
             sync_mode=self._sync_mode,
             api_version=self._api_version,
+            buffer_flush_threshold=self._buffer_flush_threshold,
+            compression=self._compression,
+            compression_level=self._compression_level,
+            retry_queue_size=self._retry_queue.max_size if self._retry_queue is not None else 0,
+            retry_queue_max_age=self._retry_queue.max_age if self._retry_queue is not None else None,
+            retry_queue_spill_dir=self._retry_queue.spill_dir if self._retry_queue is not None else None,
+            concurrent_requests=self._concurrent_requests,
+            split_payload_size=self._split_payload_size,
+            split_payload_traces=self._split_payload_traces,
+            span_pool=self._span_pool,
         )
 
-    def _reset_connection(self):
-        # type: () -> None
-        with self._conn_lck:
-            if self._conn:
-                self._conn.close()
-                self._conn = None
-
     def _put(self, data, headers):
-        # type: (bytes, Dict[str, str]) -> Response
+        # type: (Union[bytes, memoryview, Payload], Dict[str, str]) -> Response
         sw = StopWatch()
         sw.start()
-        with self._conn_lck:
-            if self._conn is None:
-                log.debug("creating new agent connection to %s with timeout %d", self.agent_url, self._timeout)
-                self._conn = get_connection(self.agent_url, self._timeout)
-            try:
-                self._conn.request("PUT", self._endpoint, data, headers)
-                resp = compat.get_connection_response(self._conn)
-                t = sw.elapsed()
-                if t >= self.interval:
-                    log_level = logging.WARNING
-                else:
-                    log_level = logging.DEBUG
-                log.log(log_level, "sent %s in %.5fs to %s", _human_size(len(data)), t, self._agent_endpoint)
-            except Exception:
-                # Always reset the connection when an exception occurs
-                self._reset_connection()
-                raise
+        # Connections are taken from the pool shared by all the clients of
+        # the agent, and are kept alive between flushes unless reusing
+        # connections is disabled.
+        with agent.connection_pool.connection(self.agent_url, self._timeout, reuse=self._reuse_connections) as conn:
+            conn.request(self._method, self._endpoint, data, headers)
+            resp = Response.from_http_response(compat.get_connection_response(conn))
+            t = sw.elapsed()
+            if t >= self.interval:
+                log_level = logging.WARNING
             else:
-                return Response.from_http_response(resp)
-            finally:
-                # Reset the connection if reusing connections is disabled.
-                if not self._reuse_connections:
-                    self._reset_connection()
+                log_level = logging.DEBUG
+            size = _payload_size(data) if isinstance(data, list) else len(data)
+            log.log(log_level, "sent %s in %.5fs to %s", _human_size(size), t, self._agent_endpoint)
+            return resp
 
     def _downgrade(self, payload, response):
         if self._endpoint == "v0.5/traces":
@@ -438,19 +721,48 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
         raise ValueError()
 
     def _send_payload(self, payload, count):
+        # type: (Payload, int) -> None
         headers = self._headers.copy()
         headers["X-Datadog-Trace-Count"] = str(count)
 
+        compression = self._compression
+        if compression is not None:
+            data = COMPRESSORS[compression](payload, self._compression_level)  # type: Union[bytes, memoryview, Payload]
+            headers["Content-Encoding"] = compression
+            size = len(data)
+        else:
+            size = _payload_size(payload)
+            if len(payload) == 1:
+                data = payload[0]
+            elif six.PY2:
+                data = _join_payload(payload)
+            else:
+                # The segments are sent one after the other by the connection,
+                # which would otherwise use a chunked transfer encoding.
+                data = payload
+                headers["Content-Length"] = str(size)
+
         self._metrics_dist("http.requests")
 
-        response = self._put(payload, headers)
+        response = self._put(data, headers)
 
         if response.status >= 400:
             self._metrics_dist("http.errors", tags=["type:%s" % response.status])
         else:
-            self._metrics_dist("http.sent.bytes", len(payload))
+            self._metrics_dist("http.sent.bytes", size)
+            self._payload_accepted = True
 
-        if response.status in [404, 415]:
+        if response.status == 415 and compression is not None:
+            # The agent does not accept compressed payloads: send the payload
+            # again uncompressed before considering an API downgrade.
+            log.debug(
+                "calling endpoint '%s' with %s content encoding but received 415; disabling compression",
+                self._endpoint,
+                compression,
+            )
+            self._compression = None
+            self._send_payload(payload, count)
+        elif response.status in [404, 415]:
             log.debug("calling endpoint '%s' but received %s; downgrading API", self._endpoint, response.status)
             try:
                 payload = self._downgrade(payload, response)
@@ -470,20 +782,21 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
                 self._agent_endpoint,
                 response.status,
                 response.reason,
-            )
+            )  # type: Tuple[Any, ...]
             # Append the payload if requested
             if self._log_error_payloads:
                 msg += ", payload %s"
                 # If the payload is bytes then hex encode the value before logging
-                if isinstance(payload, six.binary_type):
-                    log_args += (binascii.hexlify(payload).decode(),)
+                if all(isinstance(segment, (six.binary_type, memoryview)) for segment in payload):
+                    log_args += (binascii.hexlify(_join_payload(payload)).decode(),)
                 else:
-                    log_args += (payload,)
+                    log_args += (payload[0] if len(payload) == 1 else payload,)
 
             log.error(msg, *log_args)
-            self._metrics_dist("http.dropped.bytes", len(payload))
+            self._metrics_dist("http.dropped.bytes", _payload_size(payload))
             self._metrics_dist("http.dropped.traces", count)
-        elif self._priority_sampler or isinstance(self._sampler, BasePrioritySampler):
+        elif self._api_version != "otlp" and (self._priority_sampler or isinstance(self._sampler, BasePrioritySampler)):
+            # OTLP collectors do not return sampling rates
             result_traces_json = response.get_json()
             if result_traces_json and "rate_by_service" in result_traces_json:
                 try:
@@ -536,19 +849,40 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
             )
             self._metrics_dist("buffer.dropped.traces", 1, tags=["reason:full"])
             self._metrics_dist("buffer.dropped.bytes", payload_size, tags=["reason:full"])
+            self._request_flush()
         else:
             self._metrics_dist("buffer.accepted.traces", 1)
             self._metrics_dist("buffer.accepted.spans", len(spans))
             if self._sync_mode:
                 self.flush_queue()
+            elif self._encoder.size >= self._buffer_flush_size:
+                self._request_flush()
+
+        if self._span_pool is not None:
+            self._span_pool.recycle(spans)
+
+    def _request_flush(self):
+        # type: () -> None
+        """Awake the periodic thread to flush the buffer without waiting for the next interval."""
+        if self._sync_mode is False and self._worker is not None and self.status == service.ServiceStatus.RUNNING:
+            # Do not wait for the flush to happen as this is called from the
+            # threads that finish traces.
+            self.awake(wait=False)
 
     def flush_queue(self, raise_exc=False):
         # type: (bool) -> None
         try:
             try:
                 n_traces = len(self._encoder)
-                encoded = self._encoder.encode()
-                if encoded is None:
+                if self._split_payload_size or self._split_payload_traces:
+                    payloads = self._encoder.encode_split(
+                        min(self._split_payload_size or self._max_payload_size, self._max_payload_size),
+                        self._split_payload_traces,
+                    )
+                else:
+                    encoded = self._encode()
+                    payloads = [(encoded, n_traces)] if encoded is not None else None
+                if payloads is None:
                     return
             except Exception:
                 log.error("failed to encode trace with encoder %r", self._encoder, exc_info=True)
@@ -556,22 +890,18 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
                 return
 
             try:
-                self._retry_upload(self._send_payload, encoded, n_traces)
-            except tenacity.RetryError as e:
-                self._metrics_dist("http.errors", tags=["type:err"])
-                self._metrics_dist("http.dropped.bytes", len(encoded))
-                self._metrics_dist("http.dropped.traces", n_traces)
-                if raise_exc:
-                    e.reraise()
-                else:
-                    log.error("failed to send traces to Datadog Agent at %s", self._agent_endpoint, exc_info=True)
+                errors = self._upload_payloads(payloads, raise_exc)
+                if errors and raise_exc:
+                    errors[0].reraise()
             finally:
                 if self._report_metrics and self.dogstatsd:
                     # Note that we cannot use the batching functionality of dogstatsd because
                     # it's not thread-safe.
                     # https://github.com/DataDog/datadogpy/issues/439
                     # This really isn't ideal as now we're going to do a ton of socket calls.
-                    self.dogstatsd.distribution("datadog.tracer.http.sent.bytes", len(encoded))
+                    self.dogstatsd.distribution(
+                        "datadog.tracer.http.sent.bytes", sum(_payload_size(p) for p, _ in payloads)
+                    )
                     self.dogstatsd.distribution("datadog.tracer.http.sent.traces", n_traces)
                     for name, metric in self._metrics.items():
                         self.dogstatsd.distribution("datadog.tracer.%s" % name, metric["count"], tags=metric["tags"])
@@ -579,7 +909,116 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
             self._set_drop_rate()
             self._metrics_reset()
 
+    def _encode(self):
+        # type: () -> Optional[Payload]
+        try:
+            encode_segments = self._encoder.encode_segments
+        except AttributeError:
+            # Encoders are only required to implement encode()
+            encoded = self._encoder.encode()
+            return [encoded] if encoded is not None else None
+        return encode_segments()
+
+    def _upload_payload(self, encoded, n_traces, raise_exc):
+        # type: (Payload, int, bool) -> Optional[tenacity.RetryError]
+        try:
+            self._retry_upload(self._send_payload, encoded, n_traces)
+        except tenacity.RetryError as e:
+            self._metrics_dist("http.errors", tags=["type:err"])
+            if self._retry_queue is not None:
+                self._record_dropped_payloads(self._retry_queue.put(_join_payload(encoded), n_traces))
+                self._backoff_retry_queue()
+            else:
+                self._record_dropped_payloads([(_payload_size(encoded), n_traces)])
+            if not raise_exc:
+                log.error("failed to send traces to Datadog Agent at %s", self._agent_endpoint, exc_info=True)
+            return e
+        return None
+
+    def _upload_payloads(self, payloads, raise_exc):
+        # type: (List[Tuple[Payload, int]], bool) -> List[tenacity.RetryError]
+        """Upload the payloads with at most ``concurrent_requests`` requests in flight.
+
+        The calling thread takes part in the upload. Return the errors of the
+        payloads that could not be sent.
+        """
+        errors = []  # type: List[tenacity.RetryError]
+        pending = deque(payloads)
+
+        if self._concurrent_requests == 1 or not self._payload_accepted:
+            encoded, n_traces = pending.popleft()
+            error = self._upload_payload(encoded, n_traces, raise_exc)
+            if error is not None:
+                errors.append(error)
+            if self._concurrent_requests == 1:
+                for encoded, n_traces in pending:
+                    error = self._upload_payload(encoded, n_traces, raise_exc)
+                    if error is not None:
+                        errors.append(error)
+                return errors
+
+        if not pending or self._upload_workers is None:
+            return errors
+
+        def upload(encoded, n_traces):
+            # type: (Payload, int) -> Optional[tenacity.RetryError]
+            return self._upload_payload(encoded, n_traces, raise_exc)
+
+        batch = self._upload_workers.upload(list(pending), upload)
+        errors.extend(batch.errors)
+        if batch.exc_info is not None:
+            if raise_exc:
+                six.reraise(*batch.exc_info)
+            log.error("failed to send traces to Datadog Agent at %s", self._agent_endpoint, exc_info=batch.exc_info)
+        return errors
+
+    def _record_dropped_payloads(self, dropped):
+        # type: (List[Tuple[int, int]]) -> None
+        for size, n_traces in dropped:
+            self._metrics_dist("http.dropped.bytes", size)
+            self._metrics_dist("http.dropped.traces", n_traces)
+
+    def _backoff_retry_queue(self):
+        # type: () -> None
+        self._retry_queue_failures += 1
+        delay = min(self.interval * (2 ** (self._retry_queue_failures - 1)), MAX_RETRY_QUEUE_BACKOFF)
+        self._retry_queue_next_attempt = compat.monotonic() + delay
+
+    def _flush_retry_queue(self, force=False):
+        # type: (bool) -> None
+        """Send the payloads of the retry queue, oldest first.
+
+        Each payload is sent once: on failure it is put back at the front of
+        the queue and draining is delayed with an exponential backoff.
+        """
+        if self._retry_queue is None or (not force and compat.monotonic() < self._retry_queue_next_attempt):
+            return
+
+        while True:
+            item, dropped = self._retry_queue.get()
+            self._record_dropped_payloads(dropped)
+            if item is None:
+                break
+            payload, n_traces, queued_at = item
+            try:
+                self._send_payload([payload], n_traces)
+            except (compat.httplib.HTTPException, OSError, IOError):
+                log.debug("failed to send queued traces to Datadog Agent at %s", self._agent_endpoint, exc_info=True)
+                self._metrics_dist("http.errors", tags=["type:err"])
+                self._record_dropped_payloads(self._retry_queue.requeue(payload, n_traces, queued_at))
+                self._backoff_retry_queue()
+                break
+            self._retry_queue_failures = 0
+
     def periodic(self):
+        self._flush_retry_queue()
+        if not len(self._encoder) and not any(
+            metric in self._metrics
+            for metric in ("buffer.dropped.traces", "encoder.dropped.traces", "http.dropped.traces")
+        ):
+            # Nothing to flush nor to report. This also happens when the
+            # periodic thread starts.
+            return
         self.flush_queue(raise_exc=False)
 
     def _stop_service(  # type: ignore[override]
@@ -590,9 +1029,11 @@ class AgentWriter(periodic.PeriodicService, TraceWriter):
         # FIXME: don't join() on stop(), let the caller handle this
         super(AgentWriter, self)._stop_service()
         self.join(timeout=timeout)
+        if self._upload_workers is not None:
+            self._upload_workers.stop(timeout)
 
     def on_shutdown(self):
-        try:
-            self.periodic()
-        finally:
-            self._reset_connection()
+        self._flush_retry_queue(force=True)
+        self.periodic()
+        if self._retry_queue is not None:
+            self._record_dropped_payloads(self._retry_queue.clear())
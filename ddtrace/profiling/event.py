@@ -59,7 +59,7 @@ class StackBasedEvent(SampleEvent):
     local_root_span_id = attr.ib(default=None, type=typing.Optional[int])
     span_id = attr.ib(default=None, type=typing.Optional[int])
     trace_type = attr.ib(default=None, type=typing.Optional[str])
-    trace_resource_container = attr.ib(default=None, type=typing.List[str])
+    trace_resource_container = attr.ib(default=None, type=typing.List[typing.Optional[str]])
 
     def set_trace_info(
         self,
@@ -73,4 +73,4 @@ class StackBasedEvent(SampleEvent):
                 self.local_root_span_id = span._local_root.span_id
                 self.trace_type = span._local_root.span_type
                 if endpoint_collection_enabled:
-                    self.trace_resource_container = span._local_root._resource
+                    self.trace_resource_container = span._local_root._get_resource_container()
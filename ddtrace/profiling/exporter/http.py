@@ -210,21 +210,18 @@ class PprofHTTPExporter(pprof.PprofExporter):
         )
         headers["Content-Type"] = content_type
 
-        client = agent.get_connection(self.endpoint, self.timeout)
-        self._upload(client, self.endpoint_path, body, headers)
+        self._upload(self.endpoint_path, body, headers)
 
         return profile, libs
 
-    def _upload(self, client, path, body, headers):
-        self._retry_upload(self._upload_once, client, path, body, headers)
+    def _upload(self, path, body, headers):
+        self._retry_upload(self._upload_once, path, body, headers)
 
-    def _upload_once(self, client, path, body, headers):
-        try:
+    def _upload_once(self, path, body, headers):
+        with agent.connection_pool.connection(self.endpoint, self.timeout) as client:
             client.request("POST", path, body=body, headers=headers)
             response = client.getresponse()
             response.read()  # reading is mandatory
-        finally:
-            client.close()
 
         if 200 <= response.status < 300:
             return
@@ -657,7 +657,9 @@ class PprofExporter(exporter.Exporter):
         trace_resource = ""
         # Do not export trace_resource for non Web spans for privacy concerns.
         if event.trace_resource_container and event.trace_type == ext.SpanTypes.WEB:
-            (trace_resource,) = event.trace_resource_container
+            (resource,) = event.trace_resource_container
+            if resource is not None:
+                trace_resource = resource
         return ensure_str(trace_resource, errors="backslashreplace")
 
     def export(
@@ -21,6 +21,7 @@ from ..internal.compat import ensure_text
 from ..internal.constants import PROPAGATION_STYLE_B3
 from ..internal.constants import PROPAGATION_STYLE_B3_SINGLE_HEADER
 from ..internal.constants import PROPAGATION_STYLE_DATADOG
+from ..internal.constants import SAMPLING_DECISION_PROPAGATED_KEY
 from ..internal.logger import get_logger
 from ..internal.sampling import validate_sampling_decision
 from ..span import _MetaDictType
@@ -511,6 +512,9 @@ class HTTPPropagator(object):
             log.debug("tried to inject invalid context %r", span_context)
             return
 
+        if config._tail_sampling_enabled:
+            # Tail sampling must not change a decision that downstream services follow
+            span_context._meta[SAMPLING_DECISION_PROPAGATED_KEY] = "1"
         if PROPAGATION_STYLE_DATADOG in config._propagation_style_inject:
             _DatadogMultiHeader._inject(span_context, headers)
         if PROPAGATION_STYLE_B3 in config._propagation_style_inject:
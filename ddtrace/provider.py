@@ -2,6 +2,7 @@ import abc
 from typing import Any
 from typing import Callable
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 import six
@@ -16,9 +17,25 @@ from .span import Span
 log = get_logger(__name__)
 
 
+# The active span or context, with the entry that was active before it if it
+# is to be active again once the span finishes: None to fall back to the
+# parents of the span, and _NOTHING_ACTIVE if nothing is.
+_ActiveEntry = Tuple[Optional[Union[Context, Span]], Optional["_ActiveEntry"]]
+
+_NOTHING_ACTIVE = (None, None)
+
 _DD_CONTEXTVAR = contextvars.ContextVar(
     "datadog_contextvar", default=None
-)  # type: contextvars.ContextVar[Optional[Union[Context, Span]]]
+)  # type: contextvars.ContextVar[Optional[_ActiveEntry]]
+
+
+def _get_active():
+    # type: () -> Optional[Union[Context, Span]]
+    """Return the span or context made active in the current execution, even
+    if it is a span that has finished since.
+    """
+    entry = _DD_CONTEXTVAR.get()
+    return entry[0] if entry is not None else None
 
 
 class BaseContextProvider(six.with_metaclass(abc.ABCMeta)):
@@ -73,6 +90,14 @@ class BaseContextProvider(six.with_metaclass(abc.ABCMeta)):
         self._hooks.deregister(self.activate, func)
         return func
 
+    def _current_span(self):
+        # type: () -> Optional[Span]
+        """Return the active span, or ``None`` if there is none or if the active
+        item is a context.
+        """
+        active = self.active()
+        return active if isinstance(active, Span) else None
+
     def __call__(self, *args, **kwargs):
         """Method available for backward-compatibility. It proxies the call to
         ``self.active()`` and must not do anything more.
@@ -110,6 +135,10 @@ class DefaultContextProvider(BaseContextProvider, DatadogContextMixin):
 
     It is suitable for synchronous programming and for asynchronous executors
     that support contextvars.
+
+    The context variable holds a stack of the active spans: a span activated
+    while its parent is active is linked to the parent's entry, so that the
+    parent is active again in constant time once the span finishes.
     """
 
     def __init__(self):
@@ -120,19 +149,57 @@ class DefaultContextProvider(BaseContextProvider, DatadogContextMixin):
     def _has_active_context(self):
         # type: () -> bool
         """Returns whether there is an active context in the current execution."""
-        ctx = _DD_CONTEXTVAR.get()
-        return ctx is not None
+        return _get_active() is not None
 
     def activate(self, ctx):
         # type: (Optional[Union[Span, Context]]) -> None
         """Makes the given context active in the current execution."""
-        _DD_CONTEXTVAR.set(ctx)
+        if ctx is None:
+            _DD_CONTEXTVAR.set(None)
+        elif isinstance(ctx, Span):
+            entry = _DD_CONTEXTVAR.get()
+            parent = ctx._parent
+            if parent is None:
+                previous = _NOTHING_ACTIVE  # type: Optional[_ActiveEntry]
+            elif entry is not None and entry[0] is parent:
+                previous = entry
+            else:
+                previous = None
+            _DD_CONTEXTVAR.set((ctx, previous))
+        else:
+            _DD_CONTEXTVAR.set((ctx, _NOTHING_ACTIVE))
         super(DefaultContextProvider, self).activate(ctx)
 
     def active(self):
         # type: () -> Optional[Union[Context, Span]]
         """Returns the active span or context for the current execution."""
-        item = _DD_CONTEXTVAR.get()
-        if isinstance(item, Span):
-            return self._update_active(item)
+        entry = _DD_CONTEXTVAR.get()
+        if entry is None:
+            return None
+        item = entry[0]
+        if not isinstance(item, Span) or item.duration_ns is None:
+            return item
+
+        # Go back to the first unfinished span
+        while item is not None and isinstance(item, Span) and item.duration_ns is not None:
+            previous = entry[1]
+            if previous is None:
+                # The parent of the span was not active when it was activated
+                return self._update_active(item)
+            entry = previous
+            item = entry[0]
+        _DD_CONTEXTVAR.set(entry if item is not None else None)
+        BaseContextProvider.activate(self, item)
         return item
+
+    def _current_span(self):
+        # type: () -> Optional[Span]
+        entry = _DD_CONTEXTVAR.get()
+        if entry is None:
+            return None
+        item = entry[0]
+        if not isinstance(item, Span):
+            return None
+        if item.duration_ns is None:
+            return item
+        return super(DefaultContextProvider, self)._current_span()
@@ -5,6 +5,7 @@ Any `sampled = False` trace won't be written, and can be ignored by the instrume
 import abc
 import json
 import os
+import re
 from typing import Any
 from typing import Dict
 from typing import List
@@ -214,7 +215,7 @@ class DatadogSampler(RateByServiceSampler):
     provided. It is not used when the agent supplied sample rates are used.
     """
 
-    __slots__ = ("limiter", "rules", "_default_sampler")
+    __slots__ = ("limiter", "rules", "_default_sampler", "_rule_matcher")
 
     NO_RATE_LIMIT = -1
     DEFAULT_RATE_LIMIT = 100
@@ -268,6 +269,8 @@ class DatadogSampler(RateByServiceSampler):
         if default_sample_rate is not None:
             self.rules.append(SamplingRule(sample_rate=default_sample_rate))
 
+        self._rule_matcher = _SamplingRuleMatcher(self.rules)
+
         # Configure rate limiter
         self.limiter = RateLimiter(rate_limit)
 
@@ -340,23 +343,17 @@ class DatadogSampler(RateByServiceSampler):
         :returns: Whether the span was sampled or not
         :rtype: :obj:`bool`
         """
-        # If there are rules defined, then iterate through them and find one that wants to sample
-        sampler = None  # type: Optional[Union[SamplingRule, RateLimiter]]
-
-        # Go through all rules and grab the first one that matched
+        # Grab the first rule that matches
         # DEV: This means rules should be ordered by the user from most specific to least specific
-        for rule in self.rules:
-            if rule.matches(span):
-                sampler = rule
-                break
-        else:
+        matcher = self._rule_matcher
+        if matcher.rules is not self.rules or matcher.size != len(self.rules):
+            # The rules were changed since they were compiled
+            matcher = self._rule_matcher = _SamplingRuleMatcher(self.rules)
+        sampler = matcher.match(span)  # type: Optional[SamplingRule]
+        if sampler is None:
             # No rules matches so use agent based sampling
             return super(DatadogSampler, self).sample(span)
 
-        # DEV: This should never happen, but since the type is Optional we have to check
-        if not sampler:
-            raise SamplingError("No sampling rule found for span {!r} from {!r}".format(span, self))
-
         sampled = sampler.sample(span)
         self._set_sampler_decision(span, sampler, sampled)
 
@@ -522,3 +519,137 @@ class SamplingRule(BaseSampler):
             raise TypeError("Cannot compare SamplingRule to {}".format(type(other)))
 
         return self.sample_rate == other.sample_rate and self.service == other.service and self.name == other.name
+
+
+# Maximum number of patterns merged in a single regular expression, Python 2
+# supports at most 100 groups per regular expression
+_MAX_MERGED_PATTERNS = 99
+
+# Flags of the regular expressions compiled without any flag
+_DEFAULT_PATTERN_FLAGS = re.compile("").flags
+
+
+class _SamplingRuleMatcher(object):
+    """The rules of a :class:`DatadogSampler` compiled for finding the first
+    rule that matches a span without evaluating all of them.
+
+    The rules matching exact values, or any value, of the service and name are
+    indexed by these values. The regular expressions of the rules matching a
+    single property are merged into a single regular expression for that
+    property. The rules with callables, and the other rules, are evaluated
+    last, only if they come before the first matching rule found so far.
+
+    The index of the first matching rule is cached by service and name, except
+    for the rules of sub-classes of :class:`SamplingRule`, that are evaluated
+    for each span.
+    """
+
+    def __init__(self, rules):
+        # type: (List[SamplingRule]) -> None
+        self.rules = rules
+        self.size = len(rules)
+        # (service, name) -> index of the first rule with these exact values,
+        # with NO_RULE for the properties matching any value
+        self._exact = {}  # type: Dict[Tuple[Any, Any], int]
+        # The rules evaluated one by one, in order
+        self._others = []  # type: List[Tuple[int, SamplingRule]]
+        self._subclasses = []  # type: List[Tuple[int, SamplingRule]]
+
+        service_patterns = []  # type: List[Tuple[int, Any]]
+        name_patterns = []  # type: List[Tuple[int, Any]]
+        for index, rule in enumerate(rules):
+            if type(rule) is not SamplingRule:
+                self._subclasses.append((index, rule))
+            elif self._is_exact(rule.service) and self._is_exact(rule.name):
+                self._exact.setdefault((rule.service, rule.name), index)
+            elif self._is_mergeable(rule.service) and rule.name is SamplingRule.NO_RULE:
+                service_patterns.append((index, rule.service))
+            elif rule.service is SamplingRule.NO_RULE and self._is_mergeable(rule.name):
+                name_patterns.append((index, rule.name))
+            else:
+                self._others.append((index, rule))
+
+        # The merged regular expressions of the service and name, with the
+        # index of the rule of each group of the regular expressions
+        self._service_patterns = self._merge_patterns(service_patterns)
+        self._name_patterns = self._merge_patterns(name_patterns)
+
+    @staticmethod
+    def _is_exact(pattern):
+        # type: (Any) -> bool
+        return pattern is SamplingRule.NO_RULE or pattern is None or isinstance(pattern, six.string_types)
+
+    @staticmethod
+    def _is_mergeable(pattern):
+        # type: (Any) -> bool
+        # Patterns with groups of their own could have back references that
+        # would not point to the same groups once merged
+        return (
+            isinstance(pattern, pattern_type)
+            and isinstance(pattern.pattern, six.string_types)
+            and pattern.flags == _DEFAULT_PATTERN_FLAGS
+            and not pattern.groups
+        )
+
+    @staticmethod
+    def _merge_patterns(patterns):
+        # type: (List[Tuple[int, Any]]) -> List[Tuple[Any, List[int]]]
+        merged = []
+        for i in range(0, len(patterns), _MAX_MERGED_PATTERNS):
+            chunk = patterns[i : i + _MAX_MERGED_PATTERNS]
+            # The first alternative that matches is the one of the first rule
+            regex = re.compile("|".join("(%s)" % pattern.pattern for _, pattern in chunk))
+            merged.append((regex, [index for index, _ in chunk]))
+        return merged
+
+    def _match_patterns(self, patterns, prop):
+        # type: (List[Tuple[Any, List[int]]], Any) -> Optional[int]
+        if not patterns:
+            return None
+        try:
+            value = str(prop)
+        except (ValueError, TypeError):
+            log.warning("failed to match sampling rules on %r", prop, exc_info=True)
+            return None
+        for regex, indexes in patterns:
+            match = regex.match(value)
+            if match is not None:
+                return indexes[match.lastindex - 1]
+        return None
+
+    @cachedmethod()
+    def _match_key(self, key):
+        # type: (Tuple[Optional[str], str]) -> int
+        """Return the index of the first rule matching the service and name,
+        the number of rules if there is none.
+        """
+        service, name = key
+        exact = self._exact
+        NO_RULE = SamplingRule.NO_RULE
+        candidates = [
+            exact.get((service, name)),
+            exact.get((service, NO_RULE)),
+            exact.get((NO_RULE, name)),
+            exact.get((NO_RULE, NO_RULE)),
+            self._match_patterns(self._service_patterns, service),
+            self._match_patterns(self._name_patterns, name),
+        ]
+        first = min([index for index in candidates if index is not None] or [self.size])
+
+        for index, rule in self._others:
+            if index >= first:
+                break
+            if rule._pattern_matches(service, rule.service) and rule._pattern_matches(name, rule.name):
+                return index
+        return first
+
+    def match(self, span):
+        # type: (Span) -> Optional[SamplingRule]
+        """Return the first rule that matches the span, if any."""
+        first = self._match_key((span.service, span.name))
+        for index, rule in self._subclasses:
+            if index >= first:
+                break
+            if rule.matches(span):
+                return rule
+        return self.rules[first] if first < self.size else None
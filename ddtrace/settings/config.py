@@ -208,6 +208,11 @@ class Config(object):
         # Raise certain errors only if in testing raise mode to prevent crashing in production with non-critical errors
         self._raise = asbool(os.getenv("DD_TESTING_RAISE", False))
         self._trace_compute_stats = asbool(os.getenv("DD_TRACE_COMPUTE_STATS", False))
+        self._trace_stats_max_keys = int(os.getenv("DD_TRACE_STATS_MAX_AGGREGATION_KEYS", default=5000))
+        self._128_bit_trace_id_enabled = asbool(os.getenv("DD_TRACE_128_BIT_TRACEID_GENERATION_ENABLED", False))
+        self._tail_sampling_enabled = asbool(os.getenv("DD_TRACE_TAIL_SAMPLING_ENABLED", False))
+        self._tail_sampling_rate_limit = int(os.getenv("DD_TRACE_TAIL_SAMPLING_RATE_LIMIT", default=10))
+        self._tail_sampling_latency_quantile = float(os.getenv("DD_TRACE_TAIL_SAMPLING_LATENCY_QUANTILE", default=0.99))
         self._appsec_enabled = asbool(os.getenv("DD_APPSEC_ENABLED", False))
 
     def __getattr__(self, name):
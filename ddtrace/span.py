@@ -7,6 +7,7 @@ from typing import Callable
 from typing import Dict
 from typing import List
 from typing import Optional
+from typing import Sequence
 from typing import Text
 from typing import Union
 
@@ -28,7 +29,7 @@ from .constants import VERSION_KEY
 from .context import Context
 from .ext import http
 from .ext import net
-from .internal import _rand
+from .internal._rand import rand64bits
 from .internal.compat import NumericType
 from .internal.compat import StringIO
 from .internal.compat import ensure_text
@@ -57,6 +58,7 @@ class Span(object):
         "service",
         "name",
         "_resource",
+        "_resource_container",
         "span_id",
         "trace_id",
         "parent_id",
@@ -89,7 +91,7 @@ class Span(object):
         parent_id=None,  # type: Optional[int]
         start=None,  # type: Optional[int]
         context=None,  # type: Optional[Context]
-        on_finish=None,  # type: Optional[List[Callable[[Span], None]]]
+        on_finish=None,  # type: Optional[Sequence[Callable[[Span], None]]]
     ):
         # type: (...) -> None
         """
@@ -124,23 +126,26 @@ class Span(object):
         # required span info
         self.name = name
         self.service = service
-        self._resource = [resource or name]
+        self._resource = resource or name  # type: Optional[str]
+        self._resource_container = None  # type: Optional[List[Optional[str]]]
         self.span_type = span_type
 
         # tags / metadata
-        self._meta = {}  # type: _MetaDictType
+        # DEV: the dictionaries are only allocated when the first tag or
+        #      metric is set, as many spans never get any
+        self._meta = None  # type: Optional[_MetaDictType]
         self.error = 0
-        self._metrics = {}  # type: _MetricDictType
+        self._metrics = None  # type: Optional[_MetricDictType]
 
         # timing
         self.start_ns = time_ns() if start is None else int(start * 1e9)  # type: int
         self.duration_ns = None  # type: Optional[int]
 
         # tracing
-        self.trace_id = trace_id or _rand.rand64bits()  # type: int
-        self.span_id = span_id or _rand.rand64bits()  # type: int
+        self.trace_id = trace_id or rand64bits()  # type: int
+        self.span_id = span_id or rand64bits()  # type: int
         self.parent_id = parent_id  # type: Optional[int]
-        self._on_finish_callbacks = [] if on_finish is None else on_finish
+        self._on_finish_callbacks = () if on_finish is None else on_finish  # type: Sequence[Callable[[Span], None]]
 
         # sampling
         self.sampled = True  # type: bool
@@ -183,11 +188,24 @@ class Span(object):
 
     @property
     def resource(self):
-        return self._resource[0]
+        return self._resource
 
     @resource.setter
     def resource(self, value):
-        self._resource[0] = value
+        self._resource = value
+        if self._resource_container is not None:
+            self._resource_container[0] = value
+
+    def _get_resource_container(self):
+        # type: () -> List[Optional[str]]
+        """Return a single item list that follows the changes of the span resource.
+
+        This lets the resource of a span be read after the span is gone, once
+        it has its final value.
+        """
+        if self._resource_container is None:
+            self._resource_container = [self._resource]
+        return self._resource_container
 
     @property
     def finished(self):
@@ -320,8 +338,10 @@ class Span(object):
             return
 
         try:
+            if self._meta is None:
+                self._meta = {}
             self._meta[key] = stringify(value)
-            if key in self._metrics:
+            if self._metrics and key in self._metrics:
                 del self._metrics[key]
         except Exception:
             log.warning("error setting tag %s, ignoring it", key, exc_info=True)
@@ -333,6 +353,8 @@ class Span(object):
         U+FFFD.
         """
         try:
+            if self._meta is None:
+                self._meta = {}
             self._meta[key] = ensure_text(value, errors="replace")
         except Exception as e:
             if config._raise:
@@ -341,17 +363,21 @@ class Span(object):
 
     def _remove_tag(self, key):
         # type: (_TagNameType) -> None
-        if key in self._meta:
+        if self._meta and key in self._meta:
             del self._meta[key]
 
     def get_tag(self, key):
         # type: (_TagNameType) -> Optional[Text]
         """Return the given tag or None if it doesn't exist."""
+        if self._meta is None:
+            return None
         return self._meta.get(key, None)
 
     def get_tags(self):
         # type: () -> _MetaDictType
         """Return all tags."""
+        if self._meta is None:
+            return {}
         return self._meta.copy()
 
     def set_tags(self, tags):
@@ -391,8 +417,10 @@ class Span(object):
             log.debug("ignoring not real metric %s:%s", key, value)
             return
 
-        if key in self._meta:
+        if self._meta and key in self._meta:
             del self._meta[key]
+        if self._metrics is None:
+            self._metrics = {}
         self._metrics[key] = value
 
     def set_metrics(self, metrics):
@@ -404,11 +432,15 @@ class Span(object):
     def get_metric(self, key):
         # type: (_TagNameType) -> Optional[NumericType]
         """Return the given metric or None if it doesn't exist."""
+        if self._metrics is None:
+            return None
         return self._metrics.get(key)
 
     def get_metrics(self):
         # type: () -> _MetricDictType
         """Return all metrics."""
+        if self._metrics is None:
+            return {}
         return self._metrics.copy()
 
     def set_traceback(self, limit=20):
@@ -422,7 +454,7 @@ class Span(object):
             self.set_exc_info(exc_type, exc_val, exc_tb)
         else:
             tb = "".join(traceback.format_stack(limit=limit + 1)[:-1])
-            self._meta[ERROR_STACK] = tb
+            self._set_str_tag(ERROR_STACK, tb)
 
     def set_exc_info(self, exc_type, exc_val, exc_tb):
         # type: (Any, Any, Any) -> None
@@ -443,6 +475,8 @@ class Span(object):
         # readable version of type (e.g. exceptions.ZeroDivisionError)
         exc_type_str = "%s.%s" % (exc_type.__module__, exc_type.__name__)
 
+        if self._meta is None:
+            self._meta = {}
         self._meta[ERROR_MSG] = stringify(exc_val)
         self._meta[ERROR_TYPE] = exc_type_str
         self._meta[ERROR_STACK] = tb
@@ -470,8 +504,8 @@ class Span(object):
             ("end", None if not self.duration else self.start + self.duration),
             ("duration", self.duration),
             ("error", self.error),
-            ("tags", dict(sorted(self._meta.items()))),
-            ("metrics", dict(sorted(self._metrics.items()))),
+            ("tags", dict(sorted(self._meta.items())) if self._meta else {}),
+            ("metrics", dict(sorted(self._metrics.items())) if self._metrics else {}),
         ]
         return " ".join(
             # use a large column width to keep pprint output on one line
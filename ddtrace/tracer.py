@@ -12,6 +12,7 @@ from typing import Dict
 from typing import List
 from typing import Optional
 from typing import Set
+from typing import Tuple
 from typing import TypeVar
 from typing import Union
 
@@ -29,23 +30,25 @@ from .constants import PID
 from .constants import SAMPLE_RATE_METRIC_KEY
 from .constants import VERSION_KEY
 from .context import Context
+from .internal import _rand
 from .internal import agent
 from .internal import atexit
 from .internal import compat
 from .internal import debug
 from .internal import forksafe
 from .internal import hostname
+from .internal.constants import HIGHER_ORDER_TRACE_ID_BITS
 from .internal.dogstatsd import get_dogstatsd_client
 from .internal.logger import get_logger
 from .internal.logger import hasHandlers
 from .internal.processor import SpanProcessor
+from .internal.processor.batch import SpanBatchDispatcher
 from .internal.processor.trace import SpanAggregator
+from .internal.processor.trace import TraceChunkProcessor
 from .internal.processor.trace import TraceProcessor
-from .internal.processor.trace import TraceSamplingProcessor
-from .internal.processor.trace import TraceTagsProcessor
-from .internal.processor.trace import TraceTopLevelSpanProcessor
 from .internal.runtime import get_runtime_id
 from .internal.service import ServiceStatusError
+from .internal.span_pool import SpanPool
 from .internal.utils.formats import asbool
 from .internal.writer import AgentWriter
 from .internal.writer import LogWriter
@@ -97,12 +100,21 @@ def _default_span_processors_factory(
     compute_stats_enabled,  # type: bool
     agent_url,  # type: str
 ):
-    # type: (...) -> List[SpanProcessor]
+    # type: (...) -> Tuple[SpanProcessor, ...]
     """Construct the default list of span processors to use."""
     trace_processors = []  # type: List[TraceProcessor]
-    trace_processors += [TraceTagsProcessor()]
-    trace_processors += [TraceSamplingProcessor(compute_stats_enabled)]
-    trace_processors += [TraceTopLevelSpanProcessor()]
+    if config._tail_sampling_enabled:
+        # Inline the import to avoid pulling in ddsketch when importing ddtrace.
+        from .internal.processor.tail_sampling import TailSamplingProcessor
+
+        trace_processors += [
+            TailSamplingProcessor(
+                rate_limit=config._tail_sampling_rate_limit,
+                latency_quantile=config._tail_sampling_latency_quantile,
+                compute_stats_enabled=compute_stats_enabled,
+            )
+        ]
+    trace_processors += [TraceChunkProcessor(compute_stats_enabled)]
     trace_processors += trace_filters
 
     span_processors = []  # type: List[SpanProcessor]
@@ -125,7 +137,7 @@ def _default_span_processors_factory(
                 raise
 
     if compute_stats_enabled:
-        # Inline the import to avoid pulling in ddsketch or protobuf
+        # Inline the import to avoid pulling in the stats processor
         # when importing ddtrace.
         from .internal.processor.stats import SpanStatsProcessorV06
 
@@ -142,7 +154,7 @@ def _default_span_processors_factory(
             writer=trace_writer,
         )
     )
-    return span_processors
+    return tuple(span_processors)
 
 
 class Tracer(object):
@@ -192,6 +204,14 @@ class Tracer(object):
         self._compute_stats = config._trace_compute_stats
         self._agent_url = agent.get_trace_url() if url is None else url  # type: str
         agent.verify_url(self._agent_url)
+        self._span_pool = (
+            SpanPool() if asbool(os.getenv("DD_TRACE_SPAN_RECYCLING_ENABLED", default=False)) else None
+        )  # type: Optional[SpanPool]
+        # Spans are reused from the free lists of the span pool, if enabled
+        if self._span_pool is None:
+            self._new_span = Span  # type: Callable[..., Span]
+        else:
+            self._new_span = self._span_pool.new_span
 
         if self._use_log_writer() and url is None:
             writer = LogWriter()  # type: TraceWriter
@@ -204,11 +224,15 @@ class Tracer(object):
                 report_metrics=config.health_metrics_enabled,
                 sync_mode=self._use_sync_mode(),
                 headers={"Datadog-Client-Computed-Stats": "yes"} if self._compute_stats else {},
+                span_pool=self._span_pool,
             )
         self._writer = writer  # type: TraceWriter
         self._partial_flush_enabled = asbool(os.getenv("DD_TRACE_PARTIAL_FLUSH_ENABLED", default=False))
         self._partial_flush_min_spans = int(os.getenv("DD_TRACE_PARTIAL_FLUSH_MIN_SPANS", default=500))
         self._appsec_enabled = config._appsec_enabled
+        # Finished spans are processed in batches of that size, if not 0
+        self._span_batch_size = int(os.getenv("DD_TRACE_SPAN_BATCH_SIZE", default=0))
+        self._span_batch = None  # type: Optional[SpanBatchDispatcher]
 
         self._span_processors = _default_span_processors_factory(
             self._filters,
@@ -221,6 +245,9 @@ class Tracer(object):
         )
 
         self._hooks = _hooks.Hooks()
+        # The callbacks of the spans started by this tracer, shared by all of them
+        self._span_on_finish = (self._on_span_finish,)
+        self._has_start_span_hooks = False
         atexit.register(self._atexit)
         forksafe.register(self._child_after_fork)
 
@@ -248,6 +275,7 @@ class Tracer(object):
                      The started span will be passed as argument.
         """
         self._hooks.register(self.__class__.start_span, func)
+        self._update_start_span_hooks()
         return func
 
     def deregister_on_start_span(self, func):
@@ -260,8 +288,47 @@ class Tracer(object):
         """
 
         self._hooks.deregister(self.__class__.start_span, func)
+        self._update_start_span_hooks()
         return func
 
+    @property
+    def _span_processors(self):
+        # type: () -> Tuple[SpanProcessor, ...]
+        # A tuple, so that the processors can only be changed with the setter,
+        # which keeps the span callbacks up to date
+        return self._processors
+
+    @_span_processors.setter
+    def _span_processors(self, processors):
+        # type: (Tuple[SpanProcessor, ...]) -> None
+        self._processors = processors = tuple(processors)
+        self._span_start_callbacks = tuple(p.on_span_start for p in processors)
+        if self._span_batch is not None:
+            # Process the spans still queued for the previous processors
+            self._span_batch.flush_all()
+        if self._span_batch_size > 0:
+            # Inline processors run first, the others on the batches of finished spans
+            batched = [p for p in processors if not p.inline]
+            self._span_batch = SpanBatchDispatcher(batched, self._span_batch_size) if batched else None
+            processors = tuple(p for p in processors if p.inline)
+        self._span_finish_callbacks = tuple(p.on_span_finish for p in processors)
+        if self._span_pool is not None:
+            # The pool needs to know the threads finishing the spans of each trace
+            self._span_finish_callbacks = (self._span_pool.on_span_finish,) + self._span_finish_callbacks
+        if self._span_batch is not None:
+            self._span_finish_callbacks += (self._span_batch.on_span_finish,)
+
+    def _flush_span_batches(self):
+        # type: () -> None
+        """Run the span processors over the finished spans queued for batch processing."""
+        if self._span_batch is not None:
+            self._span_batch.flush_all()
+
+    def _update_start_span_hooks(self):
+        # type: () -> None
+        # Avoid emitting the start span hook for every span when no function is registered
+        self._has_start_span_hooks = self._hooks.has(self.__class__.start_span)
+
     @property
     def debug_logging(self):
         return log.isEnabledFor(logging.DEBUG)
@@ -410,6 +477,7 @@ class Tracer(object):
                 sync_mode=self._use_sync_mode(),
                 api_version=api_version,
                 headers={"Datadog-Client-Computed-Stats": "yes"} if compute_stats_enabled else {},
+                span_pool=self._span_pool,
             )
         elif writer is None and isinstance(self._writer, LogWriter):
             # No need to do anything for the LogWriter.
@@ -434,6 +502,7 @@ class Tracer(object):
                 compute_stats_enabled,
             ]
         ):
+            self._flush_span_batches()
             self._span_processors = _default_span_processors_factory(
                 self._filters,
                 self._writer,
@@ -596,11 +665,11 @@ class Tracer(object):
             else:
                 service = config.service
 
-        mapped_service = config.service_mapping.get(service, service)
+        mapped_service = config.service_mapping.get(service, service) if config.service_mapping else service
 
         if trace_id:
             # child_of a non-empty context, so either a local child span or from a remote context
-            span = Span(
+            span = self._new_span(
                 name=name,
                 context=context,
                 trace_id=trace_id,
@@ -608,7 +677,7 @@ class Tracer(object):
                 service=mapped_service,
                 resource=resource,
                 span_type=span_type,
-                on_finish=[self._on_span_finish],
+                on_finish=self._span_on_finish,
             )
 
             # Extra attributes when from a local parent
@@ -621,13 +690,18 @@ class Tracer(object):
                 span._local_root = span
         else:
             # this is the root span of a new trace
-            span = Span(
+            if config._128_bit_trace_id_enabled:
+                trace_id_128 = _rand.rand128bits()
+                trace_id = trace_id_128 & 0xFFFFFFFFFFFFFFFF
+                context._meta[HIGHER_ORDER_TRACE_ID_BITS] = "%016x" % (trace_id_128 >> 64)
+            span = self._new_span(
                 name=name,
                 context=context,
+                trace_id=trace_id,
                 service=mapped_service,
                 resource=resource,
                 span_type=span_type,
-                on_finish=[self._on_span_finish],
+                on_finish=self._span_on_finish,
             )
             span._local_root = span
             if config.report_hostname:
@@ -660,7 +734,7 @@ class Tracer(object):
 
         if not span._parent:
             span._set_str_tag("runtime-id", get_runtime_id())
-            span._metrics[PID] = self._pid
+            span.set_metric(PID, self._pid)
 
         # Apply default global tags.
         if self._tags:
@@ -690,10 +764,11 @@ class Tracer(object):
 
         # Only call span processors if the tracer is enabled
         if self.enabled:
-            for p in self._span_processors:
-                p.on_span_start(span)
+            for on_span_start in self._span_start_callbacks:
+                on_span_start(span)
 
-        self._hooks.emit(self.__class__.start_span, span)
+        if self._has_start_span_hooks:
+            self._hooks.emit(self.__class__.start_span, span)
         return span
 
     start_span = _start_span
@@ -708,8 +783,8 @@ class Tracer(object):
 
         # Only call span processors if the tracer is enabled
         if self.enabled:
-            for p in self._span_processors:
-                p.on_span_finish(span)
+            for on_span_finish in self._span_finish_callbacks:
+                on_span_finish(span)
 
         if log.isEnabledFor(logging.DEBUG):
             log.debug("finishing span %s (enabled:%s)", span._pprint(), self.enabled)
@@ -810,8 +885,7 @@ class Tracer(object):
         (like from a distributed trace) which will not be returned by this
         method.
         """
-        active = self.context_provider.active()
-        return active if isinstance(active, Span) else None
+        return self.context_provider._current_span()
 
     @property
     def agent_trace_url(self):
@@ -824,6 +898,7 @@ class Tracer(object):
 
     def flush(self):
         """Flush the buffer of the trace writer. This does nothing if an unbuffered trace writer is used."""
+        self._flush_span_batches()
         self._writer.flush_queue()
 
     def wrap(
@@ -942,8 +1017,9 @@ class Tracer(object):
         """
         with self._shutdown_lock:
             # Thread safety: Ensures tracer is shutdown synchronously
+            self._flush_span_batches()
             span_processors = self._span_processors
-            self._span_processors = []
+            self._span_processors = ()
             for processor in span_processors:
                 if hasattr(processor, "shutdown"):
                     processor.shutdown(timeout)
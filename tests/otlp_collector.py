@@ -0,0 +1,218 @@
+"""Stand-in OpenTelemetry collector receiving traces with the OTLP/HTTP protocol.
+
+Export requests are decoded with protobuf message classes built at runtime
+from the subset of the OTLP trace protocol exported by the tracer, so that
+tests do not depend on the generated OpenTelemetry protocol packages.
+"""
+import threading
+
+from google.protobuf import descriptor_pb2
+from google.protobuf import descriptor_pool
+from google.protobuf import json_format
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+
+_F = descriptor_pb2.FieldDescriptorProto
+
+# (message, [(field name, number, type, label, message type name)])
+_MESSAGES = [
+    (
+        "AnyValue",
+        [
+            ("string_value", 1, _F.TYPE_STRING, _F.LABEL_OPTIONAL, None),
+            ("bool_value", 2, _F.TYPE_BOOL, _F.LABEL_OPTIONAL, None),
+            ("int_value", 3, _F.TYPE_INT64, _F.LABEL_OPTIONAL, None),
+            ("double_value", 4, _F.TYPE_DOUBLE, _F.LABEL_OPTIONAL, None),
+        ],
+    ),
+    (
+        "KeyValue",
+        [
+            ("key", 1, _F.TYPE_STRING, _F.LABEL_OPTIONAL, None),
+            ("value", 2, _F.TYPE_MESSAGE, _F.LABEL_OPTIONAL, "AnyValue"),
+        ],
+    ),
+    ("Resource", [("attributes", 1, _F.TYPE_MESSAGE, _F.LABEL_REPEATED, "KeyValue")]),
+    (
+        "InstrumentationScope",
+        [
+            ("name", 1, _F.TYPE_STRING, _F.LABEL_OPTIONAL, None),
+            ("version", 2, _F.TYPE_STRING, _F.LABEL_OPTIONAL, None),
+        ],
+    ),
+    (
+        "Status",
+        [
+            ("message", 2, _F.TYPE_STRING, _F.LABEL_OPTIONAL, None),
+            ("code", 3, _F.TYPE_INT32, _F.LABEL_OPTIONAL, None),
+        ],
+    ),
+    (
+        "Span",
+        [
+            ("trace_id", 1, _F.TYPE_BYTES, _F.LABEL_OPTIONAL, None),
+            ("span_id", 2, _F.TYPE_BYTES, _F.LABEL_OPTIONAL, None),
+            ("parent_span_id", 4, _F.TYPE_BYTES, _F.LABEL_OPTIONAL, None),
+            ("name", 5, _F.TYPE_STRING, _F.LABEL_OPTIONAL, None),
+            ("kind", 6, _F.TYPE_INT32, _F.LABEL_OPTIONAL, None),
+            ("start_time_unix_nano", 7, _F.TYPE_FIXED64, _F.LABEL_OPTIONAL, None),
+            ("end_time_unix_nano", 8, _F.TYPE_FIXED64, _F.LABEL_OPTIONAL, None),
+            ("attributes", 9, _F.TYPE_MESSAGE, _F.LABEL_REPEATED, "KeyValue"),
+            ("status", 15, _F.TYPE_MESSAGE, _F.LABEL_OPTIONAL, "Status"),
+        ],
+    ),
+    (
+        "ScopeSpans",
+        [
+            ("scope", 1, _F.TYPE_MESSAGE, _F.LABEL_OPTIONAL, "InstrumentationScope"),
+            ("spans", 2, _F.TYPE_MESSAGE, _F.LABEL_REPEATED, "Span"),
+        ],
+    ),
+    (
+        "ResourceSpans",
+        [
+            ("resource", 1, _F.TYPE_MESSAGE, _F.LABEL_OPTIONAL, "Resource"),
+            ("scope_spans", 2, _F.TYPE_MESSAGE, _F.LABEL_REPEATED, "ScopeSpans"),
+        ],
+    ),
+    ("ExportTraceServiceRequest", [("resource_spans", 1, _F.TYPE_MESSAGE, _F.LABEL_REPEATED, "ResourceSpans")]),
+]
+
+_PACKAGE = "tests.otlp"
+
+
+def _build_request_class():
+    file_proto = descriptor_pb2.FileDescriptorProto(name="tests/otlp_trace.proto", package=_PACKAGE, syntax="proto3")
+    for name, fields in _MESSAGES:
+        message = file_proto.message_type.add(name=name)
+        for field_name, number, field_type, label, type_name in fields:
+            field = message.field.add(name=field_name, number=number, type=field_type, label=label)
+            if type_name is not None:
+                field.type_name = ".%s.%s" % (_PACKAGE, type_name)
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    descriptor = pool.FindMessageTypeByName("%s.ExportTraceServiceRequest" % _PACKAGE)
+    try:
+        from google.protobuf.message_factory import GetMessageClass
+    except ImportError:
+        from google.protobuf.message_factory import MessageFactory
+
+        return MessageFactory(pool).GetPrototype(descriptor)
+    return GetMessageClass(descriptor)
+
+
+ExportTraceServiceRequest = _build_request_class()
+
+
+def decode_request(data):
+    """Decode an export request into a dictionary, with the attributes of the
+    resources and spans turned into dictionaries of plain values.
+    """
+    request = ExportTraceServiceRequest()
+    request.ParseFromString(bytes(data))
+    decoded = json_format.MessageToDict(request, preserving_proto_field_name=True)
+    for resource_spans in decoded.get("resource_spans", []):
+        resource = resource_spans.get("resource", {})
+        resource["attributes"] = _attributes(resource.get("attributes", []))
+        for scope_spans in resource_spans.get("scope_spans", []):
+            for span in scope_spans.get("spans", []):
+                span["attributes"] = _attributes(span.get("attributes", []))
+    return decoded
+
+
+def _attributes(key_values):
+    attributes = {}
+    for kv in key_values:
+        ((kind, value),) = kv.get("value", {"string_value": ""}).items()
+        # 64-bit integers are strings in the JSON mapping of protobuf messages
+        attributes[kv["key"]] = int(value) if kind == "int_value" else value
+    return attributes
+
+
+class _CollectorRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.collector._record(self.command, self.path, dict(self.headers), body)
+        if self.path != "/v1/traces":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        # An empty ExportTraceServiceResponse
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-protobuf")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_PUT = do_POST
+
+
+class _CollectorServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # Connections are kept alive by the writer, so each one is handled by its
+    # own thread.
+    daemon_threads = True
+
+
+class OTLPCollector(object):
+    """OTLP/HTTP trace collector listening on a free local port.
+
+    Usage::
+
+        with OTLPCollector() as collector:
+            writer = AgentWriter(agent_url=collector.url, api_version="otlp")
+            ...
+            assert collector.requests
+    """
+
+    def __init__(self):
+        self.requests = []  # list of (method, path, headers, body)
+        self._lock = threading.Lock()
+        self._server = _CollectorServer(("127.0.0.1", 0), _CollectorRequestHandler)
+        self._server.collector = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self._server.server_address
+
+    def _record(self, method, path, headers, body):
+        with self._lock:
+            self.requests.append((method, path, headers, body))
+
+    def export_requests(self):
+        """Return the decoded export requests received by the collector."""
+        with self._lock:
+            return [decode_request(body) for _, path, _, body in self.requests if path == "/v1/traces"]
+
+    def spans(self):
+        """Return the ``(resource attributes, span)`` pairs of all the spans received."""
+        return [
+            (resource_spans["resource"]["attributes"], span)
+            for request in self.export_requests()
+            for resource_spans in request.get("resource_spans", [])
+            for scope_spans in resource_spans.get("scope_spans", [])
+            for span in scope_spans.get("spans", [])
+        ]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -206,6 +206,35 @@ def test_add_integration_disabled_writer(mock_send_request, telemetry_writer_dis
     assert len(httpretty.latest_requests()) == 0
 
 
+def test_add_count_metric(mock_time, mock_send_request, telemetry_writer):
+    """asserts that add_count_metric() sums the values of a metric in a generate-metrics request"""
+    telemetry_writer.add_count_metric("tracers", "metric", 2)
+    telemetry_writer.add_count_metric("tracers", "metric", 3)
+    telemetry_writer.add_count_metric("tracers", "metric", tags={"key": "value"})
+    telemetry_writer.periodic()
+    assert len(httpretty.latest_requests()) == 1
+    assert httpretty.last_request().headers["DD-Telemetry-Request-Type"] == "generate-metrics"
+    expected_payload = {
+        "namespace": "tracers",
+        "series": [
+            {"metric": "metric", "points": [[1642544540, 5]], "tags": [], "common": False, "type": "count"},
+            {"metric": "metric", "points": [[1642544540, 1]], "tags": ["key:value"], "common": False, "type": "count"},
+        ],
+    }
+    assert httpretty.last_request().parsed_body == _get_request_body(expected_payload, "generate-metrics")
+
+    # The metrics are reset once sent
+    telemetry_writer.periodic()
+    assert len(httpretty.latest_requests()) == 1
+
+
+def test_add_count_metric_disabled_writer(mock_send_request, telemetry_writer_disabled):
+    """asserts that add_count_metric() does not queue a metric when telemetry is disabled"""
+    telemetry_writer_disabled.add_count_metric("tracers", "metric")
+    telemetry_writer_disabled.periodic()
+    assert len(httpretty.latest_requests()) == 0
+
+
 def test_periodic(mock_send_request, telemetry_writer):
     """tests that periodic() sends queued app-started and integration events to the agent"""
     # add 1 event to the queue
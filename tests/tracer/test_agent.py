@@ -222,3 +222,92 @@ def test_verify_url():
     with pytest.raises(ValueError) as e:
         agent.verify_url("unix://")
     assert str(e.value) == "Invalid file path in Agent URL 'unix://'"
+
+
+def test_connection_pool_reuse():
+    pool = agent.ConnectionPool()
+    url = "http://localhost:1234"
+
+    with pool.connection(url) as conn:
+        pass
+    with pool.connection(url, timeout=5) as conn2:
+        assert conn2 is conn
+        assert conn2.timeout == 5
+
+    # Connections are not shared across URLs
+    with pool.connection("http://localhost:4321") as conn3:
+        assert conn3 is not conn
+
+
+def test_connection_pool_no_reuse():
+    pool = agent.ConnectionPool()
+    url = "http://localhost:1234"
+
+    with pool.connection(url, reuse=False) as conn:
+        pass
+    with pool.connection(url) as conn2:
+        assert conn2 is not conn
+
+
+def test_connection_pool_error():
+    pool = agent.ConnectionPool()
+    url = "http://localhost:1234"
+
+    with pytest.raises(ValueError):
+        with pool.connection(url) as conn:
+            raise ValueError()
+
+    with pool.connection(url) as conn2:
+        assert conn2 is not conn
+
+
+def test_connection_pool_idle_timeout():
+    pool = agent.ConnectionPool(idle_timeout=0)
+    url = "http://localhost:1234"
+
+    with pool.connection(url) as conn:
+        pass
+    with pool.connection(url) as conn2:
+        assert conn2 is not conn
+
+
+def test_connection_pool_max_idle_connections():
+    pool = agent.ConnectionPool(max_idle_connections=2)
+    url = "http://localhost:1234"
+
+    with pool.connection(url), pool.connection(url), pool.connection(url):
+        pass
+
+    assert len(pool._idle[url]) == 2
+
+
+def test_connection_pool_reset():
+    pool = agent.ConnectionPool()
+    url = "http://localhost:1234"
+
+    with pool.connection(url) as conn:
+        pass
+    pool.reset()
+    with pool.connection(url) as conn2:
+        assert conn2 is not conn
+
+
+@pytest.mark.subprocess
+def test_connection_pool_fork():
+    import os
+
+    from ddtrace.internal import agent
+
+    url = "http://localhost:1234"
+    with agent.connection_pool.connection(url):
+        pass
+    assert agent.connection_pool._idle[url]
+
+    pid = os.fork()
+    if pid == 0:
+        assert not agent.connection_pool._idle
+        os._exit(0)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert agent.connection_pool._idle[url]
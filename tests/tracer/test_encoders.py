@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import base64
+import binascii
 import json
 import random
 import string
@@ -24,13 +26,16 @@ from ddtrace.internal._encoding import ListStringTable
 from ddtrace.internal._encoding import MsgpackStringTable
 from ddtrace.internal.compat import msgpack_type
 from ddtrace.internal.compat import string_type
+from ddtrace.internal.constants import HIGHER_ORDER_TRACE_ID_BITS
 from ddtrace.internal.encoding import JSONEncoder
 from ddtrace.internal.encoding import JSONEncoderV2
 from ddtrace.internal.encoding import MSGPACK_ENCODERS
 from ddtrace.internal.encoding import MsgpackEncoderV03
 from ddtrace.internal.encoding import MsgpackEncoderV05
+from ddtrace.internal.encoding import OTLPEncoder
 from ddtrace.internal.encoding import _EncoderBase
 from ddtrace.span import Span
+from tests.otlp_collector import decode_request
 from tests.utils import DummyTracer
 
 
@@ -397,6 +402,56 @@ def test_span_types(encoding, span, tags):
     assert decode(refencoder.encode_traces([trace])) == decode(encoder.encode())
 
 
+class SpanWithResourceOverride(Span):
+    __slots__ = ()
+
+    @property
+    def resource(self):
+        return "overridden"
+
+    @resource.setter
+    def resource(self, value):
+        pass
+
+
+@allencodings
+def test_span_subclass(encoding):
+    refencoder = REF_MSGPACK_ENCODERS[encoding]()
+    encoder = MSGPACK_ENCODERS[encoding](1 << 20, 1 << 20)
+
+    # Subclasses of Span are read with the generic attribute lookup
+    trace = [Span("plain", resource="resource"), SpanWithResourceOverride("subclass", resource="resource")]
+    for span in trace:
+        span.set_tag("tag", "value")
+        span.set_metric("metric", 1)
+        span.finish()
+
+    encoder.put(trace)
+    decoded = decode(encoder.encode())
+    assert decoded == decode(refencoder.encode_traces([trace]))
+    resources = [span[2] if encoding == "v0.5" else span[b"resource"] for span in decoded[0]]
+    assert resources == [b"resource", b"overridden"]
+
+
+@allencodings
+def test_span_bytes_and_text_tags(encoding):
+    encoder = MSGPACK_ENCODERS[encoding](1 << 20, 1 << 20)
+
+    span = Span(u"span_name", service=b"service", resource=u"r\u00e9source")
+    span._meta = {b"bytes": b"value", u"text": u"v\u00e0lue", "str": "value"}
+    span.finish()
+
+    encoder.put([span])
+    decoded = decode(encoder.encode())[0][0]
+    if encoding == "v0.5":
+        service, resource, meta = decoded[0], decoded[2], decoded[9]
+    else:
+        service, resource, meta = decoded[b"service"], decoded[b"resource"], decoded[b"meta"]
+    assert service == b"service"
+    assert resource == u"r\u00e9source".encode("utf-8")
+    assert meta == {b"bytes": b"value", b"text": u"v\u00e0lue".encode("utf-8"), b"str": b"value"}
+
+
 @pytest.mark.parametrize(
     "Encoder,item",
     [
@@ -570,6 +625,65 @@ def test_msgpack_string_table():
     assert "foobar" not in t
 
 
+def test_custom_msgpack_encode_v05_hot_strings():
+    encoder = MsgpackEncoderV05(2 << 20, 2 << 20, 4)
+    trace = [
+        Span(name="v05-test", service="foo", resource="GET"),
+        Span(name="v05-test", service="foo", resource="POST"),
+    ]
+
+    # Strings become hot once they have been seen in a few sampled payloads
+    for _ in range(100):
+        encoder.put(trace)
+        st, _ = decode(encoder.flush(), reconstruct=False)
+
+    # The strings used in previous payloads are in the table before any trace is encoded
+    assert st[:2] == [b"", _ORIGIN_KEY]
+    assert set(st[2:6]) == {b"foo", b"v05-test", b"GET", b"POST"}
+    assert len(st) == 6
+
+    reference = MsgpackEncoderV05(2 << 20, 2 << 20, 0)
+    reference.put(trace)
+    encoder.put(trace)
+    assert decode(encoder.flush()) == decode(reference.flush())
+
+    # Strings that are no longer used are dropped from the table
+    for _ in range(100):
+        encoder.put([Span(name="other", service="bar")])
+        st, _ = decode(encoder.flush(), reconstruct=False)
+    assert st[:2] == [b"", _ORIGIN_KEY]
+    assert set(st[2:]) == {b"bar", b"other"}
+
+
+def test_custom_msgpack_encode_v05_no_hot_strings():
+    encoder = MsgpackEncoderV05(2 << 20, 2 << 20, 0)
+    trace = [Span(name="v05-test", service="foo", resource="GET")]
+
+    for _ in range(3):
+        encoder.put(trace)
+        st, _ = decode(encoder.flush(), reconstruct=False)
+        assert st == [b"", _ORIGIN_KEY, b"foo", b"v05-test", b"GET"]
+
+
+def test_custom_msgpack_encode_v05_hot_strings_rollback():
+    max_item_size = 1 << 10
+    encoder = MsgpackEncoderV05(1 << 20, max_item_size, 16)
+    trace = [Span(name="v05-test", service="foo", resource="GET")]
+
+    for _ in range(100):
+        encoder.put(trace)
+        encoder.flush()
+
+    with pytest.raises(BufferItemTooLarge):
+        encoder.put([Span(name="too-large", service="foo", resource="x" * max_item_size)])
+
+    encoder.put(trace)
+    encoded = encoder.flush()
+    assert decode(encoded) == [
+        [(b"foo", b"v05-test", b"GET", trace[0].trace_id, trace[0].span_id, 0, trace[0].start_ns, 0, 0, {}, {}, b"")]
+    ]
+
+
 def test_list_string_table():
     t = ListStringTable()
 
@@ -640,6 +754,231 @@ def test_custom_msgpack_encode_thread_safe(encoding):
     assert unpacked is not None
 
 
+@allencodings
+def test_custom_msgpack_encode_concurrent_flush(encoding):
+    encoder = MSGPACK_ENCODERS[encoding](8 << 20, 8 << 20)
+    trace = [Span(name="span-%d" % _, service="threads", resource="TEST") for _ in range(5)]
+    payloads = []
+    done = threading.Event()
+
+    def flush():
+        while not done.is_set():
+            payload = encoder.encode()
+            if payload is not None:
+                payloads.append(payload)
+
+    def put():
+        for _ in range(200):
+            encoder.put(trace)
+
+    flusher = threading.Thread(target=flush)
+    flusher.start()
+    ts = [threading.Thread(target=put) for _ in range(10)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    done.set()
+    flusher.join()
+
+    payload = encoder.encode()
+    if payload is not None:
+        payloads.append(payload)
+
+    # Traces put while a payload was being serialized go to the active buffer
+    # and must end up in a later payload.
+    traces = [t for p in payloads for t in decode(p)]
+    assert len(traces) == 10 * 200
+    assert all(len(t) == 5 for t in traces)
+    assert len(encoder) == 0
+
+
+@allencodings
+def test_custom_msgpack_encode_segments(encoding):
+    encoder = MSGPACK_ENCODERS[encoding](8 << 20, 8 << 20)
+    assert encoder.encode_segments() is None
+
+    def traces():
+        return [[Span(name="span-%d" % i, trace_id=i + 1, span_id=j + 1, start=1) for j in range(3)] for i in range(10)]
+
+    for _ in range(3):
+        for trace in traces():
+            encoder.put(trace)
+        segments = encoder.encode_segments()
+        assert len(encoder) == 0
+        # The segments are views on the buffers of the encoder
+        assert all(isinstance(segment, memoryview) for segment in segments)
+        assert len(segments) == (2 if encoding == "v0.5" else 1)
+
+        for trace in traces():
+            encoder.put(trace)
+        assert b"".join(segments) == encoder.encode()
+
+
+def _trace_id(span):
+    # Decoded v0.5 spans are tuples
+    return span[3] if isinstance(span, tuple) else span[b"trace_id"]
+
+
+@allencodings
+@pytest.mark.parametrize("max_traces", [0, 1, 3, 100])
+def test_custom_msgpack_encode_split(encoding, max_traces):
+    encoder = MSGPACK_ENCODERS[encoding](8 << 20, 8 << 20)
+    assert encoder.encode_split(1 << 20, max_traces) is None
+
+    for i in range(10):
+        encoder.put([Span(name="span-%d" % i, trace_id=i + 1, service="split") for _ in range(i + 1)])
+    payloads = encoder.encode_split(1 << 20, max_traces)
+    assert len(encoder) == 0
+
+    if max_traces:
+        assert [n for _, n in payloads[:-1]] == [max_traces] * (len(payloads) - 1)
+    else:
+        assert len(payloads) == 1
+    traces = [t for p, n in payloads for t in decode(b"".join(p))]
+    assert sum(n for _, n in payloads) == len(traces) == 10
+    assert [len(t) for t in traces] == list(range(1, 11))
+    assert [_trace_id(t[0]) for t in traces] == list(range(1, 11))
+
+
+@allencodings
+def test_custom_msgpack_encode_split_size(encoding):
+    encoder = MSGPACK_ENCODERS[encoding](8 << 20, 8 << 20)
+    for i in range(20):
+        encoder.put([Span(name="span", trace_id=i + 1, service="split") for _ in range(5)])
+    size = encoder.size
+
+    payloads = encoder.encode_split(size // 4, 0)
+    assert len(payloads) > 4
+    assert all(sum(len(_) for _ in p) <= size // 4 for p, _ in payloads)
+    traces = [t for p, _ in payloads for t in decode(b"".join(p))]
+    assert [_trace_id(t[0]) for t in traces] == list(range(1, 21))
+
+    # A trace larger than the max size gets a payload of its own
+    encoder.put([Span(name="span", trace_id=1, service="split") for _ in range(5)])
+    encoder.put([Span(name="span", trace_id=2, service="split") for _ in range(5)])
+    payloads = encoder.encode_split(1, 0)
+    assert [n for _, n in payloads] == [1, 1]
+
+
+def _otlp_spans(data):
+    return [
+        (resource_spans["resource"]["attributes"], span)
+        for resource_spans in decode_request(data)["resource_spans"]
+        for scope_spans in resource_spans["scope_spans"]
+        for span in scope_spans["spans"]
+    ]
+
+
+def test_otlp_encoder():
+    encoder = OTLPEncoder(1 << 20, 1 << 20)
+    assert encoder.content_type == "application/x-protobuf"
+    assert encoder.encode() is None
+
+    root = Span(name="web.request", service="web", resource="GET /", span_type="web", trace_id=(1 << 64) + 2, span_id=3)
+    root.set_tag("span.kind", "server")
+    root.set_tag("http.method", "GET")
+    root.set_metric("count", 3)
+    root.set_metric("ratio", 0.5)
+    child = Span(name="db.query", service="db", trace_id=root.trace_id, span_id=4, parent_id=3)
+    child.set_tag("span.kind", "client")
+    child.set_metric("huge", 1 << 70)
+    child.error = 1
+    child.set_tag("error.msg", "boom")
+    for span in (root, child):
+        span.finish()
+    root.context.dd_origin = CI_APP_TEST_ORIGIN
+    encoder.put([root, child])
+    assert len(encoder) == 1
+
+    (web_resource, web_span), (db_resource, db_span) = _otlp_spans(encoder.encode())
+    assert len(encoder) == 0
+    assert web_resource["service.name"] == "web"
+    assert db_resource["service.name"] == "db"
+    assert web_resource["telemetry.sdk.name"] == "ddtrace"
+
+    # Identifiers are big endian bytes, trace ids have 128 bits
+    assert _decode_otlp_id(web_span["trace_id"]) == (1 << 64) + 2
+    assert _decode_otlp_id(web_span["span_id"]) == 3
+    assert "parent_span_id" not in web_span
+    assert _decode_otlp_id(db_span["parent_span_id"]) == 3
+
+    assert web_span["name"] == "web.request"
+    assert web_span["kind"] == 2
+    assert db_span["kind"] == 3
+    assert int(web_span["start_time_unix_nano"]) == root.start_ns
+    assert int(web_span["end_time_unix_nano"]) == root.start_ns + root.duration_ns
+    assert web_span["attributes"] == {
+        "resource.name": "GET /",
+        "span.type": "web",
+        "span.kind": "server",
+        "http.method": "GET",
+        "count": 3,
+        "ratio": 0.5,
+        ORIGIN_KEY: CI_APP_TEST_ORIGIN,
+    }
+    assert "status" not in web_span
+
+    # Integers that do not fit in 64 bits are exported as doubles
+    assert db_span["attributes"]["huge"] == float(1 << 70)
+    assert db_span["status"] == {"code": 2, "message": "boom"}
+
+
+def _decode_otlp_id(value):
+    return int(binascii.hexlify(base64.b64decode(value)), 16)
+
+
+def test_otlp_encoder_128_bit_trace_id():
+    """The higher 64 bits of the trace id are taken from the tag of the chunk root"""
+    encoder = OTLPEncoder(1 << 20, 1 << 20)
+    root = Span(name="root", trace_id=2, span_id=3)
+    root.set_tag(HIGHER_ORDER_TRACE_ID_BITS, "640cfd8d00000000")
+    child = Span(name="child", trace_id=2, span_id=4, parent_id=3)
+    invalid = Span(name="invalid", trace_id=5, span_id=6)
+    invalid.set_tag(HIGHER_ORDER_TRACE_ID_BITS, "not hex")
+    for span in (root, child, invalid):
+        span.finish()
+    encoder.put([root, child])
+    encoder.put([invalid])
+
+    trace_ids = [_decode_otlp_id(span["trace_id"]) for _, span in _otlp_spans(encoder.encode())]
+    assert trace_ids == [(0x640CFD8D00000000 << 64) + 2] * 2 + [5]
+
+
+def test_otlp_encoder_buffer_limits():
+    encoder = OTLPEncoder(1 << 10, 1 << 10)
+    with pytest.raises(BufferItemTooLarge):
+        encoder.put([Span(name="test") for _ in range(100)])
+    assert encoder.size == 0
+
+    trace = [Span(name="test")]
+    with pytest.raises(BufferFull):
+        for _ in range(100):
+            encoder.put(trace)
+    # The trace that does not fit is rolled back
+    n = len(encoder)
+    assert len(_otlp_spans(encoder.encode())) == n
+
+
+@pytest.mark.parametrize("max_traces", [0, 1, 3])
+def test_otlp_encoder_split(max_traces):
+    encoder = OTLPEncoder(8 << 20, 8 << 20)
+    assert encoder.encode_split(1 << 20, max_traces) is None
+
+    for i in range(10):
+        encoder.put([Span(name="span-%d" % i, trace_id=i + 1, service="split") for _ in range(i + 1)])
+    payloads = encoder.encode_split(1 << 20, max_traces)
+    assert len(encoder) == 0
+
+    if max_traces:
+        assert [n for _, n in payloads[:-1]] == [max_traces] * (len(payloads) - 1)
+    else:
+        assert len(payloads) == 1
+    # Each payload is a complete export request
+    trace_ids = [_decode_otlp_id(span["trace_id"]) for p, _ in payloads for _, span in _otlp_spans(b"".join(p))]
+    assert trace_ids == [i + 1 for i in range(10) for _ in range(i + 1)]
+
+
 @pytest.mark.subprocess(parametrize={"encoder_cls": ["JSONEncoder", "JSONEncoderV2"]})
 def test_json_encoder_traces_bytes():
     """
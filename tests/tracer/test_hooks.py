@@ -27,3 +27,18 @@ def test_deregister_unknown():
     hooks.deregister("key", test_deregister_unknown)
 
     hooks.emit("key")
+
+
+def test_has():
+    hooks = _hooks.Hooks()
+    assert not hooks.has("key")
+
+    @hooks.register("key")
+    def hook():
+        pass
+
+    assert hooks.has("key")
+    assert not hooks.has("other")
+
+    hooks.deregister("key", hook)
+    assert not hooks.has("key")
@@ -1,3 +1,4 @@
+import threading
 from typing import Any
 
 import attr
@@ -6,9 +7,26 @@ import pytest
 
 from ddtrace import Span
 from ddtrace import Tracer
+from ddtrace.constants import AUTO_KEEP
+from ddtrace.constants import AUTO_REJECT
+from ddtrace.constants import SAMPLING_PRIORITY_KEY
+from ddtrace.constants import USER_KEEP
+from ddtrace.constants import USER_REJECT
+from ddtrace.context import Context
+from ddtrace.ext.ci import CI_APP_TEST_ORIGIN
 from ddtrace.internal.processor import SpanProcessor
+from ddtrace.internal.processor.batch import SpanBatchDispatcher
+from ddtrace.internal.processor.sketch import EMPTY_SKETCH
+from ddtrace.internal.processor.stats import OVERFLOW_RESOURCE
+from ddtrace.internal.processor.stats import SpanAggrBucket
+from ddtrace.internal.processor.stats import SpanStatsProcessorV06
+from ddtrace.internal.processor.tail_sampling import TAIL_SAMPLING_DECISION_KEY
+from ddtrace.internal.processor.tail_sampling import TailSamplingProcessor
 from ddtrace.internal.processor.trace import SpanAggregator
+from ddtrace.internal.processor.trace import TraceChunkProcessor
 from ddtrace.internal.processor.trace import TraceProcessor
+from ddtrace.internal.processor.trace import TraceSamplingProcessor
+from ddtrace.internal.processor.trace import TraceTagsProcessor
 from ddtrace.internal.processor.trace import TraceTopLevelSpanProcessor
 from ddtrace.internal.processor.truncator import DEFAULT_SERVICE_NAME
 from ddtrace.internal.processor.truncator import DEFAULT_SPAN_NAME
@@ -19,7 +37,10 @@ from ddtrace.internal.processor.truncator import MAX_RESOURCE_NAME_LENGTH
 from ddtrace.internal.processor.truncator import MAX_TYPE_LENGTH
 from ddtrace.internal.processor.truncator import NormalizeSpanProcessor
 from ddtrace.internal.processor.truncator import TruncateSpanProcessor
+from ddtrace.propagation.http import HTTPPropagator
 from tests.utils import DummyWriter
+from tests.utils import override_env
+from tests.utils import override_global_config
 
 
 def test_no_impl():
@@ -234,6 +255,248 @@ def test_aggregator_partial_flush_2_spans():
     assert parent.get_metric("_dd.py.partial_flush") is None
 
 
+def test_aggregator_partial_flush_open_spans():
+    writer = DummyWriter()
+    aggr = SpanAggregator(partial_flush_enabled=True, partial_flush_min_spans=3, trace_processors=[], writer=writer)
+
+    root = Span("root", on_finish=[aggr.on_span_finish])
+    aggr.on_span_start(root)
+    children = []
+    for i in range(10):
+        child = Span("child%d" % i, trace_id=root.trace_id, parent_id=root.span_id, on_finish=[aggr.on_span_finish])
+        aggr.on_span_start(child)
+        children.append(child)
+
+    # Spans are flushed in start order, whatever the order they finished in
+    for i in (5, 1, 8):
+        children[i].finish()
+    assert writer.pop() == [children[1], children[5], children[8]]
+    assert children[1].get_metric("_dd.py.partial_flush") == 3
+
+    for i in (0, 9):
+        children[i].finish()
+    assert writer.pop() == []
+
+    root.finish()
+    assert writer.pop() == [root, children[0], children[9]]
+
+    # The remaining spans are flushed when the trace completes
+    for i in (2, 3, 4, 6):
+        children[i].finish()
+    assert writer.pop() == [children[2], children[3], children[4]]
+    children[7].finish()
+    assert writer.pop() == [children[6], children[7]]
+    assert not any(traces for _, traces in aggr._shards)
+
+
+def test_aggregator_unknown_span():
+    writer = DummyWriter()
+    aggr = SpanAggregator(partial_flush_enabled=False, partial_flush_min_spans=0, trace_processors=[], writer=writer)
+
+    # Spans that were not started by the aggregator are not tracked
+    Span("span", on_finish=[aggr.on_span_finish]).finish()
+    assert writer.pop() == []
+    assert not any(traces for _, traces in aggr._shards)
+
+
+def test_aggregator_concurrent_traces():
+    """Traces finished concurrently by several threads are written once and completely"""
+    writer = DummyWriter()
+    aggr = SpanAggregator(partial_flush_enabled=False, partial_flush_min_spans=0, trace_processors=[], writer=writer)
+
+    def create_traces(n):
+        for _ in range(n):
+            root = Span("root", on_finish=[aggr.on_span_finish])
+            aggr.on_span_start(root)
+            for _ in range(5):
+                child = Span("child", trace_id=root.trace_id, parent_id=root.span_id, on_finish=[aggr.on_span_finish])
+                aggr.on_span_start(child)
+                child.finish()
+            root.finish()
+
+    threads = [threading.Thread(target=create_traces, args=(50,)) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    traces = writer.pop_traces()
+    assert len(traces) == 16 * 50
+    assert all(len(trace) == 6 and len({s.trace_id for s in trace}) == 1 for trace in traces)
+    assert not any(traces for _, traces in aggr._shards)
+
+
+@attr.s
+class BatchRecordingProcessor(SpanProcessor):
+    inline = attr.ib(type=bool, default=False)
+    finished = attr.ib(factory=list)
+    batches = attr.ib(factory=list)
+
+    def on_span_start(self, span):
+        pass
+
+    def on_span_finish(self, span):
+        self.finished.append(span)
+
+    def on_span_finish_batch(self, spans):
+        self.batches.append(list(spans))
+        super(BatchRecordingProcessor, self).on_span_finish_batch(spans)
+
+
+def test_span_batch_dispatcher():
+    proc1, proc2 = BatchRecordingProcessor(), BatchRecordingProcessor()
+    dispatcher = SpanBatchDispatcher([proc1, proc2], batch_size=3)
+    root = Span("root")
+    children = [Span("child") for _ in range(4)]
+    for child in children:
+        child._parent = root
+
+    for child in children[:2]:
+        dispatcher.on_span_finish(child)
+    assert proc1.batches == []
+
+    # The queue of the thread is full
+    dispatcher.on_span_finish(children[2])
+    assert proc1.batches == proc2.batches == [children[:3]]
+
+    # The queue is processed when the local root finishes
+    dispatcher.on_span_finish(children[3])
+    dispatcher.on_span_finish(root)
+    assert proc1.batches == proc2.batches == [children[:3], [children[3], root]]
+    assert proc1.finished == proc2.finished == children + [root]
+
+    dispatcher.flush()
+    assert len(proc1.batches) == 2
+
+
+def test_span_batch_dispatcher_threads():
+    """The spans queued by other threads are processed when a local root finishes"""
+    proc = BatchRecordingProcessor()
+    dispatcher = SpanBatchDispatcher([proc], batch_size=100)
+    root = Span("root")
+
+    def finish_child():
+        child = Span("child")
+        child._parent = root
+        dispatcher.on_span_finish(child)
+
+    threads = [threading.Thread(target=finish_child) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert proc.batches == []
+
+    dispatcher.on_span_finish(root)
+    assert len(proc.batches) == 1
+    assert len(proc.finished) == 5
+    assert root in proc.finished
+    # The queues of the threads that are gone are dropped once empty
+    del threads, t
+    dispatcher.flush_all()
+    assert len(dispatcher._queues) == 1
+
+
+def test_span_batch_dispatcher_concurrent_flushes():
+    """Spans are processed exactly once when the queues are flushed by other threads"""
+    proc = BatchRecordingProcessor()
+    dispatcher = SpanBatchDispatcher([proc], batch_size=7)
+    parent = Span("parent")
+    spans = [Span("child") for _ in range(10000)]
+    for span in spans:
+        span._parent = parent
+    done = threading.Event()
+
+    def flush_all():
+        while not done.is_set():
+            dispatcher.flush_all()
+
+    t = threading.Thread(target=flush_all)
+    t.start()
+    try:
+        for span in spans:
+            dispatcher.on_span_finish(span)
+    finally:
+        done.set()
+        t.join()
+    dispatcher.flush_all()
+    assert sorted(map(id, proc.finished)) == sorted(map(id, spans))
+
+
+def test_span_batch_dispatcher_reentrant_processor():
+    """Processors can finish spans while processing a batch"""
+
+    class FinishingProcessor(BatchRecordingProcessor):
+        def on_span_finish_batch(self, spans):
+            super(FinishingProcessor, self).on_span_finish_batch(spans)
+            if len(self.batches) == 1:
+                dispatcher.on_span_finish(Span("other"))
+
+    proc = FinishingProcessor()
+    dispatcher = SpanBatchDispatcher([proc], batch_size=10)
+    dispatcher.on_span_finish(Span("root"))
+    assert [[span.name for span in batch] for batch in proc.batches] == [["root"], ["other"]]
+
+
+def test_span_batch_dispatcher_bad_processor():
+    class BadProcessor(BatchRecordingProcessor):
+        def on_span_finish_batch(self, spans):
+            raise ValueError()
+
+    proc = BatchRecordingProcessor()
+    dispatcher = SpanBatchDispatcher([BadProcessor(), proc], batch_size=10)
+    with mock.patch("ddtrace.internal.processor.batch.log") as log:
+        dispatcher.on_span_finish(Span("root"))
+    assert len(proc.finished) == 1
+    log.error.assert_called_once()
+
+
+def test_tracer_span_batch():
+    inline_proc, batched_proc = BatchRecordingProcessor(inline=True), BatchRecordingProcessor()
+    with override_env(dict(DD_TRACE_SPAN_BATCH_SIZE="10")):
+        tracer = Tracer()
+    tracer.configure(writer=DummyWriter())
+    tracer._span_processors = (inline_proc, batched_proc) + tracer._span_processors
+
+    with tracer.trace("root"):
+        with tracer.trace("child") as child:
+            pass
+        assert inline_proc.finished == [child]
+        assert batched_proc.finished == []
+        assert tracer._writer.pop() == []
+
+    assert inline_proc.batches == []
+    assert len(batched_proc.batches) == 1
+    assert len(tracer._writer.pop()) == 2
+
+    # Pending spans are processed before the processors are replaced
+    span = tracer.start_span("child", child_of=tracer.start_span("root"))
+    span.finish()
+    tracer.configure(writer=DummyWriter())
+    assert batched_proc.finished[-1] is span
+
+    tracer._span_processors = (inline_proc, batched_proc) + tracer._span_processors
+    span = tracer.start_span("child", child_of=tracer.start_span("root"))
+    span.finish()
+    tracer._span_processors = tracer._span_processors[2:]
+    assert batched_proc.finished[-1] is span
+
+
+def test_tracer_span_batch_other_thread():
+    """Traces with spans finished by other threads are written once the local root finishes"""
+    with override_env(dict(DD_TRACE_SPAN_BATCH_SIZE="10")):
+        tracer = Tracer()
+    tracer.configure(writer=DummyWriter())
+
+    with tracer.trace("root") as root:
+        t = threading.Thread(target=lambda: tracer.start_span("child", child_of=root).finish())
+        t.start()
+        t.join()
+        assert tracer._writer.pop() == []
+
+    assert sorted(span.name for span in tracer._writer.pop()) == ["child", "root"]
+
+
 def test_trace_top_level_span_processor_partial_flushing():
     """Parent span and child span have the same service name"""
     tracer = Tracer()
@@ -316,6 +579,301 @@ def test_trace_top_level_span_processor_trace_return_val():
     assert trace_processors.process_trace(trace[:]) == trace
 
 
+def _chunk(service="svc"):
+    ctx = Context(sampling_priority=1, meta={"_dd.p.dm": "-0"})
+    root = Span("root", service=service, context=ctx)
+    root._local_root = root
+    child = Span("child", service=service, trace_id=root.trace_id, parent_id=root.span_id, context=ctx)
+    child._parent = child._local_root = root
+    other = Span("other", service="other-svc", trace_id=root.trace_id, parent_id=child.span_id, context=ctx)
+    other._parent, other._local_root = child, root
+    orphan = Span("orphan", service=service, trace_id=root.trace_id, parent_id=12345, context=ctx)
+    orphan._local_root = root
+    return [root, child, other, orphan]
+
+
+@pytest.mark.parametrize("compute_stats_enabled", [False, True])
+def test_trace_chunk_processor_same_as_processors(compute_stats_enabled):
+    """TraceChunkProcessor does the same as the processors it replaces"""
+    expected = _chunk()
+    for tp in (TraceTagsProcessor(), TraceSamplingProcessor(compute_stats_enabled), TraceTopLevelSpanProcessor()):
+        expected = tp.process_trace(expected)
+    trace = TraceChunkProcessor(compute_stats_enabled).process_trace(_chunk())
+
+    assert [span.get_tags() for span in trace] == [span.get_tags() for span in expected]
+    assert [span.get_metrics() for span in trace] == [span.get_metrics() for span in expected]
+    assert trace[0].get_metric(SAMPLING_PRIORITY_KEY) == 1
+    assert [span.get_metric("_dd.top_level") for span in trace] == [1, None, 1, 0]
+
+
+def test_trace_chunk_processor_drop():
+    assert TraceChunkProcessor(False).process_trace([]) is None
+
+    trace = _chunk()
+    for span in trace:
+        span.sampled = False
+    assert TraceChunkProcessor(False).process_trace(trace) is None
+
+    trace = _chunk()
+    trace[0].context.sampling_priority = 0
+    assert TraceChunkProcessor(False).process_trace(trace) == trace
+    assert TraceChunkProcessor(True).process_trace(trace) is None
+
+
+def test_trace_chunk_processor_truncate_normalize():
+    trace = _chunk(service=None)
+    trace[1].resource = "x" * (MAX_RESOURCE_NAME_LENGTH + 10)
+    trace[1].set_tag("t" * (MAX_META_KEY_LENGTH + 10), "v")
+    assert TraceChunkProcessor(False).process_trace(trace) == trace
+    assert trace[0].service is None
+    assert len(trace[1].resource) == MAX_RESOURCE_NAME_LENGTH + 10
+
+    trace = TraceChunkProcessor(False, truncate=True, normalize=True).process_trace(trace)
+    assert trace[0].service == DEFAULT_SERVICE_NAME
+    assert trace[1].resource == "x" * MAX_RESOURCE_NAME_LENGTH
+    assert trace[1].get_tag("t" * MAX_META_KEY_LENGTH) == "v"
+
+
+def _tail_trace(duration=1, error=False, priority=AUTO_KEEP, resource="res"):
+    ctx = Context(trace_id=1, sampling_priority=priority)
+    root = Span("root", resource=resource, trace_id=1, span_id=1, context=ctx)
+    root._local_root = root
+    child = Span("child", trace_id=1, span_id=2, parent_id=1, context=ctx, start=root.start)
+    child._parent = root
+    child._local_root = root
+    child.error = int(error)
+    child.finish(finish_time=root.start + duration)
+    root.finish(finish_time=root.start + duration)
+    return [root, child]
+
+
+def _tail_priority(tsp, trace):
+    assert tsp.process_trace(trace) == trace
+    return trace[0].context.sampling_priority
+
+
+def test_tail_sampling_processor_rate_limit():
+    tsp = TailSamplingProcessor(rate_limit=2)
+    traces = [_tail_trace() for _ in range(5)]
+    # Traces over the limit are rejected, not dropped
+    assert [_tail_priority(tsp, trace) for trace in traces] == [AUTO_KEEP] * 2 + [AUTO_REJECT] * 3
+    assert traces[0][0].get_tag(TAIL_SAMPLING_DECISION_KEY) is None
+
+    assert tsp.process_trace([]) == []
+
+
+def test_tail_sampling_processor_keeps_errors():
+    tsp = TailSamplingProcessor(rate_limit=0)
+    assert _tail_priority(tsp, _tail_trace()) == AUTO_REJECT
+
+    trace = _tail_trace(error=True, priority=AUTO_REJECT)
+    assert _tail_priority(tsp, trace) == AUTO_KEEP
+    assert trace[0].get_tag(TAIL_SAMPLING_DECISION_KEY) == "error"
+
+
+def test_tail_sampling_processor_keeps_latency_outliers():
+    tsp = TailSamplingProcessor(rate_limit=0, latency_quantile=0.9, min_samples=10)
+    # No outlier until min_samples traces have been seen
+    assert _tail_priority(tsp, _tail_trace(duration=100)) == AUTO_REJECT
+    for _ in range(9):
+        assert _tail_priority(tsp, _tail_trace(duration=1)) == AUTO_REJECT
+
+    trace = _tail_trace(duration=100, priority=AUTO_REJECT)
+    assert _tail_priority(tsp, trace) == AUTO_KEEP
+    assert trace[0].get_tag(TAIL_SAMPLING_DECISION_KEY) == "latency"
+
+    # The latencies of the other resources are separate
+    assert _tail_priority(tsp, _tail_trace(duration=100, resource="other")) == AUTO_REJECT
+
+
+def test_tail_sampling_processor_max_resources():
+    tsp = TailSamplingProcessor(rate_limit=0, min_samples=1, max_resources=2)
+    for i in range(4):
+        tsp.process_trace(_tail_trace(resource="res%d" % i))
+    assert set(tsp._latencies) == {(None, "root", "res0"), (None, "root", "res1"), None}
+    assert tsp._latencies[None].count == 2
+
+
+def test_tail_sampling_processor_rejected_traces():
+    tsp = TailSamplingProcessor(rate_limit=-1)
+    assert _tail_priority(tsp, _tail_trace(priority=AUTO_REJECT)) == AUTO_REJECT
+    assert _tail_priority(tsp, _tail_trace()) == AUTO_KEEP
+
+
+def test_tail_sampling_processor_compute_stats():
+    """Rejected traces are dropped when the trace metrics are computed by the tracer"""
+    tsp = TailSamplingProcessor(rate_limit=1, compute_stats_enabled=True)
+    assert tsp.process_trace(_tail_trace(priority=AUTO_REJECT)) is None
+    trace = _tail_trace()
+    assert tsp.process_trace(trace) == trace
+    assert tsp.process_trace(_tail_trace()) is None
+
+    trace = _tail_trace(error=True, priority=AUTO_REJECT)
+    assert tsp.process_trace(trace) == trace
+    assert trace[0].context.sampling_priority == AUTO_KEEP
+
+
+@pytest.mark.parametrize("propagation", ["upstream", "origin", "injected"])
+def test_tail_sampling_processor_propagated_decision(propagation):
+    """The priority of a trace is not changed once its sampling decision was propagated"""
+
+    def propagated_trace(**kwargs):
+        trace = _tail_trace(**kwargs)
+        if propagation == "upstream":
+            trace[0].parent_id = 42
+        elif propagation == "origin":
+            trace[0].context.dd_origin = CI_APP_TEST_ORIGIN
+        else:
+            with override_global_config(dict(_tail_sampling_enabled=True)):
+                HTTPPropagator.inject(trace[0].context, {})
+        return trace
+
+    tsp = TailSamplingProcessor(rate_limit=0, compute_stats_enabled=True)
+    assert tsp.process_trace(propagated_trace(error=True, priority=AUTO_REJECT)) is None
+
+    trace = propagated_trace()
+    assert tsp.process_trace(trace) == trace
+    assert trace[0].context.sampling_priority == AUTO_KEEP
+    assert trace[0].get_tag(TAIL_SAMPLING_DECISION_KEY) is None
+
+
+@pytest.mark.parametrize("priority", [USER_REJECT, USER_KEEP])
+def test_tail_sampling_processor_user_priority(priority):
+    tsp = TailSamplingProcessor(rate_limit=0)
+    trace = _tail_trace(error=True, priority=priority)
+    assert tsp.process_trace(trace) == trace
+    assert trace[0].context.sampling_priority == priority
+    assert trace[0].get_tag(TAIL_SAMPLING_DECISION_KEY) is None
+
+
+def test_tail_sampling_processor_partial_flush():
+    tsp = TailSamplingProcessor(rate_limit=0)
+    trace = _tail_trace()
+    trace[0].set_metric("_dd.py.partial_flush", 2)
+    assert tsp.process_trace(trace) == trace
+    # Only the local root span of a trace can be sampled
+    assert tsp.process_trace(trace[1:]) == trace[1:]
+
+
+@pytest.mark.parametrize("compute_stats", [False, True])
+def test_tracer_tail_sampling(compute_stats):
+    with override_global_config(
+        dict(_tail_sampling_enabled=True, _tail_sampling_rate_limit=0, _trace_compute_stats=compute_stats)
+    ):
+        tracer = Tracer()
+        writer = DummyWriter()
+        tracer.configure(writer=writer)
+    (aggregator,) = [p for p in tracer._span_processors if isinstance(p, SpanAggregator)]
+    assert isinstance(aggregator._trace_processors[0], TailSamplingProcessor)
+
+    with tracer.trace("rejected"):
+        pass
+    with pytest.raises(ValueError):
+        with tracer.trace("error"):
+            raise ValueError()
+    spans = writer.pop()
+    # Rejected traces are only dropped when the trace metrics are computed by the tracer
+    if compute_stats:
+        assert [span.name for span in spans] == ["error"]
+    else:
+        assert [span.name for span in spans] == ["rejected", "error"]
+        assert spans[0].get_metric(SAMPLING_PRIORITY_KEY) == AUTO_REJECT
+    assert spans[-1].get_metric(SAMPLING_PRIORITY_KEY) == AUTO_KEEP
+
+
+def test_span_stats_processor_threads():
+    """The statistics aggregated by each thread are merged when serialized"""
+    processor = SpanStatsProcessorV06("http://localhost:8126", interval=60)
+    processor.stop()
+
+    def finish_spans(n):
+        for i in range(n):
+            span = Span("op", service="svc", resource="res", start=60)
+            span._local_root = span
+            if i % 2:
+                span.set_tag("http.status_code", 200)
+            span.finish(finish_time=61)
+            processor.on_span_finish(span)
+
+    threads = [threading.Thread(target=finish_spans, args=(10,)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    del threads, t
+    finish_spans(2)
+    web_span = Span("op", service="svc", resource="res", start=60, span_type="web")
+    web_span._local_root = web_span
+    web_span.finish(finish_time=61)
+    processor.on_span_finish_batch([web_span])
+
+    (bucket,) = processor._serialize_buckets()
+    assert bucket["Start"] == 60 * 10 ** 9
+    stats = {(s.get("Type"), s["HTTPStatusCode"]): s for s in bucket["Stats"]}
+    assert set(stats) == {(None, 0), (None, 200), ("web", 0)}
+    assert stats[(None, 0)]["Hits"] == stats[(None, 0)]["TopLevelHits"] == 21
+    assert stats[(None, 0)]["Duration"] == 21 * 10 ** 9
+    assert stats[(None, 200)]["Hits"] == 21
+    assert stats[("web", 0)]["Hits"] == 1
+    assert stats[("web", 0)]["ErrorSummary"] == EMPTY_SKETCH
+    # The buckets of the threads that are gone are forgotten
+    assert len(processor._threads_buckets) == 1
+    assert processor._serialize_buckets() == []
+
+
+def test_span_aggr_bucket_heavy_hitters():
+    """The most frequent keys of a bucket are aggregated separately, the others are folded"""
+    bucket = SpanAggrBucket(max_keys=4)
+
+    def add(resource):
+        key = ("op", "svc", resource, None, None, False)
+        stats = bucket.stats.get(key)
+        if stats is None:
+            stats = bucket.new_stats(key)
+        stats.hits += 1
+
+    # The long tail comes first and fills the bucket
+    for i in range(100):
+        add("tail%d" % i)
+        if i >= 20:
+            add("heavy%d" % (i % 2))
+
+    assert {key[2] for key in bucket.stats if key[2].startswith("heavy")} == {"heavy0", "heavy1"}
+    assert list(bucket.overflow) == [("op", "svc", OVERFLOW_RESOURCE, None, 0, False)]
+    # No span is lost
+    assert sum(stats.hits for _, stats in bucket.items()) == 180
+    assert bucket.folded == bucket.overflow[("op", "svc", OVERFLOW_RESOURCE, None, 0, False)].hits
+
+
+def test_span_stats_processor_max_keys():
+    """The spans of the least frequent keys beyond the maximum are folded when serialized"""
+    processor = SpanStatsProcessorV06("http://localhost:8126", interval=60, max_keys=2)
+    processor.stop()
+
+    def finish_spans(resources):
+        for resource in resources:
+            span = Span("op", service="svc", resource=resource, start=60)
+            span._local_root = span
+            span.finish(finish_time=61)
+            processor.on_span_finish(span)
+
+    # Each thread stays within the maximum, but not all the threads together
+    threads = [
+        threading.Thread(target=finish_spans, args=(resources,))
+        for resources in (["a", "a", "a", "b"], ["a", "c", "c"], ["d"])
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with mock.patch("ddtrace.internal.processor.stats.telemetry_writer") as telemetry_writer:
+        (bucket,) = processor._serialize_buckets()
+    stats = {s["Resource"]: s["Hits"] for s in bucket["Stats"]}
+    assert stats == {"a": 4, "c": 2, OVERFLOW_RESOURCE: 2}
+    telemetry_writer.add_count_metric.assert_called_once_with("tracers", "stats.folded_spans", 2)
+
+
 def test_span_truncator():
     """TruncateSpanProcessor truncates information in spans"""
     span = Span("span1", resource="x" * (MAX_RESOURCE_NAME_LENGTH + 10))
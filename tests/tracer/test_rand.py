@@ -9,12 +9,17 @@ except ImportError:
 
 import os
 import threading
+import time
 
 from ddtrace import Span
+from ddtrace import Tracer
 from ddtrace import tracer
 from ddtrace.internal import _rand
 from ddtrace.internal import forksafe
 from ddtrace.internal.compat import Queue
+from ddtrace.internal.constants import HIGHER_ORDER_TRACE_ID_BITS
+from tests.utils import DummyWriter
+from tests.utils import override_global_config
 
 
 def test_random():
@@ -247,3 +252,45 @@ def test_span_api_fork():
             q.put(child_ids)
         finally:
             os._exit(0)
+
+
+def test_seed_discards_generated_ids():
+    # Ids are generated ahead of time, reseeding must not reuse them
+    _rand.rand64bits()
+    state = _rand._getstate()
+    ids = [_rand.rand64bits() for _ in range(10)]
+    assert _rand._getstate() == state
+
+    _rand.seed()
+    assert set(_rand.rand64bits() for _ in range(10)) & set(ids) == set()
+    assert _rand._getstate() != state
+
+
+def test_rand128bits():
+    now = int(time.time())
+    ids = {_rand.rand128bits() for _ in range(1000)}
+    assert len(ids) == 1000
+    for trace_id in ids:
+        assert now <= trace_id >> 96 <= now + 1
+        assert (trace_id >> 64) & 0xFFFFFFFF == 0
+
+
+def test_tracer_128_bit_trace_ids():
+    t = Tracer()
+    t.configure(writer=DummyWriter())
+    with override_global_config(dict(_128_bit_trace_id_enabled=True)):
+        with t.trace("root") as root:
+            with t.trace("child") as child:
+                pass
+    now = int(time.time())
+
+    assert root.trace_id == child.trace_id < 2 ** 64
+    higher_bits = root.get_tag(HIGHER_ORDER_TRACE_ID_BITS)
+    assert len(higher_bits) == 16
+    assert now - 1 <= int(higher_bits, 16) >> 32 <= now
+    assert int(higher_bits, 16) & 0xFFFFFFFF == 0
+
+    # 64-bit trace ids by default
+    with t.trace("root") as root:
+        pass
+    assert root.get_tag(HIGHER_ORDER_TRACE_ID_BITS) is None
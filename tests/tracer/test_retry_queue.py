@@ -0,0 +1,116 @@
+import os
+
+import mock
+
+from ddtrace.internal.retry_queue import PayloadRetryQueue
+
+
+def test_retry_queue_fifo():
+    queue = PayloadRetryQueue(max_size=100, max_age=60)
+    assert queue.put(b"a" * 10, 1) == []
+    assert queue.put(b"b" * 20, 2) == []
+    assert len(queue) == 2
+    assert queue.size == 30
+
+    item, dropped = queue.get()
+    assert item[:2] == (b"a" * 10, 1)
+    assert dropped == []
+    item, _ = queue.get()
+    assert item[:2] == (b"b" * 20, 2)
+    assert queue.get() == (None, [])
+    assert queue.size == 0
+
+
+def test_retry_queue_requeue():
+    queue = PayloadRetryQueue(max_size=100, max_age=60)
+    queue.put(b"a", 1)
+    queue.put(b"b", 2)
+    item, _ = queue.get()
+    queue.requeue(*item)
+    assert queue.size == 2
+    assert queue.get()[0][:2] == (b"a", 1)
+
+
+def test_retry_queue_max_size():
+    queue = PayloadRetryQueue(max_size=30, max_age=60)
+    queue.put(b"a" * 10, 1)
+    queue.put(b"b" * 10, 2)
+    # The oldest payloads are dropped to make room
+    assert queue.put(b"c" * 20, 3) == [(10, 1)]
+    assert queue.size == 30
+    # Payloads larger than the queue are dropped straight away
+    assert queue.put(b"d" * 31, 4) == [(31, 4)]
+    assert len(queue) == 2
+
+
+def test_retry_queue_max_age():
+    queue = PayloadRetryQueue(max_size=100, max_age=10)
+    with mock.patch("ddtrace.internal.retry_queue.monotonic", return_value=0):
+        queue.put(b"a", 1)
+    with mock.patch("ddtrace.internal.retry_queue.monotonic", return_value=5):
+        queue.put(b"b", 2)
+    with mock.patch("ddtrace.internal.retry_queue.monotonic", return_value=11):
+        item, dropped = queue.get()
+    assert dropped == [(1, 1)]
+    assert item == (b"b", 2, 5)
+
+
+def test_retry_queue_spill(tmpdir):
+    queue = PayloadRetryQueue(max_size=20, max_age=60, spill_dir=str(tmpdir))
+    queue.put(b"a" * 10, 1)
+    queue.put(b"b" * 10, 2)
+    assert queue.put(b"c" * 10, 3) == []
+    # The oldest payload has been moved to the spill directory
+    assert len(os.listdir(str(tmpdir))) == 1
+    assert queue.size == 30
+
+    assert queue.put(b"d" * 10, 4) == []
+    assert len(os.listdir(str(tmpdir))) == 2
+    assert queue.size == 40
+    # Both memory and spill directory are full: the oldest payload is dropped
+    assert queue.put(b"e" * 10, 5) == [(10, 1)]
+    assert len(os.listdir(str(tmpdir))) == 2
+    assert queue.size == 40
+
+    payloads = []
+    while True:
+        item, dropped = queue.get()
+        assert dropped == []
+        if item is None:
+            break
+        payloads.append(item[:2])
+    assert payloads == [(b"b" * 10, 2), (b"c" * 10, 3), (b"d" * 10, 4), (b"e" * 10, 5)]
+    assert os.listdir(str(tmpdir)) == []
+    assert queue.size == 0
+
+
+def test_retry_queue_clear(tmpdir):
+    queue = PayloadRetryQueue(max_size=10, max_age=60, spill_dir=str(tmpdir))
+    queue.put(b"a" * 10, 1)
+    queue.put(b"b" * 10, 2)
+    assert sorted(queue.clear()) == [(10, 1), (10, 2)]
+    assert len(queue) == 0
+    assert queue.size == 0
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_retry_queue_requeue_max_size(tmpdir):
+    queue = PayloadRetryQueue(max_size=20, max_age=60)
+    queue.put(b"a" * 10, 1)
+    item, _ = queue.get()
+    queue.put(b"b" * 10, 2)
+    queue.put(b"c" * 10, 3)
+    # The requeued payload is the oldest one and is dropped to stay within bounds
+    assert queue.requeue(*item) == [(10, 1)]
+    assert queue.size == 20
+
+    queue = PayloadRetryQueue(max_size=20, max_age=60, spill_dir=str(tmpdir))
+    queue.put(b"a" * 10, 1)
+    item, _ = queue.get()
+    queue.put(b"b" * 10, 2)
+    queue.put(b"c" * 10, 3)
+    # The requeued payload is moved to the spill directory
+    assert queue.requeue(*item) == []
+    assert len(os.listdir(str(tmpdir))) == 1
+    assert queue.size == 30
+    assert queue.get()[0][:2] == (b"a" * 10, 1)
@@ -621,6 +621,52 @@ def test_sampling_rule_matches_exception():
         )
 
 
+def test_datadog_sampler_rules_first_match():
+    """The compiled rules match the first rule that matches a span, as if they were evaluated in order"""
+    rules = [
+        SamplingRule(sample_rate=0.1, service="svc-a", name="op-a"),
+        SamplingRule(sample_rate=0.1, service=re.compile(r"svc-\w$")),
+        SamplingRule(sample_rate=0.1, name=lambda name: name.endswith("-b")),
+        SamplingRule(sample_rate=0.1, service="svc-b"),
+        SamplingRule(sample_rate=0.1, name=re.compile("op-")),
+        SamplingRule(sample_rate=0.1, service=re.compile("svc"), name="op-c"),
+        SamplingRule(sample_rate=0.1, service=re.compile("(s)vc-\\1"), name=re.compile("^OP", re.I)),
+        SamplingRule(sample_rate=0.1, name="op-a"),
+        SamplingRule(sample_rate=0.1, service=None),
+        NoMatch(0.1),
+        SamplingRule(sample_rate=0.1, service=re.compile(".+-db$")),
+        MatchSample(0.1),
+        SamplingRule(sample_rate=0.1),
+    ]
+    services = ["svc-a", "svc-b", "svc-ab", "svc-s", "my-db", "other", None]
+    names = ["op-a", "op-b", "op-c", "OP-D", "other", ""]
+
+    for i in range(len(rules) + 1):
+        sampler = DatadogSampler(rules=rules[i:])
+        for service in services:
+            for name in names:
+                span = Span(service=service, name=name)
+                expected = next((rule for rule in rules[i:] if rule.matches(span)), None)
+                for _ in range(2):
+                    assert sampler._rule_matcher.match(span) is expected, (rules[i:], service, name)
+
+
+def test_datadog_sampler_rules_changed():
+    rule = SamplingRule(sample_rate=0.5, service="svc")
+    sampler = DatadogSampler(rules=[SamplingRule(sample_rate=1, service="other")])
+    span = create_span(service="svc", name="op")
+    assert sampler.sample(span)
+    assert span.get_metric(SAMPLING_RULE_DECISION) is None
+
+    sampler.rules.append(rule)
+    sampler.sample(span)
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 0.5
+
+    sampler.rules = [SamplingRule(sample_rate=0.25)]
+    sampler.sample(span)
+    assert span.get_metric(SAMPLING_RULE_DECISION) == 0.25
+
+
 @pytest.mark.parametrize("sample_rate", [0.01, 0.1, 0.15, 0.25, 0.5, 0.75, 0.85, 0.9, 0.95, 0.991])
 def test_sampling_rule_sample(sample_rate):
     rule = SamplingRule(sample_rate=sample_rate)
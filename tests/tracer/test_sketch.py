@@ -0,0 +1,76 @@
+import random
+
+from ddsketch import LogCollapsingLowestDenseDDSketch
+from ddsketch.pb.proto import DDSketchProto
+from ddsketch.pb.proto import pb
+import pytest
+
+from ddtrace.internal.processor.sketch import BIN_LIMIT
+from ddtrace.internal.processor.sketch import EMPTY_SKETCH
+from ddtrace.internal.processor.sketch import RELATIVE_ACCURACY
+from ddtrace.internal.processor.sketch import DurationSketch
+
+
+def _decode(encoded):
+    return DDSketchProto.from_proto(pb.DDSketch.FromString(encoded))
+
+
+def _ddsketch(values):
+    sketch = LogCollapsingLowestDenseDDSketch(RELATIVE_ACCURACY, bin_limit=BIN_LIMIT)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        [],
+        [0],
+        [1.0],
+        [0, 0, 1e6, 2e6, 5e8],
+        [random.lognormvariate(15, 2) for _ in range(1000)],
+        # The lowest bins are collapsed beyond the bin limit
+        [1e-300, 1e-100, 1.0, 1e300],
+    ],
+)
+def test_duration_sketch_encode(values):
+    """A DurationSketch is encoded like the same DDSketch"""
+    sketch = DurationSketch()
+    for value in values:
+        sketch.add(value)
+
+    encoded = sketch.encode()
+    expected = DDSketchProto.to_proto(_ddsketch(values))
+    assert pb.DDSketch.FromString(encoded).mapping == expected.mapping
+
+    decoded = _decode(encoded)
+    expected_decoded = DDSketchProto.from_proto(expected)
+    assert decoded.count == expected_decoded.count == len(values)
+    assert decoded._zero_count == expected_decoded._zero_count
+    for quantile in (0, 0.5, 0.9, 0.99, 1):
+        assert decoded.get_quantile_value(quantile) == expected_decoded.get_quantile_value(quantile)
+
+
+def test_duration_sketch_empty():
+    assert EMPTY_SKETCH == DDSketchProto.to_proto(_ddsketch([])).SerializeToString()
+    assert DurationSketch().encode() == EMPTY_SKETCH
+
+
+def test_duration_sketch_merge():
+    values = [random.randint(0, 10 ** 9) for _ in range(200)]
+    sketch = DurationSketch()
+    other = DurationSketch()
+    for value in values[:100]:
+        sketch.add(value)
+    for value in values[100:]:
+        other.add(value)
+    other.add(0)
+    sketch.merge(other)
+
+    expected = DurationSketch()
+    for value in values + [0]:
+        expected.add(value)
+    assert sketch.bins == expected.bins
+    assert sketch.zero_count == expected.zero_count == 1 + values.count(0)
+    assert sketch.encode() == expected.encode()
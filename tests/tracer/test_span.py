@@ -552,6 +552,44 @@ def test_on_finish_multi_callback():
     m2.assert_called_once_with(s)
 
 
+def test_span_lazy_tags_and_metrics():
+    s = Span("test")
+    assert s._meta is None
+    assert s._metrics is None
+    assert s.get_tag("key") is None
+    assert s.get_tags() == {}
+    assert s.get_metric("key") is None
+    assert s.get_metrics() == {}
+
+    # Removing a tag or a metric does not allocate anything
+    s._remove_tag("key")
+    s.set_tag("key")
+    assert s._meta == {"key": "None"}
+    assert s._metrics is None
+
+    s.set_metric("key", 1)
+    assert s._meta == {}
+    assert s._metrics == {"key": 1}
+
+    s = Span("test")
+    s._set_str_tag("key", "value")
+    assert s.get_tags() == {"key": "value"}
+    assert s._metrics is None
+
+
+def test_span_resource_container():
+    s = Span("test", resource="resource")
+    assert s._resource_container is None
+
+    container = s._get_resource_container()
+    assert container == ["resource"]
+    assert s._get_resource_container() is container
+
+    s.resource = "new resource"
+    assert s.resource == "new resource"
+    assert container == ["new resource"]
+
+
 @pytest.mark.parametrize("arg", ["span_id", "trace_id", "parent_id"])
 def test_span_preconditions(arg):
     Span("test", **{arg: None})
@@ -0,0 +1,161 @@
+import collections
+import functools
+import platform
+import threading
+import weakref
+
+import mock
+import pytest
+
+from ddtrace.internal.span_pool import SpanPool
+from ddtrace.internal.span_pool import _refcounts_reliable
+from ddtrace.span import Span
+
+
+def _trace(pool, n_children=2, finished_by=None):
+    root = pool.new_span("root")
+    root._local_root = root
+    trace = [root]
+    for _ in range(n_children):
+        child = pool.new_span("child", trace_id=root.trace_id, parent_id=root.span_id)
+        child._parent = child._local_root = root
+        trace.append(child)
+    trace[0].set_tag("key", "value")
+    trace[1].set_metric("metric", 1)
+    for span in trace:
+        span.finish()
+        (finished_by or pool).on_span_finish(span)
+    return trace
+
+
+def test_span_pool_reuses_unreferenced_spans():
+    pool = SpanPool()
+    trace = _trace(pool)
+    recycled_ids = {id(span) for span in trace}
+    pool.recycle(trace)
+    del trace
+    # The spans of a trace are checked once the next trace is recycled
+    assert pool._local.free == []
+    pool.recycle(_trace(pool))
+    assert pool.enabled
+    assert {id(span) for span in pool._local.free} == recycled_ids
+
+    span = pool.new_span("reused", service="svc", resource="res")
+    assert id(span) in recycled_ids
+    assert len(pool._local.free) == 2
+    assert span.name == "reused"
+    assert span.service == "svc"
+    assert span.resource == "res"
+    assert span.duration_ns is None
+    assert span._parent is None
+    assert span._local_root is None
+    assert span.get_tags() == {}
+    assert span.get_metrics() == {}
+
+    # The next trace reuses the remaining recycled spans
+    assert {id(span) for span in _trace(pool, n_children=1)} < recycled_ids
+    assert pool._local.free == []
+
+
+def test_span_pool_disabled_by_referenced_spans():
+    pool = SpanPool()
+    trace = _trace(pool)
+    kept = trace[1]
+    pool.recycle(trace)
+    del trace
+    pool.recycle(_trace(pool))
+    assert not pool.enabled
+    assert pool._local.free == []
+    assert kept._parent is not None
+
+    # Nothing is recycled anymore
+    pool.recycle(_trace(pool))
+    pool.recycle(_trace(pool))
+    assert pool._local.free == []
+
+
+def test_span_pool_skips_weakly_referenced_spans():
+    pool = SpanPool()
+    trace = _trace(pool)
+    ref = weakref.ref(trace[0])
+    pool.recycle(trace)
+    del trace
+    pool.recycle(_trace(pool))
+    assert pool.enabled
+    assert pool._local.free == []
+    assert ref() is not None
+
+
+def test_span_pool_skips_unfinished_spans():
+    pool = SpanPool()
+    trace = [Span("open")]
+    pool.on_span_finish(trace[0])
+    pool.recycle(trace)
+    del trace
+    pool.recycle(_trace(pool))
+    assert pool.enabled
+    assert pool._local.free == []
+
+
+def test_span_pool_max_size():
+    pool = SpanPool(max_size=4)
+    for _ in range(4):
+        # Spans not created by the pool do not take spans off the free list
+        pool.recycle(_trace(SpanPool(), finished_by=pool))
+    assert len(pool._local.free) == 3
+
+
+def test_span_pool_skips_traces_finished_by_other_threads():
+    pool = SpanPool()
+    trace = _trace(pool)
+    # The last span is finished by another thread
+    t = threading.Thread(target=pool.on_span_finish, args=(trace[-1],))
+    t.start()
+    t.join()
+    pool.recycle(trace)
+    del trace
+    assert pool._local.pending is None
+    assert pool._finished_by == {}
+
+    trace = _trace(pool)
+    pool.recycle(trace)
+    del trace
+    pool.recycle(_trace(pool))
+    assert len(pool._local.free) == 3
+
+
+@pytest.mark.parametrize("keep", ["closure", "dict", "deque"])
+def test_span_pool_keeps_spans_referenced_outside_the_trace(keep):
+    pool = SpanPool()
+    trace = _trace(pool)
+    # The span is only referenced by a closure or a C container
+    if keep == "closure":
+        get_span = (lambda span: lambda: span)(trace[1])
+    elif keep == "dict":
+        get_span = functools.partial(dict.__getitem__, {"span": trace[1]}, "span")
+    else:
+        get_span = functools.partial(collections.deque.__getitem__, collections.deque([trace[1]]), 0)
+    span_id = trace[1].span_id
+    pool.recycle(trace)
+    del trace
+    pool.recycle(_trace(pool))
+    assert not pool.enabled
+    assert pool._local.free == []
+
+    span = get_span()
+    assert span.span_id == span_id
+    assert span.name == "child"
+    assert span.duration_ns is not None
+
+
+def test_span_pool_unreliable_refcounts():
+    with mock.patch("ddtrace.internal.span_pool._REFCOUNTS_RELIABLE", False):
+        pool = SpanPool()
+    assert not pool.enabled
+    pool.recycle(_trace(pool))
+    pool.recycle(_trace(pool))
+    assert pool._local.free == []
+
+
+def test_span_pool_refcounts_reliable():
+    assert _refcounts_reliable() is (platform.python_implementation() == "CPython")
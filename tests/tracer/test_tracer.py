@@ -30,11 +30,14 @@ from ddtrace.constants import USER_KEEP
 from ddtrace.constants import USER_REJECT
 from ddtrace.constants import VERSION_KEY
 from ddtrace.context import Context
+from ddtrace.filters import TraceFilter
 from ddtrace.internal._encoding import MsgpackEncoderV03
 from ddtrace.internal._encoding import MsgpackEncoderV05
+from ddtrace.internal.processor.trace import SpanAggregator
 from ddtrace.internal.writer import AgentWriter
 from ddtrace.internal.writer import LogWriter
 from ddtrace.settings import Config
+from ddtrace.span import Span
 from ddtrace.span import _is_top_level
 from ddtrace.tracer import Tracer
 from ddtrace.tracer import _has_aws_lambda_agent_extension
@@ -928,6 +931,59 @@ def test_deregister_start_span_hooks():
     assert result == {}
 
 
+def test_span_pipeline_follows_configure():
+    class DropAllFilter(TraceFilter):
+        def process_trace(self, trace):
+            return None
+
+    t = ddtrace.Tracer()
+    assert not t._has_start_span_hooks
+    processors = t._span_processors
+
+    t.configure(settings={"FILTERS": [DropAllFilter()]})
+    assert t._span_processors is not processors
+    assert t._span_start_callbacks == tuple(p.on_span_start for p in t._span_processors)
+    assert t._span_finish_callbacks == tuple(p.on_span_finish for p in t._span_processors)
+    # The processors can only be changed through the setter
+    with pytest.raises(AttributeError):
+        t._span_processors.append(DropAllFilter())
+
+    with mock.patch.object(SpanAggregator, "on_span_start") as on_span_start:
+        t.configure(settings={"FILTERS": [DropAllFilter()]})
+        span = t.start_span("hello")
+        on_span_start.assert_called_once_with(span)
+        span.finish()
+
+    @t.on_start_span
+    def on_start_span(span):
+        pass
+
+    assert t._has_start_span_hooks
+    t.deregister_on_start_span(on_start_span)
+    assert not t._has_start_span_hooks
+
+
+def test_span_recycling():
+    assert ddtrace.Tracer()._span_pool is None
+
+    with override_env(dict(DD_TRACE_SPAN_RECYCLING_ENABLED="true")):
+        t = ddtrace.Tracer()
+    assert t._writer._span_pool is t._span_pool
+    t.configure(hostname="localhost")
+    assert t._writer._span_pool is t._span_pool
+
+    recycled = Span("recycled")
+    recycled.finish()
+    t._span_pool._local.free.append(recycled)
+    with t.trace("new") as span:
+        assert span is recycled
+        assert span.name == "new"
+        assert span._local_root is span
+        assert not span.finished
+    with t.trace("new") as span:
+        assert span is not recycled
+
+
 def test_enable(monkeypatch):
     t1 = ddtrace.Tracer()
     assert t1.enabled
@@ -1723,6 +1779,43 @@ def test_top_level(tracer):
             assert _is_top_level(child_span2)
 
 
+def test_default_provider_active_stack(tracer):
+    from ddtrace.provider import _DD_CONTEXTVAR
+
+    provider = tracer.context_provider
+    with tracer.trace("root") as root:
+        with tracer.trace("parent") as parent:
+            child = tracer.trace("child")
+            # The active spans are linked to the entry of their active parent
+            assert _DD_CONTEXTVAR.get()[0] is child
+            assert _DD_CONTEXTVAR.get()[1][0] is parent
+            assert _DD_CONTEXTVAR.get()[1][1][0] is root
+
+            # The parent finishing first is skipped once the child finishes
+            parent.finish()
+            assert tracer.current_span() is child
+            child.finish()
+            assert tracer.current_span() is root
+
+        # A span activated while its parent is not active falls back to its parents
+        sibling = tracer.trace("sibling")
+        other = tracer.start_span("other", child_of=root)
+        provider.activate(other)
+        assert _DD_CONTEXTVAR.get()[1] is None
+        other.finish()
+        sibling.finish()
+        assert tracer.current_span() is root
+    assert tracer.current_span() is None
+    assert provider.active() is None
+
+    # The context a span continues is not active again once the span finishes
+    provider.activate(Context(trace_id=1234, span_id=4321))
+    with tracer.trace("remote") as span:
+        assert tracer.current_span() is span
+    assert provider.active() is None
+    assert not provider._has_active_context()
+
+
 def test_ctx_api():
     from ddtrace.internal import _context
 
@@ -1,5 +1,6 @@
 from functools import partial
 import sys
+import threading
 import typing
 import unittest
 
@@ -9,6 +10,8 @@ import pytest
 from ddtrace.internal.utils import ArgumentError
 from ddtrace.internal.utils import get_argument_value
 from ddtrace.internal.utils import time
+from ddtrace.internal.utils.cache import CacheInfo
+from ddtrace.internal.utils.cache import LFUCache
 from ddtrace.internal.utils.cache import cached
 from ddtrace.internal.utils.cache import cachedmethod
 from ddtrace.internal.utils.formats import asbool
@@ -293,17 +296,23 @@ def cached_test_recipe(expensive, cheap, witness, cache_size):
 
     assert witness.call_count == 1 + cache_size
 
+    MIN_FOO = "Foo%d" % (cache_size >> 1)
     MAX_FOO = "Foo%d" % (cache_size - 1)
 
-    cheap("last drop")  # Forces least frequent elements out of the cache
+    cheap("last drop")  # Forces the oldest least frequent element out of the cache
     assert witness.call_count == 2 + cache_size
 
-    cheap(MAX_FOO)  # Check MAX_FOO was dropped
+    cheap(MIN_FOO)  # Check MIN_FOO was dropped
     assert witness.call_count == 3 + cache_size
 
+    cheap(MAX_FOO)  # Check MAX_FOO was retained
     cheap("last drop")  # Check last drop was retained
     assert witness.call_count == 3 + cache_size
 
+    assert cheap.cache_info() == CacheInfo(
+        hits=(cache_size >> 1) + 2, misses=cache_size + 2, maxsize=cache_size, currsize=cache_size
+    )
+
 
 def test_cached():
     witness = mock.Mock()
@@ -336,6 +345,51 @@ def test_cachedmethod():
     cached_test_recipe(expensive, Foo().cheap, witness, cache_size)
 
 
+def test_lfu_cache_scan():
+    cache = LFUCache(16)
+    for _ in range(3):
+        for i in range(8):
+            assert cache.get("hot%d" % i, lambda key: key.upper()) == "HOT%d" % i
+
+    # Keys used once do not evict the keys used more often
+    for i in range(1000):
+        assert cache.get(i, lambda key: -key) == -i
+    assert len(cache) == 16
+    assert all("hot%d" % i in cache for i in range(8))
+    assert cache.info() == CacheInfo(hits=16, misses=1008, maxsize=16, currsize=16)
+
+    cache.clear()
+    assert cache.info() == CacheInfo(hits=0, misses=0, maxsize=16, currsize=0)
+
+
+def test_lfu_cache_concurrent_misses():
+    """A value missing from the cache is computed once when threads get it concurrently"""
+    cache = LFUCache(16)
+    computing = threading.Event()
+    done = threading.Event()
+    calls = []
+
+    def slow(key):
+        calls.append(key)
+        computing.set()
+        done.wait(1)
+        return key.upper()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("key", slow))) for _ in range(4)]
+    threads[0].start()
+    computing.wait(1)
+    for t in threads[1:]:
+        t.start()
+    done.set()
+    for t in threads:
+        t.join()
+
+    assert calls == ["key"]
+    assert results == ["KEY"] * 4
+    assert cache.info() == CacheInfo(hits=3, misses=1, maxsize=16, currsize=1)
+
+
 @pytest.mark.parametrize(
     "version_str,expected",
     [
@@ -3,24 +3,29 @@ import socket
 import tempfile
 import threading
 import time
+import zlib
 
 import mock
 import msgpack
 import pytest
+import tenacity
 from six.moves import BaseHTTPServer
 from six.moves import socketserver
 
 from ddtrace.constants import KEEP_SPANS_RATE_KEY
+from ddtrace.internal import agent
 from ddtrace.internal.compat import PY3
 from ddtrace.internal.compat import get_connection_response
 from ddtrace.internal.compat import httplib
 from ddtrace.internal.encoding import MSGPACK_ENCODERS
+from ddtrace.internal.encoding import OTLPEncoder
 from ddtrace.internal.uds import UDSHTTPConnection
 from ddtrace.internal.writer import AgentWriter
 from ddtrace.internal.writer import LogWriter
 from ddtrace.internal.writer import Response
 from ddtrace.internal.writer import _human_size
 from ddtrace.span import Span
+from tests.otlp_collector import OTLPCollector
 from tests.utils import AnyInt
 from tests.utils import BaseTestCase
 from tests.utils import override_env
@@ -176,7 +181,13 @@ class AgentWriterTests(BaseTestCase):
     def test_drop_reason_buffer_full(self):
         statsd = mock.Mock()
         writer_metrics_reset = mock.Mock()
-        writer = AgentWriter(agent_url="http://asdf:1234", buffer_size=5235, dogstatsd=statsd, report_metrics=False)
+        writer = AgentWriter(
+            agent_url="http://asdf:1234",
+            buffer_size=5235,
+            dogstatsd=statsd,
+            report_metrics=False,
+            buffer_flush_threshold=1.0,
+        )
         writer._metrics_reset = writer_metrics_reset
         for i in range(10):
             writer.write([Span(name="name", trace_id=i, span_id=j, parent_id=j - 1 or None) for j in range(5)])
@@ -193,9 +204,10 @@ class AgentWriterTests(BaseTestCase):
         n_traces = 10
         statsd = mock.Mock()
         writer_encoder = mock.Mock()
-        writer_encoder.__len__ = (lambda *args: n_traces).__get__(writer_encoder)
+        writer_encoder.__len__ = (lambda *args: writer_encoder.put.call_count).__get__(writer_encoder)
+        writer_encoder.size = 0
         writer_metrics_reset = mock.Mock()
-        writer_encoder.encode.side_effect = Exception
+        writer_encoder.encode_segments.side_effect = Exception
         writer = AgentWriter(agent_url="http://asdf:1234", dogstatsd=statsd, report_metrics=False)
         writer._encoder = writer_encoder
         writer._metrics_reset = writer_metrics_reset
@@ -341,10 +353,20 @@ class _ResetAPIEndpointRequestHandlerTest(_BaseHTTPRequestHandler):
         return
 
 
+class _PayloadAPIEndpointRequestHandlerTest(_BaseHTTPRequestHandler):
+
+    payloads = []
+
+    def do_PUT(self):
+        self.payloads.append((self.headers, self.rfile.read(int(self.headers["Content-Length"]))))
+        self.send_error(200, "OK")
+
+
 _HOST = "0.0.0.0"
 _PORT = 8743
 _TIMEOUT_PORT = _PORT + 1
 _RESET_PORT = _TIMEOUT_PORT + 1
+_PAYLOAD_PORT = _RESET_PORT + 1
 
 
 class UDSHTTPServer(socketserver.UnixStreamServer, BaseHTTPServer.HTTPServer):
@@ -562,22 +584,326 @@ def test_writer_reuse_connections_envvar(monkeypatch):
     assert writer._reuse_connections
 
 
-def test_writer_reuse_connections():
-    # Ensure connection is not reused
-    writer = AgentWriter(agent_url="http://localhost:9126", reuse_connections=True)
-    # Do an initial flush to get a connection
-    writer.flush_queue()
-    assert writer._conn is None
-    writer.flush_queue()
-    assert writer._conn is None
+def test_writer_reuse_connections(endpoint_assert_path):
+    endpoint_assert_path()
+    agent_url = "http://%s:%s" % (_HOST, _PORT)
+    agent.connection_pool.reset()
+    writer = AgentWriter(agent_url=agent_url, reuse_connections=True)
 
+    writer._encoder.put([Span("foobar")])
+    writer.flush_queue(raise_exc=True)
+    ((conn, _),) = agent.connection_pool._idle[agent_url]
 
-def test_writer_reuse_connections_false():
-    # Ensure connection is reused
-    writer = AgentWriter(agent_url="http://localhost:9126", reuse_connections=False)
-    # Do an initial flush to get a connection
-    writer.flush_queue()
-    conn = writer._conn
-    # And another to potentially have it reset
+    # The connection is kept alive and reused by the next flush
+    writer._encoder.put([Span("foobar")])
+    writer.flush_queue(raise_exc=True)
+    assert [c for c, _ in agent.connection_pool._idle[agent_url]] == [conn]
+
+
+def test_writer_reuse_connections_false(endpoint_assert_path):
+    endpoint_assert_path()
+    agent_url = "http://%s:%s" % (_HOST, _PORT)
+    agent.connection_pool.reset()
+    writer = AgentWriter(agent_url=agent_url, reuse_connections=False)
+
+    writer._encoder.put([Span("foobar")])
+    writer.flush_queue(raise_exc=True)
+    assert not agent.connection_pool._idle.get(agent_url)
+
+
+def test_writer_buffer_flush_threshold():
+    writer_put = mock.Mock()
+    writer_put.return_value = Response(status=200)
+    # Use a long interval so that only the flush threshold can trigger a flush
+    writer = AgentWriter(
+        agent_url="http://localhost:9126", processing_interval=3600, buffer_size=1 << 16, buffer_flush_threshold=0.5
+    )
+    writer._put = writer_put
+    try:
+        for i in range(1000):
+            writer.write([Span(name="name", trace_id=i, span_id=j, parent_id=j - 1 or None) for j in range(5)])
+            if writer._encoder.size >= writer._buffer_flush_size:
+                break
+
+        # The periodic thread has been awakened to flush the buffer.
+        for _ in range(100):
+            if writer_put.called:
+                break
+            time.sleep(0.01)
+        assert writer_put.called
+        assert writer._metrics["buffer.dropped.traces"]["count"] == 0
+    finally:
+        writer.stop()
+        writer.join()
+
+
+@pytest.mark.parametrize("threshold", [0, -0.5, 1.5])
+def test_writer_buffer_flush_threshold_invalid(threshold):
+    with pytest.raises(ValueError):
+        AgentWriter(agent_url="http://localhost:9126", buffer_flush_threshold=threshold)
+
+
+def test_writer_buffer_flush_threshold_envvar(monkeypatch):
+    monkeypatch.setenv("DD_TRACE_WRITER_BUFFER_FLUSH_THRESHOLD", "0.5")
+    writer = AgentWriter(agent_url="http://localhost:9126", buffer_size=1000)
+    assert writer._buffer_flush_size == 500
+
+    writer = writer.recreate()
+    assert writer._buffer_flush_threshold == 0.5
+
+
+def test_writer_gzip_compression():
+    writer = AgentWriter(agent_url="http://localhost:9126", compression="gzip")
+    writer._put = mock.Mock(return_value=Response(status=200))
+    writer._encoder.put([Span("foobar")])
+    writer.flush_queue(raise_exc=True)
+
+    data, headers = writer._put.call_args[0]
+    assert headers["Content-Encoding"] == "gzip"
+    traces = msgpack.unpackb(zlib.decompress(data, 16 + zlib.MAX_WBITS), raw=False)
+    assert traces[0][0]["name"] == "foobar"
+
+
+def test_writer_compression_unsupported_by_agent():
+    writer = AgentWriter(agent_url="http://localhost:9126", compression="gzip")
+    endpoint = writer._endpoint
+    writer._put = mock.Mock(side_effect=[Response(status=415), Response(status=200)])
+    writer._encoder.put([Span("foobar")])
+    writer.flush_queue(raise_exc=True)
+
+    assert writer._put.call_count == 2
+    (compressed, compressed_headers), (data, headers) = (c[0] for c in writer._put.call_args_list)
+    assert compressed_headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in headers
+    assert zlib.decompress(compressed, 16 + zlib.MAX_WBITS) == data
+    # The API version is not downgraded and compression stays disabled
+    assert writer._endpoint == endpoint
+    assert writer._compression is None
+
+
+def test_writer_compression_invalid():
+    with pytest.raises(ValueError):
+        AgentWriter(agent_url="http://localhost:9126", compression="brotli")
+
+
+def test_writer_compression_envvar(monkeypatch):
+    monkeypatch.setenv("DD_TRACE_WRITER_COMPRESSION", "gzip")
+    monkeypatch.setenv("DD_TRACE_WRITER_COMPRESSION_LEVEL", "9")
+    writer = AgentWriter(agent_url="http://localhost:9126")
+    assert writer._compression == "gzip"
+    assert writer._compression_level == 9
+
+    writer = writer.recreate()
+    assert writer._compression == "gzip"
+    assert writer._compression_level == 9
+
+
+def test_writer_retry_queue():
+    writer = AgentWriter(agent_url="http://localhost:9126", retry_queue_size=1 << 20, retry_queue_max_age=60)
+    writer._retry_upload = mock.Mock(side_effect=tenacity.RetryError(None))
+    writer._send_payload = mock.Mock()
+    writer._encoder.put([Span("foobar")])
     writer.flush_queue()
-    assert writer._conn is conn
+
+    # The payload has been queued instead of being dropped
+    assert len(writer._retry_queue) == 1
+    assert "http.dropped.traces" not in writer._metrics
+
+    # The queue is drained once the backoff delay has passed
+    writer._flush_retry_queue()
+    writer._send_payload.assert_not_called()
+    writer._retry_queue_next_attempt = 0
+    writer._flush_retry_queue()
+    writer._send_payload.assert_called_once_with(mock.ANY, 1)
+    assert len(writer._retry_queue) == 0
+
+
+def test_writer_retry_queue_agent_down():
+    writer = AgentWriter(agent_url="http://localhost:9126", retry_queue_size=1 << 20, retry_queue_max_age=60)
+    writer._send_payload = mock.Mock(side_effect=OSError)
+    writer._retry_queue.put(b"payload", 2)
+
+    writer._flush_retry_queue()
+    assert writer._send_payload.call_count == 1
+    # The payload is kept and the next attempt is delayed
+    assert len(writer._retry_queue) == 1
+    assert writer._retry_queue_failures == 1
+    next_attempt = writer._retry_queue_next_attempt
+
+    writer._flush_retry_queue(force=True)
+    assert writer._retry_queue_failures == 2
+    assert writer._retry_queue_next_attempt > next_attempt
+
+    writer.on_shutdown()
+    assert len(writer._retry_queue) == 0
+    assert writer._metrics["http.dropped.traces"]["count"] == 2
+
+
+def test_writer_retry_queue_disabled():
+    writer = AgentWriter(agent_url="http://localhost:9126")
+    assert writer._retry_queue is None
+
+    writer = AgentWriter(agent_url="http://localhost:9126", retry_queue_size=1024, retry_queue_spill_dir="/tmp")
+    writer = writer.recreate()
+    assert writer._retry_queue.max_size == 1024
+    assert writer._retry_queue.spill_dir == "/tmp"
+
+
+def test_writer_split_payloads():
+    writer = AgentWriter(agent_url="http://localhost:9126", split_payload_traces=2)
+    writer._put = mock.Mock(return_value=Response(status=200))
+    for i in range(5):
+        writer._encoder.put([Span("foobar", trace_id=i + 1)])
+    writer.flush_queue(raise_exc=True)
+
+    counts = [int(c[0][1]["X-Datadog-Trace-Count"]) for c in writer._put.call_args_list]
+    assert counts == [2, 2, 1]
+
+
+def test_writer_concurrent_requests():
+    writer = AgentWriter(agent_url="http://localhost:9126", concurrent_requests=3, split_payload_traces=1)
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def put(data, headers):
+        with lock:
+            in_flight.append(None)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.05)
+        with lock:
+            in_flight.pop()
+        return Response(status=200)
+
+    writer._put = mock.Mock(side_effect=put)
+    for _ in range(2):
+        for i in range(7):
+            writer._encoder.put([Span("foobar", trace_id=i + 1)])
+        writer.flush_queue(raise_exc=True)
+
+    assert writer._put.call_count == 14
+    # The first payload is sent alone until the agent accepts one
+    assert max_in_flight[0] == 1
+    assert max(max_in_flight) == 3
+
+
+def test_writer_concurrent_requests_error():
+    writer = AgentWriter(agent_url="http://localhost:9126", concurrent_requests=2, split_payload_traces=1)
+    writer._payload_accepted = True
+    last_attempt = tenacity.Future(1)
+    last_attempt.set_exception(OSError())
+    writer._retry_upload = mock.Mock(side_effect=[None, tenacity.RetryError(last_attempt), None])
+    for i in range(3):
+        writer._encoder.put([Span("foobar", trace_id=i + 1)])
+    with mock.patch.object(writer, "_metrics_reset"):
+        with pytest.raises(OSError):
+            writer.flush_queue(raise_exc=True)
+    assert writer._retry_upload.call_count == 3
+    assert writer._metrics["http.dropped.traces"]["count"] == 1
+
+
+def test_writer_concurrent_requests_workers():
+    writer = AgentWriter(agent_url="http://localhost:9126", concurrent_requests=3, split_payload_traces=1)
+    writer._payload_accepted = True
+    threads = set()
+
+    def put(data, headers):
+        threads.add(threading.current_thread().name)
+        time.sleep(0.01)
+        return Response(status=200)
+
+    writer._put = mock.Mock(side_effect=put)
+    try:
+        for _ in range(3):
+            for i in range(6):
+                writer._encoder.put([Span("foobar", trace_id=i + 1)])
+            writer.flush_queue(raise_exc=True)
+        # The same workers are used for all the flushes
+        assert len(writer._upload_workers._threads) == 2
+        assert threads <= {threading.current_thread().name} | {t.name for t in writer._upload_workers._threads}
+
+        # Unexpected exceptions raised in the workers are propagated
+        writer._put = mock.Mock(side_effect=put)
+        writer._upload_payload = mock.Mock(side_effect=[None, ValueError(), None, None])
+        for i in range(4):
+            writer._encoder.put([Span("foobar", trace_id=i + 1)])
+        with pytest.raises(ValueError):
+            writer.flush_queue(raise_exc=True)
+        assert writer._upload_payload.call_count == 4
+    finally:
+        writer._upload_workers.stop()
+    assert writer._upload_workers._threads == []
+
+
+def test_writer_concurrent_requests_invalid():
+    with pytest.raises(ValueError):
+        AgentWriter(agent_url="http://localhost:9126", concurrent_requests=0)
+
+
+@pytest.mark.parametrize("api_version", ["v0.4", "v0.5"])
+def test_writer_payload_segments(api_version):
+    server, thread = _make_server(_PAYLOAD_PORT, _PayloadAPIEndpointRequestHandlerTest)
+    try:
+        writer = AgentWriter(agent_url="http://%s:%s" % (_HOST, _PAYLOAD_PORT), api_version=api_version)
+        for i in range(10):
+            writer._encoder.put([Span("foobar", trace_id=i + 1, span_id=j + 1) for j in range(3)])
+        expected = writer._encoder.encode_segments()
+        for i in range(10):
+            writer._encoder.put([Span("foobar", trace_id=i + 1, span_id=j + 1) for j in range(3)])
+        writer.flush_queue(raise_exc=True)
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+    # The segments of the payload are sent as a whole request body
+    (headers, body), = _PayloadAPIEndpointRequestHandlerTest.payloads
+    del _PayloadAPIEndpointRequestHandlerTest.payloads[:]
+    assert "Transfer-Encoding" not in headers
+    assert headers["X-Datadog-Trace-Count"] == "10"
+    decoded = msgpack.unpackb(body, raw=False)
+    assert len(decoded[1] if api_version == "v0.5" else decoded) == 10
+    assert len(body) == sum(len(_) for _ in expected)
+
+
+def test_writer_otlp():
+    with OTLPCollector() as collector:
+        writer = AgentWriter(agent_url=collector.url, api_version="otlp", priority_sampler=mock.Mock())
+        assert writer._endpoint == "v1/traces"
+        assert isinstance(writer._encoder, OTLPEncoder)
+        for i in range(10):
+            writer._encoder.put([Span("foobar", service="otlp", trace_id=i + 1, span_id=j + 1) for j in range(3)])
+        writer.flush_queue(raise_exc=True)
+
+        ((method, path, headers, _),) = collector.requests
+        spans = collector.spans()
+
+    assert (method, path) == ("POST", "/v1/traces")
+    assert headers["Content-Type"] == "application/x-protobuf"
+    assert len(spans) == 30
+    assert all(resource["service.name"] == "otlp" for resource, _ in spans)
+    assert "http.dropped.traces" not in writer._metrics
+    # Collectors do not return sampling rates
+    writer._priority_sampler.update_rate_by_service_sample_rates.assert_not_called()
+
+
+def test_writer_otlp_split_payloads():
+    with OTLPCollector() as collector:
+        writer = AgentWriter(agent_url=collector.url, api_version="otlp", split_payload_traces=4)
+        for i in range(10):
+            writer._encoder.put([Span("foobar", trace_id=i + 1, span_id=j + 1) for j in range(3)])
+        writer.flush_queue(raise_exc=True)
+
+        assert [headers["X-Datadog-Trace-Count"] for _, _, headers, _ in collector.requests] == ["4", "4", "2"]
+        assert len(collector.spans()) == 30
+
+
+def test_writer_otlp_envvar(monkeypatch):
+    monkeypatch.setenv("DD_TRACE_API_VERSION", "otlp")
+    writer = AgentWriter(agent_url="http://localhost:4318")
+    assert writer._endpoint == "v1/traces"
+    assert isinstance(writer._encoder, OTLPEncoder)
+
+    writer = writer.recreate()
+    assert writer._endpoint == "v1/traces"
+    assert isinstance(writer._encoder, OTLPEncoder)
@@ -96,7 +96,12 @@ def override_global_config(values):
         "service",
         "_raise",
         "_trace_compute_stats",
+        "_trace_stats_max_keys",
         "_appsec_enabled",
+        "_128_bit_trace_id_enabled",
+        "_tail_sampling_enabled",
+        "_tail_sampling_rate_limit",
+        "_tail_sampling_latency_quantile",
     ]
 
     # Grab the current values of all keys
@@ -605,8 +610,9 @@ class TestSpan(Span):
         if exact:
             return self.get_tags() == meta
 
+        tags = self.get_tags()
         for key, value in meta.items():
-            if key not in self._meta:
+            if key not in tags:
                 return False
             if self.get_tag(key) != value:
                 return False
@@ -655,8 +661,9 @@ class TestSpan(Span):
         if exact:
             assert self.get_tags() == meta
         else:
+            tags = self.get_tags()
             for key, value in meta.items():
-                assert key in self._meta, "{0} meta does not have property {1!r}".format(self, key)
+                assert key in tags, "{0} meta does not have property {1!r}".format(self, key)
                 assert self.get_tag(key) == value, "{0} meta property {1!r}: {2!r} != {3!r}".format(
                     self, key, self.get_tag(key), value
                 )
@@ -677,12 +684,13 @@ class TestSpan(Span):
         :raises: AssertionError
         """
         if exact:
-            assert self._metrics == metrics
+            assert self.get_metrics() == metrics
         else:
+            span_metrics = self.get_metrics()
             for key, value in metrics.items():
-                assert key in self._metrics, "{0} metrics does not have property {1!r}".format(self, key)
-                assert self._metrics[key] == value, "{0} metrics property {1!r}: {2!r} != {3!r}".format(
-                    self, key, self._metrics[key], value
+                assert key in span_metrics, "{0} metrics does not have property {1!r}".format(self, key)
+                assert span_metrics[key] == value, "{0} metrics property {1!r}: {2!r} != {3!r}".format(
+                    self, key, span_metrics[key], value
                 )
 
 